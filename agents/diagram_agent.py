@@ -2,22 +2,18 @@
 DiagramAgent: Detects and generates diagrams for questions.
 """
 
-import json
-import re
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 from typing import Dict, Any
-
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from telemetry.tracing import span
+from llm.client import as_client
+from llm.schemas import DIAGRAM_SCHEMA
 
 
 class DiagramAgent:
     """Generates TikZ/PGFPlots diagrams for questions."""
     
-    def __init__(self):
-        self.model = genai.GenerativeModel("gemini-2.5-flash-lite")
+    def __init__(self, model=None):
+        # An LLMClient, or any object with generate_content() (e.g. a cassette replay model)
+        self.llm = as_client(model, "diagram")
     
     def generate_diagram(self, question: Dict[str, Any], topic_name: str) -> Dict[str, Any]:
         """Generate diagram code for a question if needed."""
@@ -41,21 +37,21 @@ class DiagramAgent:
         }}
         """
         
-        try:
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
+        with span("diagram", question_id=question.get("question_id")) as trace:
+            try:
+                diagram_info, _ = self.llm.generate_json(prompt, schema=DIAGRAM_SCHEMA)
+                if isinstance(diagram_info, dict):
+                    question["diagram_code"] = diagram_info.get("diagram_code", "")
+                    question["needs_python_diagram"] = diagram_info.get("needs_python_diagram", False)
+                    question["insert_position"] = diagram_info.get("insert_position", "below question")
+                    trace.set(outcome="python" if question["needs_python_diagram"] else "tikz")
+                    return question
+            except Exception as e:
+                print(f"DiagramAgent error: {e}")
+                trace.set(error=str(e))
             
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                diagram_info = json.loads(json_match.group())
-                question["diagram_code"] = diagram_info.get("diagram_code", "")
-                question["needs_python_diagram"] = diagram_info.get("needs_python_diagram", False)
-                question["insert_position"] = diagram_info.get("insert_position", "below question")
-                return question
-        except Exception as e:
-            print(f"DiagramAgent error: {e}")
-        
-        # Default: no diagram
-        question["diagram_code"] = ""
-        question["needs_python_diagram"] = False
-        return question
\ No newline at end of file
+            # Default: no diagram
+            trace.set(outcome="no_diagram")
+            question["diagram_code"] = ""
+            question["needs_python_diagram"] = False
+            return question
\ No newline at end of file
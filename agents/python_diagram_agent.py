@@ -4,28 +4,41 @@ PythonDiagramAgent: Generates complex diagrams using Python (matplotlib, etc.).
 
 import json
 import re
-import os
-import google.generativeai as genai
+import threading
 from pathlib import Path
-from dotenv import load_dotenv
 from typing import Dict, Any
+from telemetry.tracing import span
+from telemetry.metrics import PYTHON_DIAGRAM_FALLBACKS
+from llm.client import as_client
+from llm.cache import evict
 
-import matplotlib.pyplot as plt
-import matplotlib
-matplotlib.use('Agg')  # Non-interactive backend
-import numpy as np
+# pyplot keeps global figure state, so only one thread may draw at a time
+_PLOT_LOCK = threading.Lock()
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+_plotting = None
+
+
+def _load_plotting():
+    """Import matplotlib and numpy on the first diagram instead of at import time."""
+    global _plotting
+    with _PLOT_LOCK:
+        if _plotting is None:
+            import matplotlib
+            matplotlib.use('Agg')  # Non-interactive backend
+            import matplotlib.pyplot as plt
+            import numpy as np
+            _plotting = (plt, np)
+    return _plotting
 
 
 class PythonDiagramAgent:
     """Generates complex diagrams using Python (matplotlib, etc.)."""
     
-    def __init__(self, output_dir: str = "question_paper/images"):
+    def __init__(self, output_dir: str = "question_paper/images", model=None):
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.model = genai.GenerativeModel("gemini-2.5-flash-lite")
+        # An LLMClient, or any object with generate_content() (e.g. a cassette replay model)
+        self.llm = as_client(model, "python_diagram")
     
     def generate_diagram(self, question: Dict[str, Any], topic_name: str) -> Dict[str, Any]:
         """Generate a Python-based diagram and save it."""
@@ -51,36 +64,46 @@ class PythonDiagramAgent:
         Assume plt, np are imported.
         """
         
-        try:
-            response = self.model.generate_content(prompt)
-            code = response.text.strip()
+        plt, np = _load_plotting()
+        
+        with span("python_diagram", question_id=question_id) as trace:
+            response = None
+            try:
+                response = self.llm.generate(prompt)
+                code = response.text.strip()
             
-            # Extract code block
-            code_match = re.search(r'```python\n(.*?)\n```', code, re.DOTALL)
-            if code_match:
-                code = code_match.group(1)
+                # Extract code block
+                code_match = re.search(r'```python\n(.*?)\n```', code, re.DOTALL)
+                if code_match:
+                    code = code_match.group(1)
             
-            # Execute code safely
-            image_path = self.output_dir / f"diagram_{question_id.lower()}.png"
+                # Execute code safely
+                image_path = self.output_dir / f"diagram_{question_id.lower()}.png"
             
-            exec_globals = {'plt': plt, 'np': np}
-            # Append save if missing
-            if 'plt.savefig' not in code:
-                code += f'\nplt.savefig(r"{image_path}", dpi=300, bbox_inches="tight")\nplt.close()'
+                exec_globals = {'plt': plt, 'np': np}
+                # Append save if missing
+                if 'plt.savefig' not in code:
+                    code += f'\nplt.savefig(r"{image_path}", dpi=300, bbox_inches="tight")\nplt.close()'
             
-            exec(code, exec_globals)
+                with _PLOT_LOCK, span("matplotlib_exec", question_id=question_id):
+                    exec(code, exec_globals)
             
-            question["image_path"] = str(image_path)
-            return question
+                question["image_path"] = str(image_path)
+                return question
             
-        except Exception as e:
-            print(f"PythonDiagramAgent error: {e}")
-            # Placeholder image
-            fig, ax = plt.subplots(figsize=(6, 4))
-            ax.text(0.5, 0.5, f'Diagram for {question_id}', ha='center', va='center', fontsize=14)
-            ax.axis('off')
-            image_path = self.output_dir / f"diagram_{question_id.lower()}.png"
-            plt.savefig(str(image_path), dpi=300, bbox_inches='tight')
-            plt.close()
-            question["image_path"] = str(image_path)
-            return question
\ No newline at end of file
+            except Exception as e:
+                print(f"PythonDiagramAgent error: {e}")
+                trace.set(outcome="placeholder", error=str(e))
+                PYTHON_DIAGRAM_FALLBACKS.inc()
+                evict(response)  # Code that failed to run should be regenerated next time
+                # Placeholder image
+                image_path = self.output_dir / f"diagram_{question_id.lower()}.png"
+                with _PLOT_LOCK:
+                    plt.close('all')  # Discard any half-drawn figure from the failed code
+                    fig, ax = plt.subplots(figsize=(6, 4))
+                    ax.text(0.5, 0.5, f'Diagram for {question_id}', ha='center', va='center', fontsize=14)
+                    ax.axis('off')
+                    plt.savefig(str(image_path), dpi=300, bbox_inches='tight')
+                    plt.close()
+                question["image_path"] = str(image_path)
+                return question
\ No newline at end of file
@@ -2,22 +2,21 @@
 QuestionFramerAgent: Converts question ideas into fully framed MCQs with 4 options.
 """
 
-import json
 import re
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 from typing import Dict, Any
-
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from telemetry.tracing import span
+from telemetry.metrics import FRAMER_JSON_PARSE_FAILURES
+from llm.client import as_client, LLMJSONError
+from llm.cache import evict
+from llm.schemas import FRAMER_SCHEMA
 
 
 class QuestionFramerAgent:
     """Converts question ideas into fully framed MCQs with 4 options."""
     
-    def __init__(self):
-        self.model = genai.GenerativeModel("gemini-2.5-flash-lite")
+    def __init__(self, model=None):
+        # An LLMClient, or any object with generate_content() (e.g. a cassette replay model)
+        self.llm = as_client(model, "framer")
     
     def frame_question(self, idea: str, topic_name: str, class_level: str, question_id: str, 
                       difficulty_target: str = "intermediate") -> Dict[str, Any]:
@@ -25,8 +24,11 @@ class QuestionFramerAgent:
         max_attempts = 3
         
         for attempt in range(max_attempts):
-            try:
-                prompt = f"""
+            with span("frame_attempt", question_id=question_id, attempt=attempt + 1,
+                      difficulty=difficulty_target) as trace:
+                response = None
+                try:
+                    prompt = f"""
                 Convert this question idea into a complete MCQ:
                 
                 Idea: {idea}
@@ -53,80 +55,71 @@ class QuestionFramerAgent:
                 }}
                 """
                 
-                response = self.model.generate_content(prompt)
-                result_text = response.text.strip()
-                
-                # Remove markdown code blocks if present
-                result_text = re.sub(r'```json\s*', '', result_text)
-                result_text = re.sub(r'```\s*', '', result_text)
-                
-                # Extract JSON - try multiple patterns
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', result_text, re.DOTALL)
-                if not json_match:
-                    # Try more aggressive pattern
-                    json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-                
-                if json_match:
-                    try:
-                        question = json.loads(json_match.group())
-                        
-                        # Validate the question structure
-                        if not isinstance(question, dict):
-                            raise ValueError("Question is not a dictionary")
-                        
-                        # Check for required fields
-                        if "question_text" not in question or not question["question_text"]:
-                            raise ValueError("Missing or empty question_text")
-                        
-                        if "options" not in question or not isinstance(question["options"], list):
-                            raise ValueError("Missing or invalid options")
-                        
-                        # Check if it's a fallback/sample question
-                        question_text_lower = question.get("question_text", "").lower()
-                        if "sample question" in question_text_lower or "option 1" in question_text_lower:
-                            raise ValueError("Detected fallback/sample question")
-                        
-                        # Ensure exactly 4 options
-                        options = question.get("options", [])
-                        if len(options) < 4:
-                            # Pad with placeholder if needed
-                            while len(options) < 4:
-                                options.append("N/A")
-                            question["options"] = options
-                        elif len(options) > 4:
-                            question["options"] = options[:4]
-                        
-                        # Clean options - remove labels if present
-                        cleaned_options = []
-                        for opt in question["options"]:
-                            opt_str = str(opt).strip()
-                            # Remove leading labels like "A.", "A)", "A:", etc.
-                            opt_str = re.sub(r'^[A-D][\.\)\:\s]+', '', opt_str, flags=re.IGNORECASE)
-                            cleaned_options.append(opt_str)
-                        question["options"] = cleaned_options
-                        
-                        # Ensure correct_option is valid
-                        if "correct_option" not in question or question["correct_option"] not in ["A", "B", "C", "D"]:
-                            question["correct_option"] = "A"
-                        
-                        question["question_id"] = question_id
-                        question["difficulty"] = difficulty_target
-                        question.setdefault("needs_diagram", False)
-                        
-                        return question
-                    except json.JSONDecodeError as e:
-                        print(f"QuestionFramerAgent JSON decode error (attempt {attempt + 1}/{max_attempts}): {e}")
-                        if attempt < max_attempts - 1:
-                            continue
-                    except ValueError as e:
-                        print(f"QuestionFramerAgent validation error (attempt {attempt + 1}/{max_attempts}): {e}")
-                        if attempt < max_attempts - 1:
-                            continue
+                    question, response = self.llm.generate_json(prompt, pattern=(
+                        r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}',
+                        r'\{.*\}',  # More aggressive fallback
+                    ), schema=FRAMER_SCHEMA)
+                    
+                    # Validate the question structure
+                    if not isinstance(question, dict):
+                        raise ValueError("Question is not a dictionary")
+                    
+                    # Check for required fields
+                    if "question_text" not in question or not question["question_text"]:
+                        raise ValueError("Missing or empty question_text")
+                    
+                    if "options" not in question or not isinstance(question["options"], list):
+                        raise ValueError("Missing or invalid options")
+                    
+                    # Check if it's a fallback/sample question
+                    question_text_lower = question.get("question_text", "").lower()
+                    if "sample question" in question_text_lower or "option 1" in question_text_lower:
+                        raise ValueError("Detected fallback/sample question")
+                    
+                    # Ensure exactly 4 options
+                    options = question.get("options", [])
+                    if len(options) < 4:
+                        # Pad with placeholder if needed
+                        while len(options) < 4:
+                            options.append("N/A")
+                        question["options"] = options
+                    elif len(options) > 4:
+                        question["options"] = options[:4]
+                    
+                    # Clean options - remove labels if present
+                    cleaned_options = []
+                    for opt in question["options"]:
+                        opt_str = str(opt).strip()
+                        # Remove leading labels like "A.", "A)", "A:", etc.
+                        opt_str = re.sub(r'^[A-D][\.\)\:\s]+', '', opt_str, flags=re.IGNORECASE)
+                        cleaned_options.append(opt_str)
+                    question["options"] = cleaned_options
+                    
+                    # Ensure correct_option is valid
+                    if "correct_option" not in question or question["correct_option"] not in ["A", "B", "C", "D"]:
+                        question["correct_option"] = "A"
+                    
+                    question["question_id"] = question_id
+                    question["difficulty"] = difficulty_target
+                    question.setdefault("needs_diagram", False)
+                    
+                    return question
                 
-            except Exception as e:
-                print(f"QuestionFramerAgent error (attempt {attempt + 1}/{max_attempts}): {e}")
-                if attempt < max_attempts - 1:
-                    continue
+                except LLMJSONError as e:
+                    # generate_json already dropped the reply from the cache, so a retry asks afresh
+                    print(f"QuestionFramerAgent JSON decode error (attempt {attempt + 1}/{max_attempts}): {e}")
+                    trace.set(outcome=e.kind, error=str(e))
+                    FRAMER_JSON_PARSE_FAILURES.inc()
+                except ValueError as e:
+                    print(f"QuestionFramerAgent validation error (attempt {attempt + 1}/{max_attempts}): {e}")
+                    trace.set(outcome="invalid", error=str(e))
+                    evict(response)  # Don't let the retry replay the same cached output
+                except Exception as e:
+                    print(f"QuestionFramerAgent error (attempt {attempt + 1}/{max_attempts}): {e}")
+                    trace.set(outcome="error", error=str(e))
+                    # API errors were already retried (with backoff) by the model's retry policy;
+                    # only unusable responses are worth another attempt here
+                    break
         
         # If all attempts failed, raise an exception instead of returning fallback
         raise ValueError(f"Failed to generate question after {max_attempts} attempts for idea: {idea[:50]}...")
\ No newline at end of file
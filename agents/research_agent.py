@@ -2,26 +2,188 @@
 ResearchAgent: Searches internet for creative, thought-provoking question ideas.
 """
 
-import json
-import re
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
+import math
+import queue
+import threading
+from typing import Iterator, List, Optional
+from telemetry.tracing import span
+from llm.client import as_client, LLMJSONError
+from llm.json_stream import JSONArrayStream
+from llm.schemas import RESEARCH_SCHEMA
 
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+
+# Larger research needs are split into calls of at most this many ideas, run in parallel
+MAX_IDEAS_PER_CALL = 40
+MAX_PARALLEL_CALLS = 4
+
+# Each parallel call of one round gets its own angle, so the calls don't return the same ideas
+FOCUS_AREAS = [
+    "Higher-order thinking questions",
+    "Application-based problems",
+    "Conceptual understanding",
+    "Problem-solving scenarios",
+]
+
+
+def split_topic(topic_name: str) -> List[str]:
+    """Subtopics of a compound topic such as "Congruence of Triangles, AREA AND PERIMETER".
+    
+    Splits on commas, semicolons and slashes only, so "Area and Perimeter" stays one subtopic, and
+    only outside brackets, so "Numbers (1,000 to 10,000)" does too. A topic with no separators
+    comes back as a single subtopic.
+    """
+    parts, depth, start = [], 0, 0
+    for i, c in enumerate(topic_name):
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth = max(0, depth - 1)
+        elif c in ",;/" and depth == 0:
+            parts.append(topic_name[start:i])
+            start = i + 1
+    parts.append(topic_name[start:])
+    
+    subtopics = []
+    for part in parts:
+        part = " ".join(part.split())
+        if part and part.lower() not in [s.lower() for s in subtopics]:
+            subtopics.append(part)
+    return subtopics or [topic_name]
 
 
 class ResearchAgent:
     """Searches internet for creative, thought-provoking question ideas."""
     
-    def __init__(self):
-        self.model = genai.GenerativeModel("gemini-2.5-flash-lite")  # Updated to stable model
+    def __init__(self, model=None):
+        # An LLMClient, or any object with generate_content() (e.g. a cassette replay model)
+        self.llm = as_client(model, "research")
+    
+    def generate_ideas(self, topic_name: str, class_level: str, count: Optional[int] = None,
+                       focus: Optional[str] = None) -> dict:
+        """Generate question ideas for the given topic and class level (40-50 unless count is given)."""
+        prompt = self._prompt(topic_name, class_level, count, focus)
+        
+        with span("research", topic=topic_name, class_level=class_level, requested=count) as trace:
+            try:
+                result, _ = self.llm.generate_json(prompt, schema=RESEARCH_SCHEMA)
+                trace.set(ideas=len(result.get("ideas", [])))
+                return result
+            except LLMJSONError as e:
+                if e.kind == "no_json":
+                    # Last resort
+                    trace.set(outcome="no_json")
+                    return {"topic": topic_name, "class_level": class_level, "ideas": []}
+                print(f"ResearchAgent error: {e}")
+                trace.set(outcome="fallback", error=str(e))
+            except Exception as e:
+                print(f"ResearchAgent error: {e}")
+                trace.set(outcome="fallback", error=str(e))
+            
+            # Fallback: Generate minimal ideas
+            return {
+                "topic": topic_name,
+                "class_level": class_level,
+                "ideas": self._fallback_ideas(topic_name, count)
+            }
+    
+    def stream_ideas(self, topic_name: str, class_level: str, count: Optional[int] = None,
+                     focus: Optional[str] = None) -> Iterator[List[str]]:
+        """Like generate_ideas(), but yields batches of ideas as the reply streams in."""
+        prompt = self._prompt(topic_name, class_level, count, focus)
+        parser = JSONArrayStream("ideas")
+        requested, count = count, 0
+        
+        with span("research", topic=topic_name, class_level=class_level, requested=requested,
+                  streamed=True) as trace:
+            stream = self.llm.generate_stream(prompt)
+            try:
+                for chunk in stream:
+                    ideas = parser.feed(chunk)
+                    if ideas:
+                        count += len(ideas)
+                        yield ideas
+                ideas = parser.feed("", final=True)  # A last idea cut off by the end of a truncated reply
+                if ideas:
+                    count += len(ideas)
+                    yield ideas
+                trace.set(ideas=count, outcome="ok" if parser.started else "no_json")
+            except Exception as e:
+                print(f"ResearchAgent error: {e}")
+                trace.set(ideas=count, outcome="fallback" if not count else "partial", error=str(e))
+                if not count:
+                    yield self._fallback_ideas(topic_name, requested)
+            finally:
+                stream.close()
     
-    def generate_ideas(self, topic_name: str, class_level: str) -> dict:
-        """Generate question ideas for the given topic and class level."""
-        prompt = f"""
-        Research and collect 40-50 creative question ideas for the topic: "{topic_name}"
+    def research(self, topic_name: str, class_level: str, count: int, stream: bool = False,
+                 max_per_call: int = MAX_IDEAS_PER_CALL) -> Iterator[List[str]]:
+        """Research about `count` ideas, yielding batches as they arrive.
+        
+        Up to max_per_call ideas come from a single call. More are split evenly over calls
+        running in parallel (MAX_PARALLEL_CALLS at a time), each with its own focus, so a large
+        worksheet does not wait on one giant reply. stream uses stream_ideas() for every call.
+        """
+        parts = max(1, math.ceil(count / max_per_call))
+        if parts == 1:
+            yield from self._research_call(topic_name, class_level, count, None, stream)
+            return
+        
+        batches = queue.Queue()
+        stop = threading.Event()
+        todo = queue.Queue()
+        for i in range(parts):
+            size = count // parts + (1 if i < count % parts else 0)
+            todo.put((size, f"{FOCUS_AREAS[i % len(FOCUS_AREAS)]} (idea set {i + 1} of {parts})"))
+        
+        def worker():
+            try:
+                while not stop.is_set():
+                    try:
+                        size, focus = todo.get_nowait()
+                    except queue.Empty:
+                        break
+                    call = self._research_call(topic_name, class_level, size, focus, stream)
+                    try:
+                        for batch in call:
+                            if stop.is_set():
+                                break
+                            batches.put(batch)
+                    finally:
+                        call.close()
+            finally:
+                batches.put(None)  # Even when a call raises, or the reader would wait for this worker forever
+        
+        workers = min(parts, MAX_PARALLEL_CALLS)
+        for i in range(workers):
+            threading.Thread(target=worker, name=f"qpg-research-{i}", daemon=True).start()
+        try:
+            finished = 0
+            while finished < workers:
+                batch = batches.get()
+                if batch is None:
+                    finished += 1
+                else:
+                    yield batch
+        finally:
+            # Closed early (e.g. the run is complete): calls not started yet are skipped
+            stop.set()
+    
+    def _research_call(self, topic_name: str, class_level: str, count: int, focus: Optional[str],
+                       stream: bool) -> Iterator[List[str]]:
+        if stream:
+            yield from self.stream_ideas(topic_name, class_level, count, focus)
+        else:
+            yield self.generate_ideas(topic_name, class_level, count, focus).get("ideas", [])
+    
+    @staticmethod
+    def _fallback_ideas(topic_name: str, count: Optional[int] = None) -> List[str]:
+        return [f"Idea {i}: Sample for {topic_name}" for i in range(count or 40)]
+    
+    @staticmethod
+    def _prompt(topic_name: str, class_level: str, count: Optional[int] = None, focus: Optional[str] = None) -> str:
+        emphasis = f"\n        Above all, focus on: {focus}\n        " if focus else ""
+        return f"""
+        Research and collect {count or "40-50"} creative question ideas for the topic: "{topic_name}"
         Suitable for: {class_level}
         
         Focus on:
@@ -29,7 +191,7 @@ class ResearchAgent:
         - Application-based problems
         - Conceptual understanding
         - Problem-solving scenarios
-        
+        {emphasis}
         Return ONLY a valid JSON object in this format:
         {{
             "topic": "{topic_name}",
@@ -43,23 +205,3 @@ class ResearchAgent:
             ]
         }}
         """
-        
-        try:
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
-            
-            # Robust JSON extraction with regex
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-        except Exception as e:
-            print(f"ResearchAgent error: {e}")
-            # Fallback: Generate minimal ideas
-            return {
-                "topic": topic_name,
-                "class_level": class_level,
-                "ideas": [f"Idea {i}: Sample for {topic_name}" for i in range(40)]
-            }
-        
-        # Last resort
-        return {"topic": topic_name, "class_level": class_level, "ideas": []}
\ No newline at end of file
@@ -3,21 +3,20 @@ ValidatorAgent: Validates questions for mathematical soundness and correctness.
 """
 
 import json
-import re
-import os
-import google.generativeai as genai
-from dotenv import load_dotenv
 from typing import Tuple, Optional, Dict, Any
-
-load_dotenv()
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+from telemetry.metrics import VALIDATION_REJECTIONS, VALIDATION_CORRECTIONS, VALIDATION_EARLY_ACCEPTS
+from llm.client import as_client, LLMJSONError
+from llm.schemas import VALIDATOR_SCHEMA
 
 
 class ValidatorAgent:
     """Validates questions for mathematical soundness and correctness."""
     
-    def __init__(self):
-        self.model = genai.GenerativeModel("gemini-2.5-flash-lite")
+    def __init__(self, model=None, stream: bool = False):
+        # An LLMClient, or any object with generate_content() (e.g. a cassette replay model)
+        self.llm = as_client(model, "validator")
+        # Stream verdicts and stop reading at "is_valid": true; feedback is only needed to fix a question
+        self.stream = stream
     
     def validate(self, question: Dict[str, Any], topic_name: str, class_level: str) -> Tuple[bool, str, Optional[Dict]]:
         """Validate a question. Returns (is_valid, feedback, corrected_question)."""
@@ -47,13 +46,15 @@ class ValidatorAgent:
         """
         
         try:
-            response = self.model.generate_content(prompt)
-            result_text = response.text.strip()
-            
-            # Extract JSON
-            json_match = re.search(r'\{.*\}', result_text, re.DOTALL)
-            if json_match:
-                validation = json.loads(json_match.group())
+            if self.stream:
+                validation, stopped_early = self.llm.stream_json(
+                    prompt, lambda partial: partial.get("is_valid") is True, schema=VALIDATOR_SCHEMA)
+                if stopped_early:
+                    VALIDATION_EARLY_ACCEPTS.inc()
+                    validation.setdefault("feedback", "Accepted as soon as the streamed verdict arrived")
+            else:
+                validation, _ = self.llm.generate_json(prompt, schema=VALIDATOR_SCHEMA)
+            if isinstance(validation, dict):
                 is_valid = validation.get("is_valid", False)
                 feedback = validation.get("feedback", "")
                 corrections = validation.get("suggested_corrections")
@@ -61,11 +62,16 @@ class ValidatorAgent:
                 if is_valid:
                     return True, feedback, None
                 else:
+                    VALIDATION_REJECTIONS.inc()
                     if corrections:
+                        VALIDATION_CORRECTIONS.inc()
                         corrected = question.copy()
                         corrected.update(corrections)
                         return False, feedback, corrected
                     return False, feedback, None
+        except LLMJSONError as e:
+            # Unparseable verdicts are dropped from the cache by generate_json
+            print(f"ValidatorAgent could not parse verdict: {e}")
         except Exception as e:
             print(f"ValidatorAgent error: {e}")
         
@@ -0,0 +1,74 @@
+"""
+Time-to-first-question benchmark: research read whole vs streamed with --stream-research.
+
+Generates the same paper against the fake backend (which streams a reply over its latency, the
+first chunk after llm.fake.TIME_TO_FIRST_CHUNK of it) once waiting for the whole research reply
+and once framing from the first idea that arrives, and reports seconds until the first question
+starts framing, until the first question is written, and for the whole run.
+
+    python benchmarks/bench_first_question.py
+    python benchmarks/bench_first_question.py --latency 2.0 --runs 5
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.fake import FakeBackend  # noqa: E402
+from main import QuestionPaperGenerator  # noqa: E402
+
+
+def run(stream: bool, count: int, latency: float, seed: int) -> dict:
+    backend = FakeBackend(seed=seed, latency_mean=latency, latency_jitter=0.3)
+    generator = QuestionPaperGenerator(tempfile.mkdtemp(prefix="bench_first_"), model_factory=backend.model_for,
+                                       stream_research=stream)
+    marks = {}
+    started = time.perf_counter()
+    
+    def timed(name, method):
+        def wrapper(*args, **kwargs):
+            result = method(*args, **kwargs)
+            marks.setdefault(name, time.perf_counter() - started)
+            return result
+        return wrapper
+    
+    generator._next_job = timed("first_job", generator._next_job)
+    generator._accept_question = timed("first_question", generator._accept_question)
+    with contextlib.redirect_stdout(io.StringIO()):
+        generator.generate("Fractions", "Class 6", count)
+    marks["total"] = time.perf_counter() - started
+    return marks
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare time to first question with and without streamed research.")
+    parser.add_argument("--count", type=int, default=3, help="Questions per paper (default: 3)")
+    parser.add_argument("--latency", type=float, default=1.0, help="Mean fake LLM latency in seconds (default: 1.0)")
+    parser.add_argument("--runs", type=int, default=3, help="Papers per mode (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    results = {}
+    for stream in (False, True):
+        runs = [run(stream, args.count, args.latency, args.seed + i) for i in range(args.runs)]
+        results[stream] = {name: statistics.mean(r[name] for r in runs) for name in ("first_job", "first_question", "total")}
+    
+    print(f"{'mode':<8} {'first job s':>12} {'first question s':>17} {'total s':>8}")
+    for stream, marks in results.items():
+        mode = "stream" if stream else "full"
+        print(f"{mode:<8} {marks['first_job']:>12.2f} {marks['first_question']:>17.2f} {marks['total']:>8.2f}")
+    
+    full, streamed = results[False]["first_question"], results[True]["first_question"]
+    print(f"\nFirst question written {full - streamed:.2f}s sooner with streamed research "
+          f"({full:.2f}s -> {streamed:.2f}s, {1 - streamed / full:.0%} faster)")
+
+
+if __name__ == "__main__":
+    main()
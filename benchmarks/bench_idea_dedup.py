@@ -0,0 +1,177 @@
+"""
+Idea dedup benchmark: quality and cost of dropping near-duplicate research ideas (pipeline/minhash.py).
+
+Three parts:
+  - precision and recall per threshold on benchmarks/corpora/research_idea_duplicates.jsonl, real
+    research ideas labeled with paraphrase groups and hard negatives ("Perimeter of composite
+    shapes" / "Area of composite shapes"); an idea counts as a duplicate when its group came earlier
+  - seconds to dedup growing numbers of ideas with MinHash/LSH vs comparing every pair, for varied
+    synthetic ideas (built from word lists, 10% of them reordered copies) and for the fake backend's
+    templated ideas (10% reworded), which share most of their words: the index stays near-linear on
+    both while pairwise checks grow quadratically
+  - a worksheet against a fake backend that rewords some of its ideas, with and without dedup,
+    counting framer calls spent on reworded ideas
+    
+    python benchmarks/bench_idea_dedup.py
+    python benchmarks/bench_idea_dedup.py --sizes 1000 4000 16000 --brute-force-max 4000
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.fake import FakeBackend  # noqa: E402
+from main import QuestionPaperGenerator  # noqa: E402
+from pipeline.minhash import MinHashIndex, jaccard, shingles  # noqa: E402
+
+CORPUS = Path(__file__).resolve().parent / "corpora" / "research_idea_duplicates.jsonl"
+
+
+def corpus_scores(threshold: float) -> dict:
+    rows = [json.loads(line) for line in CORPUS.read_text(encoding="utf-8").splitlines() if line.strip()]
+    index = MinHashIndex(threshold)
+    seen_groups = set()
+    tp = fp = fn = 0
+    for row in rows:
+        dropped = index.add(row["idea"]) is not None
+        duplicate = row["group"] in seen_groups
+        seen_groups.add(row["group"])
+        tp += dropped and duplicate
+        fp += dropped and not duplicate
+        fn += duplicate and not dropped
+    return {
+        "precision": tp / (tp + fp) if tp + fp else 1.0,
+        "recall": tp / (tp + fn) if tp + fn else 1.0,
+        "dropped": tp + fp,
+        "duplicates": tp + fn,
+    }
+
+
+_VERBS = ["Find", "Compare", "Estimate", "Explain", "Prove", "Measure", "Sketch", "Predict", "Check", "Design"]
+_QUANTITIES = ["area", "perimeter", "volume", "angle", "ratio", "percentage", "speed", "cost", "height",
+               "distance", "fraction", "average", "probability", "scale", "weight", "time"]
+_OBJECTS = ["triangle", "rectangle", "circle", "trapezium", "cuboid", "cylinder", "garden", "ladder", "tank",
+            "map", "recipe", "train", "bicycle", "kite", "roof", "pizza", "fence", "road", "clock", "flag"]
+_CONTEXTS = ["school fair", "farm", "cricket match", "bakery", "river crossing", "city park", "science lab",
+             "train journey", "shopping mall", "festival", "hospital", "library", "swimming pool",
+             "construction site", "bus route", "kitchen", "museum", "stadium", "village well", "art class"]
+_EXTRAS = ["with fractions", "in metres", "using a table", "from a graph", "with a twist", "in two steps",
+           "with estimation", "using algebra", "with a diagram", "in rupees", "for a group", "over a week"]
+
+
+def synthetic_ideas(count: int, duplicate_rate: float, seed: int) -> list:
+    rng = random.Random(seed)
+    ideas = []
+    for _ in range(count):
+        if ideas and rng.random() < duplicate_rate:
+            words = rng.choice(ideas).split()
+            rng.shuffle(words)
+            ideas.append(" ".join(words))
+        else:
+            ideas.append(f"{rng.choice(_VERBS)} the {rng.choice(_QUANTITIES)} of a {rng.choice(_OBJECTS)} at the "
+                         f"{rng.choice(_CONTEXTS)} {rng.choice(_EXTRAS)}")
+    return ideas
+
+
+def fake_ideas(count: int, duplicate_rate: float, seed: int) -> list:
+    backend = FakeBackend(seed=seed, duplicate_rate=duplicate_rate)
+    prompt = f'Research and collect {count} creative question ideas for the topic: "Fractions"\nSuitable for: Class 7'
+    return json.loads(backend._research_text(prompt, random.Random(seed)))["ideas"]
+
+
+def dedup_lsh(ideas: list, threshold: float) -> int:
+    index = MinHashIndex(threshold)
+    return sum(index.add(idea) is not None for idea in ideas)
+
+
+def dedup_brute_force(ideas: list, threshold: float) -> int:
+    kept = []
+    dropped = 0
+    for idea in ideas:
+        words = shingles(idea)
+        if words and any(jaccard(words, other) >= threshold for other in kept):
+            dropped += 1
+        else:
+            kept.append(words)
+    return dropped
+
+
+def pipeline_run(threshold: float, count: int, duplicate_rate: float, seed: int) -> dict:
+    backend = FakeBackend(seed=seed, duplicate_rate=duplicate_rate)
+    reworded = {"framer": 0}
+    respond = backend.respond
+    
+    def counting_respond(agent_name, prompt, **kwargs):
+        if agent_name == "framer" and "Idea: In a real-life setting" in prompt:
+            reworded["framer"] += 1
+        return respond(agent_name, prompt, **kwargs)
+    
+    backend.respond = counting_respond
+    generator = QuestionPaperGenerator(tempfile.mkdtemp(prefix="bench_dedup_"), model_factory=backend.model_for,
+                                       idea_dedup_threshold=threshold)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(generator.generate_async("Fractions", "Class 7", count, 6))
+    calls = backend.stats["calls"]
+    return {
+        "questions": result["total_questions"],
+        "framer": calls.get("framer", 0),
+        "validator": calls.get("validator", 0),
+        "reworded_framed": reworded["framer"],
+        "reworded_researched": backend.stats["duplicates"],
+        "total": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure near-duplicate idea detection.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 2000, 4000, 8000])
+    parser.add_argument("--brute-force-max", type=int, default=4000,
+                        help="Largest size also timed with pairwise comparison (default: 4000)")
+    parser.add_argument("--count", type=int, default=25, help="Questions in the pipeline run (default: 25)")
+    parser.add_argument("--duplicate-rate", type=float, default=0.3,
+                        help="Share of fake research ideas that reword an earlier one (default: 0.3)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(f"Labeled corpus ({CORPUS.name}):")
+    print("threshold  precision  recall  dropped/duplicates")
+    for threshold in args.thresholds:
+        r = corpus_scores(threshold)
+        print(f"{threshold:9.2f}  {r['precision']:9.2f}  {r['recall']:6.2f}  {r['dropped']:>7}/{r['duplicates']}")
+    
+    for name, make_ideas in (("synthetic", synthetic_ideas), ("fake backend", fake_ideas)):
+        print(f"\nDedup time ({name} ideas, 10% duplicates, threshold 0.8):")
+        print("  ideas  dropped  lsh s  pairwise s")
+        for size in args.sizes:
+            ideas = make_ideas(size, 0.1, args.seed)
+            started = time.perf_counter()
+            dropped = dedup_lsh(ideas, 0.8)
+            lsh = time.perf_counter() - started
+            brute = "-"
+            if size <= args.brute_force_max:
+                started = time.perf_counter()
+                brute_dropped = dedup_brute_force(ideas, 0.8)
+                brute = f"{time.perf_counter() - started:.2f}" + ("" if brute_dropped == dropped else f" ({brute_dropped} dropped)")
+            print(f"{size:>7}  {dropped:>7}  {lsh:5.2f}  {brute:>10}")
+    
+    print(f"\nPipeline ({args.count} questions, {args.duplicate_rate:.0%} of researched ideas reworded):")
+    for threshold in (0.0, 0.8):
+        r = pipeline_run(threshold, args.count, args.duplicate_rate, args.seed)
+        print(f"dedup {'off' if not threshold else threshold}: {r['questions']} questions, {r['framer']} framer and "
+              f"{r['validator']} validator calls, {r['reworded_framed']} framed from reworded ideas "
+              f"({r['reworded_researched']} researched), {r['total']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
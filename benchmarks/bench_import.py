@@ -0,0 +1,132 @@
+"""
+Start-up benchmark: how long `main.py --from-json` takes before it can write LaTeX.
+
+Each measurement runs in a fresh interpreter, so it includes every import main.py triggers.
+Reports the bare `import main`, a full JSON -> LaTeX run, and (when the packages are installed)
+the cost of the heavy dependencies that used to load eagerly: google.generativeai,
+matplotlib.pyplot and numpy. Exits non-zero if the --from-json path imports any of them.
+
+    python benchmarks/bench_import.py
+    python benchmarks/bench_import.py --repeats 10 --questions 100
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ["google.generativeai", "matplotlib", "matplotlib.pyplot", "numpy"]
+
+# Runs main.py as the CLI would, then reports which heavy modules ended up loaded
+FROM_JSON_DRIVER = """
+import json, runpy, sys
+root, heavy = sys.argv.pop(1), json.loads(sys.argv.pop(1))
+sys.path.insert(0, root)
+runpy.run_path(root + "/main.py", run_name="__main__")
+sys.stderr.write("LOADED=" + json.dumps([m for m in heavy if m in sys.modules]) + "\\n")
+"""
+
+
+def write_sample_json(path: Path, count: int):
+    """A question data JSON in the format generate() writes, without diagrams."""
+    questions = [
+        {
+            "question_id": f"Q{i:02d}",
+            "question_text": f"What is ${i} + {i}$?",
+            "options": [str(2 * i), str(2 * i + 1), str(i), str(i * i)],
+            "correct_option": "A",
+            "difficulty": "basic",
+            "needs_diagram": False,
+        }
+        for i in range(1, count + 1)
+    ]
+    data = {"topic": "Addition", "class_level": "Class 6", "questions": questions}
+    path.write_text(json.dumps(data, indent=2), encoding='utf-8')
+
+
+def time_command(args: list, cwd: str) -> tuple:
+    """Run a fresh interpreter and return (seconds, completed process)."""
+    started = time.perf_counter()
+    completed = subprocess.run(args, cwd=cwd, capture_output=True, text=True)
+    return time.perf_counter() - started, completed
+
+
+def measure(name: str, args: list, cwd: str, repeats: int) -> dict:
+    """Best and median wall time over several runs; None if the command fails."""
+    timings = []
+    completed = None
+    for _ in range(repeats):
+        seconds, completed = time_command(args, cwd)
+        if completed.returncode != 0:
+            print(f"   ⚠️  {name}: exited with {completed.returncode}")
+            print("      " + (completed.stderr.strip().splitlines() or ["(no output)"])[-1])
+            return None
+        timings.append(seconds)
+    result = {"best_ms": round(min(timings) * 1000, 1), "median_ms": round(statistics.median(timings) * 1000, 1)}
+    print(f"   {name:<32} best {result['best_ms']:>8.1f} ms   median {result['median_ms']:>8.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Start-up time of the --from-json path.")
+    parser.add_argument("--repeats", type=int, default=5, help="Fresh interpreters per measurement (default: 5)")
+    parser.add_argument("--questions", type=int, default=25, help="Questions in the sample JSON (default: 25)")
+    parser.add_argument("--output", type=str, help="Also write the results JSON here")
+    args = parser.parse_args()
+    
+    results = {"settings": {"repeats": args.repeats, "questions": args.questions, "python": sys.version.split()[0]}}
+    print(f"⏱️  Start-up benchmark ({args.repeats} runs each)...")
+    
+    results["python_baseline"] = measure("python -c pass", [sys.executable, "-c", "pass"], str(ROOT), args.repeats)
+    results["import_main"] = measure("import main", [sys.executable, "-c", "import main"], str(ROOT), args.repeats)
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp) / "questions.json"
+        write_sample_json(json_path, args.questions)
+        
+        # generate_from_json writes to ./question_paper, so run from the scratch directory
+        cli = [sys.executable, "-c", FROM_JSON_DRIVER, str(ROOT), json.dumps(HEAVY_MODULES),
+               "Addition", "Class 6", "--from-json", str(json_path)]
+        results["from_json"] = measure("main.py --from-json", cli, tmp, args.repeats)
+        _, completed = time_command(cli, tmp)
+        loaded = []
+        for line in completed.stderr.splitlines():
+            if line.startswith("LOADED="):
+                loaded = json.loads(line[len("LOADED="):])
+        results["heavy_modules_loaded"] = loaded
+    
+    # What every run used to pay up front, whatever the mode
+    eager = {}
+    for module in ["google.generativeai", "matplotlib.pyplot", "numpy"]:
+        eager[module] = measure(f"import {module}", [sys.executable, "-c", f"import {module}"], str(ROOT), args.repeats)
+    results["eager_dependencies"] = eager
+    
+    if all(eager.values()) and results["from_json"]:
+        combined = measure("eager reference (all + main)",
+                           [sys.executable, "-c", "import google.generativeai, matplotlib, numpy; "
+                                                  "matplotlib.use('Agg'); import matplotlib.pyplot; import main"],
+                           str(ROOT), args.repeats)
+        results["eager_reference"] = combined
+        if combined:
+            ratio = results["from_json"]["best_ms"] / combined["best_ms"]
+            print(f"\n📉 --from-json now takes {ratio:.0%} of the eager-import start-up time")
+    else:
+        print("\n⚠️  Some heavy dependencies are not installed; skipping the eager-import comparison")
+    
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2), encoding='utf-8')
+    
+    if results["heavy_modules_loaded"]:
+        print(f"\n❌ --from-json imported heavy modules: {', '.join(results['heavy_modules_loaded'])}")
+        sys.exit(1)
+    print("\n✅ --from-json loaded none of: " + ", ".join(HEAVY_MODULES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+JSON repair benchmark: framer retries avoided by the repairing parser.
+
+Feeds recorded bad framer responses (benchmarks/corpora/framer_bad_responses.jsonl) plus
+malformed replies from the fake backend to QuestionFramerAgent, answering any retry with a good
+response, and compares the calls it needs with the strict regex + json.loads parsing the agents
+used before llm/json_repair.py. Also reports replies the strict parser accepted but mangled
+(single-backslash LaTeX such as \\frac turned into control characters) and the parse overhead.
+
+    python benchmarks/bench_json_repair.py
+    python benchmarks/bench_json_repair.py --generated 2000
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import re
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from agents.question_framer_agent import QuestionFramerAgent  # noqa: E402
+from llm.fake import FakeBackend  # noqa: E402
+from llm.json_repair import repair_json  # noqa: E402
+
+CORPUS = ROOT / "benchmarks" / "corpora" / "framer_bad_responses.jsonl"
+
+# What the framer matched and parsed before the repairing parser
+STRICT_PATTERNS = (r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', r'\{.*\}')
+
+GOOD_RESPONSE = json.dumps({
+    "question_id": "Q00",
+    "question_text": "What is the perimeter of a square of side $5$ cm?",
+    "options": ["$20$ cm", "$10$ cm", "$25$ cm", "$15$ cm"],
+    "correct_option": "A",
+    "difficulty": "basic",
+    "needs_diagram": False,
+})
+
+
+class CorpusModel:
+    """Answers the first call with a recorded reply and every retry with a good one."""
+    
+    model_name = "corpus"
+    
+    def __init__(self, first_text: str):
+        self.first_text = first_text
+        self.calls = 0
+    
+    def generate_content(self, prompt: str, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(text=self.first_text if self.calls == 1 else GOOD_RESPONSE, usage_metadata=None)
+
+
+def strict_parse(text: str):
+    """The pre-repair path: strip fences, regex out an object, json.loads it, check its shape."""
+    text = re.sub(r'```(?:json)?\s*', '', text.strip())
+    for pattern in STRICT_PATTERNS:
+        match = re.search(pattern, text, re.DOTALL)
+        if match:
+            break
+    else:
+        raise ValueError("No JSON found")
+    question = json.loads(match.group())
+    if not isinstance(question, dict) or not question.get("question_text") or not isinstance(question.get("options"), list):
+        raise ValueError("Invalid question")
+    return question
+
+
+def has_mangled_latex(question) -> bool:
+    """True if a string contains a control character that began life as a LaTeX command."""
+    strings = [question.get("question_text", "")] + [str(o) for o in question.get("options", [])]
+    return any(re.search(r'[\x08\x0c\t\r]|\n(?:eq|e|u|abla|eg|ot|i)\b', s) for s in strings)
+
+
+def frame_calls(text: str) -> int:
+    """LLM calls QuestionFramerAgent makes when the first reply is text."""
+    model = CorpusModel(text)
+    agent = QuestionFramerAgent(model)
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            agent.frame_question("perimeter of a square", "Perimeter", "Class 6", "Q00", "basic")
+        except ValueError:
+            pass
+    return model.calls
+
+
+def generated_corpus(count: int, seed: int):
+    """Framer replies from the fake backend, every one corrupted by one of its malformations."""
+    backend = FakeBackend(seed=seed, malformed_rate=1.0)
+    model = backend.model_for("framer")
+    for i in range(count):
+        prompt = f"Idea: perimeter idea {i}\nQuestion ID: Q{i:04d}\nDifficulty: basic"
+        yield {"id": f"G{i:04d}", "kind": "generated", "text": model.generate_content(prompt).text}
+
+
+def evaluate(rows):
+    """Per-kind counts of strict-parser failures, mangled LaTeX and retries with the repairing parser."""
+    by_kind = {}
+    for row in rows:
+        stats = by_kind.setdefault(row["kind"], Counter())
+        stats["responses"] += 1
+        try:
+            question = strict_parse(row["text"])
+            if has_mangled_latex(question):
+                stats["strict_mangled"] += 1
+        except ValueError:
+            stats["strict_retries"] += 1
+        calls = frame_calls(row["text"])
+        stats["repair_retries"] += 1 if calls > 1 else 0
+        stats["repair_extra_calls"] += calls - 1
+    return by_kind
+
+
+def parse_overhead(texts, repeats: int) -> dict:
+    """Microseconds per parse of already-valid replies: json.loads vs repair_json."""
+    timings = {}
+    for name, parse in (("json.loads", json.loads), ("repair_json", repair_json)):
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for text in texts:
+                parse(text)
+        timings[name] = (time.perf_counter() - started) / (repeats * len(texts)) * 1e6
+    return timings
+
+
+def print_table(by_kind):
+    print(f"{'kind':<18} {'responses':>9} {'strict retry':>13} {'strict mangled':>15} {'repair retry':>13}")
+    totals = Counter()
+    for kind, stats in sorted(by_kind.items()):
+        totals.update(stats)
+        print(f"{kind:<18} {stats['responses']:>9} {stats['strict_retries']:>13} "
+              f"{stats['strict_mangled']:>15} {stats['repair_retries']:>13}")
+    print(f"{'total':<18} {totals['responses']:>9} {totals['strict_retries']:>13} "
+          f"{totals['strict_mangled']:>15} {totals['repair_retries']:>13}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure framer retries avoided by JSON repair.")
+    parser.add_argument("--corpus", type=str, default=str(CORPUS), help="JSONL of recorded bad responses")
+    parser.add_argument("--generated", type=int, default=500, help="Fake-backend malformed replies to add (default: 500)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generated replies")
+    parser.add_argument("--repeats", type=int, default=200, help="Repeats for the parse overhead timing")
+    args = parser.parse_args()
+    
+    with open(args.corpus, 'r', encoding='utf-8') as f:
+        recorded = [json.loads(line) for line in f if line.strip()]
+    
+    print(f"Recorded corpus ({len(recorded)} responses, {args.corpus}):")
+    recorded_totals = print_table(evaluate(recorded))
+    
+    generated_totals = Counter()
+    if args.generated:
+        print(f"\nFake backend malformations ({args.generated} responses):")
+        generated_totals = print_table(evaluate(generated_corpus(args.generated, args.seed)))
+    
+    totals = recorded_totals + generated_totals
+    avoided = totals["strict_retries"] - totals["repair_retries"]
+    print(f"\nFramer retries: {totals['strict_retries']} strict -> {totals['repair_retries']} with repair "
+          f"({avoided / max(totals['strict_retries'], 1):.0%} fewer); "
+          f"{totals['strict_mangled']} replies the strict parser accepted with mangled LaTeX")
+    
+    timings = parse_overhead([GOOD_RESPONSE] + [row["text"] for row in recorded if row["kind"] == "valid"], args.repeats)
+    print(f"Parse cost on valid replies: json.loads {timings['json.loads']:.1f} µs, "
+          f"repair_json {timings['repair_json']:.1f} µs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Question dedup benchmark: repeated questions in the paper, and what they cost, with and without
+the duplicate-question check.
+
+Generates the same worksheet in every mode against a fake backend whose framer repeats an earlier
+question some of the time and whose questions all need a diagram, once with
+--question-dedup-threshold 0 and once with the default, and reports repeated questions left in
+the paper, diagram calls (repeats that get through cost one each), all LLM calls and seconds.
+
+    python benchmarks/bench_question_dedup.py
+    python benchmarks/bench_question_dedup.py --count 60 --repeat-rate 0.3
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.fake import FakeBackend  # noqa: E402
+from main import QuestionPaperGenerator  # noqa: E402
+
+
+def run(mode: str, threshold: float, count: int, repeat_rate: float, seed: int) -> dict:
+    backend = FakeBackend(seed=seed, repeat_question_rate=repeat_rate, diagram_rate=1.0)
+    generator = QuestionPaperGenerator(tempfile.mkdtemp(prefix="bench_qdedup_"), model_factory=backend.model_for,
+                                       question_dedup_threshold=threshold)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if mode == "sync":
+            result = generator.generate("Perimeter", "Class 6", count)
+        elif mode == "async":
+            result = asyncio.run(generator.generate_async("Perimeter", "Class 6", count, 6))
+        else:
+            result = asyncio.run(generator.generate_staged("Perimeter", "Class 6", count))
+    texts = [(q.get("question_text"), tuple(q.get("options", []))) for q in generator.validated_questions]
+    return {
+        "questions": result["total_questions"],
+        "repeated": len(texts) - len(set(texts)),
+        "diagram": backend.stats["calls"].get("diagram", 0),
+        "calls": backend.total_calls(),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the duplicate-question check.")
+    parser.add_argument("--count", type=int, default=25, help="Questions per worksheet (default: 25)")
+    parser.add_argument("--repeat-rate", type=float, default=0.2,
+                        help="Share of framed questions that repeat an earlier one (default: 0.2)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(" mode    dedup  questions  repeated  diagram calls  LLM calls  seconds")
+    for mode in ("sync", "async", "staged"):
+        for threshold in (0.0, 0.9):
+            r = run(mode, threshold, args.count, args.repeat_rate, args.seed)
+            print(f"{mode:>6}  {'off' if not threshold else threshold:>5}  {r['questions']:>9}  {r['repeated']:>8}  "
+                  f"{r['diagram']:>13}  {r['calls']:>9}  {r['seconds']:7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Research sizing benchmark: fixed 40-50 idea research calls vs demand-sized parallel ones.
+
+Generates worksheets of several sizes against the fake backend, with generation time growing
+with reply length (--seconds-per-token), once with the old research (one 40-50 idea call, another
+one only after every idea is used) and once with demand-sized research. Reports research calls
+and output tokens, seconds until the first question starts framing, and the whole run's time.
+
+    python benchmarks/bench_research_sizing.py
+    python benchmarks/bench_research_sizing.py --counts 5 25 100 300 --concurrency 8
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.fake import FakeBackend  # noqa: E402
+from main import QuestionPaperGenerator  # noqa: E402
+
+
+def fixed_research(generator: QuestionPaperGenerator, topic_name: str, class_level: str):
+    """What research did before sizing: a 40-50 idea call, repeated only once no idea is unused."""
+    pool = generator.idea_pools[topic_name]
+    if pool.fresh > 0 and len(pool) > 0:
+        return None
+    return iter([generator.research_agent.generate_ideas(topic_name, class_level).get("ideas", [])])
+
+
+def run(sized: bool, count: int, concurrency: int, latency: float, seconds_per_token: float, seed: int) -> dict:
+    backend = FakeBackend(seed=seed, latency_mean=latency, latency_jitter=0.3,
+                          seconds_per_output_token=seconds_per_token)
+    generator = QuestionPaperGenerator(tempfile.mkdtemp(prefix="bench_research_"), model_factory=backend.model_for,
+                                       idea_low_watermark=0 if not sized else 10)
+    if not sized:
+        generator._research_ideas = lambda topic_name, class_level: fixed_research(generator, topic_name, class_level)
+    
+    marks = {}
+    started = time.perf_counter()
+    next_job = generator._next_job
+    
+    def timed_next_job(*args):
+        job = next_job(*args)
+        marks.setdefault("first_job", time.perf_counter() - started)
+        return job
+    
+    generator._next_job = timed_next_job
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(generator.generate_async("Perimeter", "Class 6", count, concurrency))
+    research = result["usage"]["by_agent"].get("research", {})
+    return {
+        "questions": result["total_questions"],
+        "calls": research.get("calls", 0),
+        "output_tokens": research.get("output_tokens", 0),
+        "ideas": sum(len(pool) for pool in generator.idea_pools.values()),
+        "first_job": marks.get("first_job", 0.0),
+        "total": time.perf_counter() - started,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fixed-size and demand-sized research.")
+    parser.add_argument("--counts", type=int, nargs="+", default=[5, 25, 150], help="Worksheet sizes (default: 5 25 150)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Ideas processed at once (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean fake LLM latency before generation (default: 0.2)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.002,
+                        help="Fake generation time per output token (default: 0.002)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    print(f"{'count':>5} {'research':<8} {'calls':>5} {'out tokens':>10} {'ideas':>6} {'first job s':>11} {'total s':>8}")
+    for count in args.counts:
+        for sized in (False, True):
+            r = run(sized, count, args.concurrency, args.latency, args.seconds_per_token, args.seed)
+            print(f"{count:>5} {'sized' if sized else 'fixed':<8} {r['calls']:>5} {r['output_tokens']:>10} "
+                  f"{r['ideas']:>6} {r['first_job']:>11.2f} {r['total']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
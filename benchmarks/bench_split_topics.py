@@ -0,0 +1,76 @@
+"""
+Split-topic benchmark: one research prompt for a compound topic vs parallel per-subtopic research.
+
+Generates the same worksheet for a compound topic against the fake backend (generation time
+growing with reply length) once researching the whole topic in one round and once with
+--split-topics, and reports research calls, seconds until the first question starts framing,
+the whole run's time and how many questions each subtopic got.
+
+    python benchmarks/bench_split_topics.py
+    python benchmarks/bench_split_topics.py --topic "Fractions, Decimals, Percentages" --count 30
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from llm.fake import FakeBackend  # noqa: E402
+from main import QuestionPaperGenerator  # noqa: E402
+
+
+def run(split: bool, topic: str, count: int, concurrency: int, latency: float, seconds_per_token: float,
+        seed: int) -> dict:
+    backend = FakeBackend(seed=seed, latency_mean=latency, latency_jitter=0.3,
+                          seconds_per_output_token=seconds_per_token)
+    generator = QuestionPaperGenerator(tempfile.mkdtemp(prefix="bench_split_"), model_factory=backend.model_for,
+                                       split_topics=split)
+    marks = {}
+    started = time.perf_counter()
+    next_job = generator._next_job
+    
+    def timed_next_job(*args):
+        job = next_job(*args)
+        marks.setdefault("first_job", time.perf_counter() - started)
+        return job
+    
+    generator._next_job = timed_next_job
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(generator.generate_async(topic, "Class 7", count, concurrency))
+    return {
+        "questions": result["total_questions"],
+        "research_calls": backend.stats["calls"].get("research", 0),
+        "first_job": marks.get("first_job", 0.0),
+        "total": time.perf_counter() - started,
+        "by_subtopic": Counter(q.get("subtopic", topic) for q in generator.validated_questions),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare whole-topic and per-subtopic research.")
+    parser.add_argument("--topic", type=str, default="Congruence of Triangles, AREA AND PERIMETER")
+    parser.add_argument("--count", type=int, default=25, help="Questions per worksheet (default: 25)")
+    parser.add_argument("--concurrency", type=int, default=6, help="Ideas processed at once (default: 6)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Mean fake LLM latency before generation (default: 0.2)")
+    parser.add_argument("--seconds-per-token", type=float, default=0.004,
+                        help="Fake generation time per output token (default: 0.004)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    for split in (False, True):
+        r = run(split, args.topic, args.count, args.concurrency, args.latency, args.seconds_per_token, args.seed)
+        print(f"{'split' if split else 'whole'}: {r['questions']} questions, {r['research_calls']} research calls, "
+              f"first job {r['first_job']:.2f}s, total {r['total']:.2f}s")
+        for subtopic, questions in r["by_subtopic"].items():
+            print(f"    {questions:>3}  {subtopic}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Validator streaming benchmark: time to a verdict with and without --stream-validation.
+
+Validates the same questions against the fake backend (which streams a reply over its latency,
+the first chunk after llm.fake.TIME_TO_FIRST_CHUNK of it) once reading whole replies and once
+streaming with early acceptance, and reports p50/p95 seconds per validation for accepted and
+rejected questions plus the output tokens read.
+
+    python benchmarks/bench_validator_stream.py
+    python benchmarks/bench_validator_stream.py --questions 100 --latency 2.0
+"""
+
+import argparse
+import contextlib
+import io
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from agents.validator_agent import ValidatorAgent  # noqa: E402
+from llm.client import build_client  # noqa: E402
+from llm.fake import FakeBackend  # noqa: E402
+from telemetry.accounting import UsageLedger  # noqa: E402
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run(stream: bool, questions: int, latency: float, rejection_rate: float, seed: int) -> dict:
+    backend = FakeBackend(seed=seed, latency_mean=latency, latency_jitter=0.3, rejection_rate=rejection_rate)
+    ledger = UsageLedger()
+    validator = ValidatorAgent(build_client("validator", backend.model_for("validator"), usage=ledger), stream=stream)
+    timings = {True: [], False: []}
+    for i in range(questions):
+        question = {
+            "question_id": f"Q{i:03d}",
+            "question_text": f"A square has side ${i + 2}$ cm. What is its perimeter?",
+            "options": [f"${4 * (i + 2)}$ cm", f"${2 * (i + 2)}$ cm", f"${(i + 2) ** 2}$ cm", f"${i + 2}$ cm"],
+            "correct_option": "A",
+            "difficulty": "basic",
+        }
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            is_valid, _, _ = validator.validate(question, "Perimeter", "Class 6")
+        timings[is_valid].append(time.perf_counter() - started)
+    return {"accepted": timings[True], "rejected": timings[False], "output_tokens": ledger.total["output_tokens"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare validation latency with and without streaming.")
+    parser.add_argument("--questions", type=int, default=40, help="Questions to validate per mode (default: 40)")
+    parser.add_argument("--latency", type=float, default=0.5, help="Mean fake LLM latency in seconds (default: 0.5)")
+    parser.add_argument("--rejection-rate", type=float, default=0.2, help="Share of questions judged invalid")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    
+    results = {}
+    for stream in (False, True):
+        results[stream] = run(stream, args.questions, args.latency, args.rejection_rate, args.seed)
+    
+    print(f"{'mode':<8} {'verdict':<9} {'n':>4} {'p50 s':>7} {'p95 s':>7}")
+    for stream, result in results.items():
+        mode = "stream" if stream else "full"
+        for verdict in ("accepted", "rejected"):
+            values = result[verdict]
+            print(f"{mode:<8} {verdict:<9} {len(values):>4} {percentile(values, 0.5):>7.3f} "
+                  f"{percentile(values, 0.95):>7.3f}")
+    
+    full, streamed = statistics.mean(results[False]["accepted"] or [0]), statistics.mean(results[True]["accepted"] or [0])
+    if full:
+        print(f"\nAccepted questions validate {1 - streamed / full:.0%} faster with streaming "
+              f"({full:.3f}s -> {streamed:.3f}s mean)")
+    print(f"Output tokens read: {results[False]['output_tokens']} full, {results[True]['output_tokens']} streamed")
+
+
+if __name__ == "__main__":
+    main()
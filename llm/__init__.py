@@ -0,0 +1 @@
+# Empty init for llm package
\ No newline at end of file
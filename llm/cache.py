@@ -0,0 +1,233 @@
+"""
+ResponseCache: Persistent, content-addressed cache of LLM responses shared by all agents.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, Any, Optional
+
+from llm.cassette import CassetteResponse, _model_name, _usage_dict
+from telemetry.metrics import REGISTRY
+
+CACHE_HITS = REGISTRY.counter("qpg_llm_cache_hits_total", "LLM calls served from the response cache.", ["agent"])
+CACHE_MISSES = REGISTRY.counter("qpg_llm_cache_misses_total", "LLM calls the response cache could not serve.", ["agent"])
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Seconds each agent's responses stay fresh; None never expires
+DEFAULT_TTLS = {
+    "research": 7 * 24 * 3600,
+    "framer": 30 * 24 * 3600,
+    "validator": 30 * 24 * 3600,
+    "diagram": 30 * 24 * 3600,
+    "python_diagram": 30 * 24 * 3600,
+}
+
+# Seconds a miss may hold its key's fill claim; a filler that crashed or hung is taken over after this
+DEFAULT_FILL_LEASE = 300.0
+FILL_POLL_INTERVAL = 0.05
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Collapse whitespace so re-indented prompt templates still share cache entries."""
+    return " ".join(prompt.split())
+
+
+def prompt_key(model_name: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+    """Content address of a call: model name, normalized prompt and any generate_content options."""
+    material = model_name + "\0" + normalize_prompt(prompt)
+    if options:
+        material += "\0" + json.dumps(options, sort_keys=True, default=str)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class CachedResponse(CassetteResponse):
+    """A response served by (or stored in) the cache; remembers its key so it can be evicted."""
+    
+    def __init__(self, text: str, usage: Optional[Dict[str, int]], cache: "ResponseCache", key: str,
+                 cache_hit: bool):
+        super().__init__(text, usage)
+        self.cache = cache
+        self.cache_key = key
+        self.cache_hit = cache_hit
+
+
+class ResponseCache:
+    """SQLite store of zlib-compressed responses with size-bounded LRU eviction and per-agent TTLs.
+    
+    Safe to share between threads, and between processes (e.g. --batch workers) through
+    SQLite's own locking. clock (default time.time) stamps entries for TTLs and LRU order.
+    """
+    
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES, ttls: Optional[Dict[str, float]] = None,
+                 clock: Callable[[], float] = time.time, fill_lease: float = DEFAULT_FILL_LEASE):
+        self.path = Path(path)
+        self.clock = clock
+        self.fill_lease = fill_lease
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self._lock = threading.Lock()
+        self.stats = {}
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, agent TEXT, model TEXT, payload BLOB,"
+            " size INTEGER, created REAL, last_used REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        # One row per key being filled, so misses for that key elsewhere wait instead of calling too
+        self._conn.execute("CREATE TABLE IF NOT EXISTS fills (key TEXT PRIMARY KEY, expires REAL)")
+        self._conn.commit()
+    
+    def count(self, agent_name: str, hit: bool):
+        outcome = "hits" if hit else "misses"
+        with self._lock:
+            counts = self.stats.setdefault(agent_name, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+        (CACHE_HITS if hit else CACHE_MISSES).inc(agent=agent_name)
+    
+    def claim_fill(self, key: str) -> bool:
+        """Claim filling key, across threads and processes sharing the store. False while someone
+        else's unexpired claim holds it; only that key waits, other keys fill in parallel."""
+        now = self.clock()
+        with self._lock:
+            self._conn.execute("DELETE FROM fills WHERE key = ? AND expires < ?", (key, now))
+            claimed = self._conn.execute("INSERT OR IGNORE INTO fills (key, expires) VALUES (?, ?)",
+                                         (key, now + self.fill_lease)).rowcount == 1
+            self._conn.commit()
+        return claimed
+    
+    def release_fill(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM fills WHERE key = ?", (key,))
+            self._conn.commit()
+    
+    def wait_fill(self, key: str):
+        """Return once no unexpired claim holds key (its response is stored, or the filler gave up)."""
+        while True:
+            with self._lock:
+                row = self._conn.execute("SELECT expires FROM fills WHERE key = ?", (key,)).fetchone()
+            if row is None or row[0] < self.clock():
+                return
+            time.sleep(FILL_POLL_INTERVAL)
+    
+    def get(self, key: str, agent_name: str) -> Optional[Dict[str, Any]]:
+        """Return the stored {"text", "usage"} for key, or None if missing or expired."""
+        now = self.clock()
+        with self._lock:
+            row = self._conn.execute("SELECT payload, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                ttl = self.ttls.get(agent_name)
+                if ttl is not None and now - row[1] > ttl:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    row = None
+                else:
+                    self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+        
+        if row is None:
+            return None
+        return json.loads(zlib.decompress(row[0]).decode("utf-8"))
+    
+    def put(self, key: str, agent_name: str, model_name: str, text: str, usage: Optional[Dict[str, int]]):
+        payload = zlib.compress(json.dumps({"text": text, "usage": usage}).encode("utf-8"))
+        now = self.clock()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, agent, model, payload, size, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, agent_name, model_name, payload, len(payload), now, now)
+            )
+            self._evict_lru()
+            self._conn.commit()
+    
+    def _evict_lru(self):
+        # Drop least recently used entries until the store fits max_bytes again
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+    
+    def discard(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+    
+    def summary(self) -> Dict[str, Any]:
+        """Hit/miss counts per agent and overall, plus the store's current size."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            by_agent = {agent: dict(counts) for agent, counts in self.stats.items()}
+        hits = sum(counts["hits"] for counts in by_agent.values())
+        misses = sum(counts["misses"] for counts in by_agent.values())
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            "by_agent": by_agent,
+            "entries": entries,
+            "size_bytes": size,
+        }
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedModel:
+    """Wraps a model and serves repeated prompts from a ResponseCache.
+    
+    Put it outside the metering wrappers so cache hits cost no tokens and record no latency.
+    Concurrent misses for one key (in this or another process) make a single call.
+    Streaming calls always go to the inner model.
+    """
+    
+    def __init__(self, inner, cache: ResponseCache, agent_name: str):
+        self.inner = inner
+        self.cache = cache
+        self.agent_name = agent_name
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        if kwargs.get("stream"):
+            return self.inner.generate_content(prompt, **kwargs)
+        
+        model_name = _model_name(self.inner)
+        key = prompt_key(model_name, prompt, kwargs)
+        stored = self.cache.get(key, self.agent_name)
+        while stored is None:
+            if self.cache.claim_fill(key):
+                try:
+                    self.cache.count(self.agent_name, hit=False)
+                    response = self.inner.generate_content(prompt, **kwargs)
+                    text = response.text
+                    usage = _usage_dict(response)
+                    self.cache.put(key, self.agent_name, model_name, text, usage)
+                    return CachedResponse(text, usage, self.cache, key, cache_hit=False)
+                finally:
+                    self.cache.release_fill(key)
+            # Another caller is filling this very key: wait for its response (or for it to fail)
+            self.cache.wait_fill(key)
+            stored = self.cache.get(key, self.agent_name)
+        
+        self.cache.count(self.agent_name, hit=True)
+        return CachedResponse(stored["text"], stored["usage"], self.cache, key, cache_hit=True)
+
+
+def evict(response):
+    """Drop a response from the cache it came from, e.g. because it failed to parse, so the
+    next identical call goes to the API instead of replaying the same bad output."""
+    cache = getattr(response, "cache", None)
+    if cache is not None:
+        cache.discard(response.cache_key)
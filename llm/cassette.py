@@ -0,0 +1,194 @@
+"""
+Cassette: Records Gemini prompts/responses to a file and replays them offline.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, Any, Optional
+
+from llm.gemini import DEFAULT_MODEL_NAME, default_model
+
+
+class CassetteMissError(LookupError):
+    """Raised in replay mode when a prompt was never recorded."""
+
+
+class CassetteResponse:
+    """Replayed stand-in for a genai response: exposes .text and .usage_metadata."""
+    
+    def __init__(self, text: str, usage: Optional[Dict[str, int]] = None):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+
+
+class Cassette:
+    """A JSON Lines file of recorded calls, keyed by agent, model name, prompt hash and options.
+    
+    Each key holds every response recorded for it, in order, so repeated identical prompts
+    (framer retries, re-research) replay the same sequence the live run saw. Recording appends
+    one line per call, so a long session costs the same per call however big the cassette
+    grows; a line cut off by a crash is skipped on load. Cassettes in the older single-JSON
+    format are still read, and rewritten as JSON Lines the first time something is recorded.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._positions = {}
+        self.entries = {}
+        self._legacy = False
+        if self.path.exists():
+            self._load()
+    
+    def _load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        if isinstance(data, dict) and "entries" in data:
+            self.entries = data["entries"]
+            self._legacy = True
+            return
+        for line in text.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Cut off mid-write
+            entry = self.entries.setdefault(record["key"], {"prompt": record["prompt"], "responses": []})
+            entry["responses"].append(record["outcome"])
+    
+    @staticmethod
+    def key(agent_name: str, model_name: str, prompt: str, options: Optional[Dict[str, Any]] = None) -> str:
+        # Options (generation_config, response_schema, ...) change the reply, so they are part of
+        # the key; calls without any hash as before, so older cassettes still match them
+        material = prompt
+        if options:
+            material += "\0" + json.dumps(options, sort_keys=True, default=str)
+        digest = hashlib.sha256(material.encode("utf-8")).hexdigest()
+        return f"{agent_name}:{model_name}:{digest}"
+    
+    def record(self, key: str, prompt: str, outcome: Dict[str, Any]):
+        """Append one call outcome ({"text", "latency", "usage"} or {"error", "latency"}) to the file."""
+        with self._lock:
+            entry = self.entries.setdefault(key, {"prompt": prompt, "responses": []})
+            entry["responses"].append(outcome)
+            if self._legacy:
+                self._rewrite()
+                return
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(self._line(key, prompt, outcome))
+    
+    def next_outcome(self, key: str) -> Dict[str, Any]:
+        """Return the next recorded outcome for key, repeating the last one once exhausted."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if not entry or not entry["responses"]:
+                raise CassetteMissError(f"No recorded response for {key}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            return entry["responses"][min(position, len(entry["responses"]) - 1)]
+    
+    @staticmethod
+    def _line(key: str, prompt: str, outcome: Dict[str, Any]) -> str:
+        return json.dumps({"key": key, "prompt": prompt, "outcome": outcome}, ensure_ascii=False) + "\n"
+    
+    def _rewrite(self):
+        # Converts an old cassette once; written to a temp file and swapped in so a crash never
+        # leaves a truncated one
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for key, entry in self.entries.items():
+                for outcome in entry["responses"]:
+                    f.write(self._line(key, entry["prompt"], outcome))
+        os.replace(tmp_path, self.path)
+        self._legacy = False
+
+
+def _model_name(model) -> str:
+    name = getattr(model, "model_name", None) or DEFAULT_MODEL_NAME
+    return name.split("/")[-1]  # genai reports "models/<name>"
+
+
+def _usage_dict(response) -> Optional[Dict[str, int]]:
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return None
+    return {
+        "prompt_token_count": getattr(usage, "prompt_token_count", 0) or 0,
+        "candidates_token_count": getattr(usage, "candidates_token_count", 0) or 0,
+        "total_token_count": getattr(usage, "total_token_count", 0) or 0,
+    }
+
+
+class RecordingModel:
+    """Wraps a live model and records every call into a cassette."""
+    
+    def __init__(self, inner, cassette: Cassette, agent_name: str):
+        self.inner = inner
+        self.cassette = cassette
+        self.agent_name = agent_name
+        self.model_name = _model_name(inner)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        # Cassettes hold whole responses, so a streamed call is recorded (and replayed) unstreamed
+        kwargs.pop("stream", None)
+        key = Cassette.key(self.agent_name, self.model_name, prompt, kwargs)
+        started = time.perf_counter()
+        try:
+            response = self.inner.generate_content(prompt, **kwargs)
+            text = response.text
+        except Exception as e:
+            # Errors are replayed too, so retry/fallback paths reproduce offline
+            self.cassette.record(key, prompt, {
+                "error": f"{type(e).__name__}: {e}",
+                "latency": round(time.perf_counter() - started, 4),
+            })
+            raise
+        
+        self.cassette.record(key, prompt, {
+            "text": text,
+            "latency": round(time.perf_counter() - started, 4),
+            "usage": _usage_dict(response),
+        })
+        return response
+
+
+class ReplayModel:
+    """Serves responses from a cassette with their recorded (or a synthetic) latency."""
+    
+    def __init__(self, cassette: Cassette, agent_name: str, model_name: str = DEFAULT_MODEL_NAME,
+                 latency: Optional[float] = None):
+        self.cassette = cassette
+        self.agent_name = agent_name
+        self.model_name = model_name
+        self.latency = latency  # None replays the recorded latency
+    
+    def generate_content(self, prompt: str, **kwargs):
+        kwargs.pop("stream", None)
+        outcome = self.cassette.next_outcome(Cassette.key(self.agent_name, self.model_name, prompt, kwargs))
+        delay = outcome.get("latency", 0.0) if self.latency is None else self.latency
+        if delay > 0:
+            time.sleep(delay)
+        if "error" in outcome:
+            raise RuntimeError(f"Replayed error: {outcome['error']}")
+        return CassetteResponse(outcome["text"], outcome.get("usage"))
+
+
+def cassette_model_factory(path: str, mode: str, latency: Optional[float] = None):
+    """Build a QuestionPaperGenerator model_factory that records to or replays from a cassette."""
+    cassette = Cassette(path)
+    
+    if mode == "record":
+        return lambda agent_name: RecordingModel(default_model(), cassette, agent_name)
+    if mode == "replay":
+        if not cassette.entries:
+            raise ValueError(f"Cassette {path} is empty or missing")
+        return lambda agent_name: ReplayModel(cassette, agent_name, latency=latency)
+    raise ValueError(f"Unknown cassette mode: {mode}")
@@ -0,0 +1,397 @@
+"""
+LLMClient: The one way agents talk to a language model.
+
+A client wraps a provider model (Gemini, the fake backend, or a cassette) in the shared
+middleware stack (timeouts, latency metrics, rate limiting, token metering, retries,
+coalescing and caching) and gives agents sync and async calls plus JSON helpers. In
+structured mode, JSON calls also declare the agent's response schema to the model.
+"""
+
+import contextvars
+import functools
+import json
+import queue
+import re
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
+
+from llm.cache import CachedModel, ResponseCache, evict
+from llm.gemini import DEFAULT_MODEL_NAME, default_model
+from llm.json_repair import repair_json
+from llm.ratelimit import RateLimiter, RateLimitedModel
+from llm.retry import CircuitBreaker, RetryPolicy, RetryingModel
+from llm.schemas import schema_errors
+from llm.singleflight import CoalescingModel
+from telemetry.accounting import MeteredModel, UsageLedger
+from telemetry.metrics import REGISTRY, InstrumentedModel
+from telemetry.tracing import span
+
+SCHEMA_VIOLATIONS = REGISTRY.counter(
+    "qpg_llm_schema_violations_total", "Structured LLM responses that failed local schema validation.", ["agent"])
+JSON_REPAIRS = REGISTRY.counter(
+    "qpg_llm_json_repairs_total", "LLM responses parsed only after repairing their JSON, by repair.", ["agent", "repair"])
+
+PROVIDERS = ("gemini", "fake", "replay", "record")
+
+
+class LLMJSONError(ValueError):
+    """A response that did not contain usable JSON. kind is "no_json", "json_error", "schema_error"
+    or "truncated" (cut off, and what could be salvaged is missing required fields)."""
+    
+    def __init__(self, message: str, kind: str, text: str, response=None):
+        super().__init__(message)
+        self.kind = kind
+        self.text = text
+        self.response = response
+
+
+def extract_json(text: str, pattern: Union[str, Tuple[str, ...]] = r'\{.*\}') -> Tuple[Any, List[str]]:
+    """Parse the JSON in a model reply, ignoring markdown fences and surrounding prose, and
+    repairing what models commonly get wrong (see llm/json_repair.py).
+    
+    The value starts where pattern (or the first of a tuple of patterns that matches) matches,
+    else at the first "{". Returns (value, repairs made). Raises LLMJSONError.
+    """
+    text = re.sub(r'```(?:json)?\s*', '', text.strip())
+    match = None
+    for candidate in ((pattern,) if isinstance(pattern, str) else pattern):
+        match = re.search(candidate, text, re.DOTALL)
+        if match:
+            break
+    start = match.start() if match else text.find("{")  # A truncated reply has no closing brace
+    if start < 0:
+        raise LLMJSONError("No JSON found in response", "no_json", text)
+    try:
+        return repair_json(text[start:])
+    except json.JSONDecodeError as e:
+        raise LLMJSONError(str(e), "json_error", text) from e
+
+
+class _CallPool:
+    """Daemon worker threads shared by every TimeoutModel, started as needed up to max_workers.
+    
+    Daemon threads (unlike ThreadPoolExecutor's) never hold up interpreter exit, so a call
+    abandoned after its timeout cannot keep a finished run from exiting. An abandoned call
+    stops counting towards max_workers: a replacement worker takes its place, and whichever
+    worker next finds nothing to do exits, so hung calls cannot starve the pool.
+    """
+    
+    def __init__(self, max_workers: int = 64):
+        self.max_workers = max_workers
+        self._tasks = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._workers = 0
+        self._idle = 0  # Workers waiting for a task no one has claimed
+        self._backlog = 0  # Tasks queued while every worker was busy
+        self._retiring = 0  # Workers to let go once idle, one per abandoned call
+    
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs). The returned future's `started` event is set when it begins running."""
+        future = Future()
+        future.started = threading.Event()
+        with self._lock:
+            if self._idle:
+                self._idle -= 1
+            elif self._workers - self._retiring < self.max_workers:
+                self._start_worker()
+            else:
+                self._backlog += 1
+            self._tasks.put((future, fn, args, kwargs))
+        return future
+    
+    def abandon(self, future: Future):
+        """Stop counting a running call that its caller gave up on against max_workers."""
+        with self._lock:
+            if future.done():
+                return
+            self._retiring += 1
+            if self._backlog:
+                self._backlog -= 1
+                self._start_worker()
+    
+    def _start_worker(self):
+        self._workers += 1
+        threading.Thread(target=self._work, name=f"llm-call-{self._workers}", daemon=True).start()
+    
+    def _work(self):
+        while True:
+            future, fn, args, kwargs = self._tasks.get()
+            if future.set_running_or_notify_cancel():
+                future.started.set()
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+            del future, fn, args, kwargs  # Don't keep the response alive while idle
+            with self._lock:
+                if self._backlog:
+                    self._backlog -= 1
+                elif self._retiring:
+                    self._retiring -= 1
+                    self._workers -= 1
+                    return
+                else:
+                    self._idle += 1
+
+
+_CALL_POOL = _CallPool()
+_STREAM_END = object()
+
+
+class TimeoutModel:
+    """Fails a call with TimeoutError (which the retry layer treats as transient) after it has
+    run for `timeout` seconds; time spent queued for a worker does not count.
+    
+    Calls run on a worker pool shared by all agents instead of a new thread each; an abandoned
+    call finishes in the background. A streamed response is timed chunk by chunk, so a stream
+    that stalls part-way fails too (see TimeoutStream).
+    """
+    
+    def __init__(self, inner, timeout: float, pool: _CallPool = None):
+        self.inner = inner
+        self.timeout = timeout
+        self.pool = pool or _CALL_POOL
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        response = self.call(self.inner.generate_content, prompt, **kwargs)
+        if kwargs.get("stream") and hasattr(response, "__iter__"):
+            return TimeoutStream(response, self)
+        return response
+    
+    def call(self, fn, *args, **kwargs):
+        """Run fn on the pool and wait at most `timeout` seconds from when it starts running."""
+        future = self.pool.submit(fn, *args, **kwargs)
+        future.started.wait()
+        try:
+            return future.result(self.timeout)
+        except FutureTimeoutError:
+            self.pool.abandon(future)
+            raise TimeoutError(f"LLM call timed out after {self.timeout:g}s") from None
+
+
+class TimeoutStream:
+    """A streamed response whose every chunk must arrive within the model's timeout of asking
+    for it; on a stall the stream is closed and TimeoutError raised."""
+    
+    def __init__(self, inner, model: TimeoutModel):
+        self.inner = inner
+        self.model = model
+    
+    def __iter__(self):
+        chunks = iter(self.inner)
+        while True:
+            try:
+                chunk = self.model.call(next, chunks, _STREAM_END)
+            except TimeoutError:
+                self.close()
+                raise TimeoutError(f"LLM stream stalled: no chunk for {self.model.timeout:g}s") from None
+            if chunk is _STREAM_END:
+                return
+            yield chunk
+    
+    def close(self):
+        close = getattr(self.inner, "close", None)
+        if close is not None:
+            close()
+    
+    @property
+    def text(self) -> str:
+        return self.inner.text
+    
+    @property
+    def usage_metadata(self):
+        return getattr(self.inner, "usage_metadata", None)
+
+
+class LLMClient:
+    """An agent's handle on its (wrapped) model. Stateless apart from the model, so one client
+    can be used from many threads and tasks at once.
+    
+    With structured=True, generate_json() calls that pass a schema ask the model for JSON
+    matching it (response_mime_type/response_schema) and reject replies that do not conform.
+    stream_json() reads a JSON reply as it streams and can stop as soon as it knows enough.
+    """
+    
+    def __init__(self, model, agent_name: str, structured: bool = False):
+        self.model = model
+        self.agent_name = agent_name
+        self.structured = structured
+        self.model_name = getattr(model, "model_name", None)
+    
+    def generate(self, prompt: str, **kwargs):
+        """Send one prompt and return the response (.text, .usage_metadata)."""
+        return self.model.generate_content(prompt, **kwargs)
+    
+    # Lets a client stand in anywhere a model is expected
+    generate_content = generate
+    
+    def generate_text(self, prompt: str, **kwargs) -> str:
+        return self.generate(prompt, **kwargs).text.strip()
+    
+    def generate_json(self, prompt: str, pattern: Union[str, Tuple[str, ...]] = r'\{.*\}',
+                      schema: Optional[Dict[str, Any]] = None, **kwargs) -> Tuple[Any, Any]:
+        """Send a prompt that asks for JSON and return (parsed JSON, response).
+        
+        Malformed JSON is repaired where possible; a truncated reply is accepted only if what
+        survives still satisfies schema. On unusable output raises LLMJSONError and drops the
+        response from the cache, so asking again reaches the model instead of replaying the same reply.
+        """
+        response = self.generate(prompt, **self._json_options(schema, kwargs))
+        try:
+            return self.parse_json(response.text, pattern, schema), response
+        except LLMJSONError as e:
+            evict(response)
+            e.response = response
+            raise
+    
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """Yield the reply's text chunk by chunk as the model streams it.
+        
+        Closing the generator (e.g. breaking out early) closes the response, which for Gemini
+        cancels the call (llm/gemini.py), so the rest of the reply is never generated or read.
+        Providers that cannot stream yield one whole chunk.
+        """
+        response = self.generate(prompt, stream=True, **kwargs)
+        try:
+            for chunk in (response if hasattr(response, "__iter__") else [response]):
+                yield chunk.text
+        finally:
+            close = getattr(response, "close", None)
+            if close is not None:
+                close()
+    
+    def stream_json(self, prompt: str, stop_when: Callable[[Dict[str, Any]], bool],
+                    pattern: Union[str, Tuple[str, ...]] = r'\{.*\}', schema: Optional[Dict[str, Any]] = None,
+                    **kwargs) -> Tuple[Any, bool]:
+        """Stream a JSON reply, re-parsing it as each chunk arrives, and stop reading as soon as
+        stop_when(partial object) is true. Returns (parsed JSON, stopped early).
+        
+        A partial object holds only the members that arrived complete. A reply read to the end
+        is parsed and checked like generate_json()'s.
+        """
+        text = ""
+        stream = self.generate_stream(prompt, **self._json_options(schema, kwargs))
+        try:
+            for chunk in stream:
+                text += chunk
+                start = text.find("{")
+                if start < 0:
+                    continue
+                try:
+                    partial, _ = repair_json(text[start:])
+                except ValueError:
+                    continue
+                if isinstance(partial, dict) and stop_when(partial):
+                    return partial, True
+        finally:
+            stream.close()
+        return self.parse_json(text, pattern, schema), False
+    
+    def _json_options(self, schema: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> Dict[str, Any]:
+        """generate_content options for a JSON call: in structured mode, declare the schema."""
+        if self.structured and schema is not None:
+            config = dict(kwargs.get("generation_config") or {})
+            config.update(response_mime_type="application/json", response_schema=schema)
+            kwargs = dict(kwargs, generation_config=config)
+        return kwargs
+    
+    def parse_json(self, text: str, pattern: Union[str, Tuple[str, ...]] = r'\{.*\}',
+                   schema: Optional[Dict[str, Any]] = None) -> Any:
+        """Parse (repairing if needed) and check a complete JSON reply. Raises LLMJSONError."""
+        structured = self.structured and schema is not None
+        data = None
+        if structured:
+            try:
+                data = json.loads(text)
+            except ValueError:
+                pass  # A provider that ignored the schema (e.g. an old cassette); fall back to scraping
+        if data is None:
+            data, repairs = extract_json(text, pattern)
+            if repairs:
+                self._report_repairs(repairs)
+            if "truncated" in repairs and schema is not None and schema_errors(data, schema):
+                # Salvaging a cut-off reply is only worth it if nothing required was lost
+                raise LLMJSONError("Response was truncated", "truncated", text)
+        if structured:
+            errors = schema_errors(data, schema)
+            if errors:
+                SCHEMA_VIOLATIONS.inc(agent=self.agent_name)
+                raise LLMJSONError("Response does not match schema: " + "; ".join(errors[:3]),
+                                   "schema_error", text)
+        return data
+    
+    def _report_repairs(self, repairs: List[str]):
+        for repair in repairs:
+            JSON_REPAIRS.inc(agent=self.agent_name, repair=repair)
+        with span("json_repair", agent=self.agent_name, repairs=",".join(repairs)):
+            pass
+    
+    async def agenerate(self, prompt: str, **kwargs):
+        """Async generate(): the blocking call runs on the loop's default executor, in the task's
+        context so the question scope (token accounting) carries over."""
+        import asyncio  # Only async callers pay for importing asyncio
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(None, functools.partial(context.run, self.generate, prompt, **kwargs))
+    
+    async def agenerate_json(self, prompt: str, pattern: Union[str, Tuple[str, ...]] = r'\{.*\}',
+                             schema: Optional[Dict[str, Any]] = None, **kwargs) -> Tuple[Any, Any]:
+        import asyncio
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            None, functools.partial(context.run, self.generate_json, prompt, pattern, schema, **kwargs))
+
+
+def as_client(model, agent_name: str) -> LLMClient:
+    """Use model as-is if it is already a client, else wrap it (the default Gemini model if None)."""
+    if isinstance(model, LLMClient):
+        return model
+    return LLMClient(model or default_model(), agent_name)
+
+
+def build_client(agent_name: str, model, usage: Optional[UsageLedger] = None,
+                 cache: Optional[ResponseCache] = None, rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None, breaker: Optional[CircuitBreaker] = None,
+                 timeout: Optional[float] = None, structured: bool = False) -> LLMClient:
+    """Wrap a provider model in the full middleware stack, innermost first:
+    timeout -> latency metrics -> rate limiter -> token metering -> retries -> coalescing -> cache.
+    
+    Rate limiting sits outside the latency timer so queueing shows separately; retries sit
+    outside metering and the limiter so every attempt is counted and budgeted; the cache is
+    outermost so hits cost nothing. structured turns on schema-constrained JSON output.
+    """
+    model = model or default_model()
+    if timeout:
+        model = TimeoutModel(model, timeout)
+    model = InstrumentedModel(model, agent_name)
+    if rate_limiter:
+        model = RateLimitedModel(model, rate_limiter, agent_name)
+    if usage is not None:
+        model = MeteredModel(model, usage, agent_name)
+    model = RetryingModel(model, agent_name, retry_policy, breaker)
+    # Identical prompts already in flight (from any generator in this process) share one call
+    model = CoalescingModel(model, agent_name)
+    if cache:
+        model = CachedModel(model, cache, agent_name)
+    return LLMClient(model, agent_name, structured)
+
+
+def provider_factory(provider: str, **options) -> Callable[[str], Any]:
+    """Model factory (agent name -> provider model) for a named provider.
+    
+    "gemini": options model_name; "fake": FakeBackend settings; "replay" / "record": options
+    path and (replay only) latency.
+    """
+    if provider == "gemini":
+        model_name = options.get("model_name", DEFAULT_MODEL_NAME)
+        return lambda agent_name: default_model(model_name)
+    if provider == "fake":
+        from llm.fake import FakeBackend
+        return FakeBackend(**options).model_for
+    if provider in ("replay", "record"):
+        from llm.cassette import cassette_model_factory
+        return cassette_model_factory(options["path"], provider, options.get("latency"))
+    raise ValueError(f"Unknown LLM provider: {provider} (expected one of {', '.join(PROVIDERS)})")
@@ -0,0 +1,301 @@
+"""
+FakeBackend: Local stand-in for the Gemini model with latency, error and malformed-output injection.
+"""
+
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+
+class FakeBackendError(RuntimeError):
+    """An injected provider failure (rate limit, server error or timeout)."""
+
+
+class FakeStream:
+    """Mimics a streamed genai response: iterating yields chunks with .text, spaced out over the
+    generation time. close() stops the stream; usage counts only what was sent."""
+    
+    def __init__(self, text: str, prompt: str, generation_seconds: float, chunk_chars: int):
+        self._chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        self._prompt = prompt
+        self._chunk_delay = generation_seconds / len(self._chunks)
+        self._sent = []
+        self._closed = False
+    
+    def __iter__(self):
+        for chunk in self._chunks:
+            if self._closed:
+                return
+            if self._chunk_delay:
+                time.sleep(self._chunk_delay)
+            self._sent.append(chunk)
+            yield SimpleNamespace(text=chunk)
+    
+    def close(self):
+        self._closed = True
+    
+    @property
+    def text(self) -> str:
+        return "".join(self._sent)
+    
+    @property
+    def usage_metadata(self):
+        return FakeResponse(self.text, self._prompt).usage_metadata
+
+
+class FakeResponse:
+    """Mimics a genai response: exposes .text and .usage_metadata."""
+    
+    def __init__(self, text: str, prompt: str):
+        self.text = text
+        prompt_tokens = max(1, len(prompt) // 4)
+        output_tokens = max(1, len(text) // 4)
+        self.usage_metadata = SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+        )
+
+
+# Injected errors look like the provider's own messages so retry logic can classify them
+_INJECTED_ERRORS = [
+    "429 Resource has been exhausted (e.g. check quota).",
+    "503 The service is currently unavailable.",
+    "504 Deadline Exceeded",
+    "500 An internal error has occurred.",
+]
+
+# Share of a call's latency spent before the first streamed chunk arrives
+TIME_TO_FIRST_CHUNK = 0.3
+
+# Like the real model, the fake explains itself at length even when the question is fine
+_VALID_FEEDBACK = (
+    "The question is correct and clear. The computation in the stem gives the marked option, and "
+    "exactly one option matches it. The distractors are plausible results of common mistakes "
+    "(adding only two sides, multiplying instead of adding). The wording is unambiguous, the units "
+    "are consistent, there are no grammatical errors and the difficulty suits the class level."
+)
+
+_SHAPES = ["triangle", "rectangle", "square", "parallelogram", "circle", "trapezium"]
+
+# How many distinct questions repeat_question_rate draws its repeats from
+_REPEATED_QUESTIONS = 4
+
+
+class FakeBackend:
+    """Schema-correct fake responses for every agent, with configurable failure modes.
+    
+    Outcomes are derived from (seed, agent, prompt, n-th identical call), so a run is
+    reproducible no matter how concurrent calls interleave. Use backend.model_for as a
+    QuestionPaperGenerator model_factory.
+    """
+    
+    def __init__(self, seed: int = 0, latency_mean: float = 0.0, latency_jitter: float = 0.0,
+                 latency_distribution: str = "lognormal", error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, rejection_rate: float = 0.2, correction_rate: float = 0.5,
+                 diagram_rate: float = 0.0, python_diagram_rate: float = 0.0, stream_chunk_chars: int = 64,
+                 seconds_per_output_token: float = 0.0, duplicate_rate: float = 0.0,
+                 repeat_question_rate: float = 0.0):
+        """seconds_per_output_token adds generation time proportional to the reply's length (on top
+        of the sampled latency), as a real model decodes long replies more slowly.
+        duplicate_rate is the share of research ideas that only reword an earlier idea of the reply.
+        repeat_question_rate is the share of framed questions that reuse the text and options of one of
+        a few stock questions (chosen from the prompt, so runs stay reproducible whatever the thread
+        scheduling); every use of a stock question after its first is a repeat."""
+        if latency_distribution not in ("constant", "uniform", "lognormal"):
+            raise ValueError(f"Unknown latency distribution: {latency_distribution}")
+        self.seed = seed
+        self.latency_mean = latency_mean
+        self.latency_jitter = latency_jitter
+        self.latency_distribution = latency_distribution
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.rejection_rate = rejection_rate
+        self.correction_rate = correction_rate
+        self.diagram_rate = diagram_rate
+        self.python_diagram_rate = python_diagram_rate
+        self.stream_chunk_chars = stream_chunk_chars
+        self.seconds_per_output_token = seconds_per_output_token
+        self.duplicate_rate = duplicate_rate
+        self.repeat_question_rate = repeat_question_rate
+        self._stock_questions_used = set()
+        
+        self._lock = threading.Lock()
+        self._prompt_calls = {}
+        self.stats = {"calls": {}, "errors": 0, "malformed": 0, "rejections": 0, "duplicates": 0, "repeated_questions": 0}
+    
+    def model_for(self, agent_name: str) -> "FakeModel":
+        return FakeModel(self, agent_name)
+    
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self.stats["calls"].values())
+    
+    def _rng_for(self, agent_name: str, prompt: str) -> random.Random:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self._lock:
+            key = (agent_name, digest)
+            n = self._prompt_calls.get(key, 0)
+            self._prompt_calls[key] = n + 1
+            self.stats["calls"][agent_name] = self.stats["calls"].get(agent_name, 0) + 1
+        return random.Random(f"{self.seed}:{agent_name}:{digest}:{n}")
+    
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+    
+    def latency(self, rng: random.Random) -> float:
+        if self.latency_mean <= 0:
+            return 0.0
+        if self.latency_distribution == "constant":
+            return self.latency_mean
+        if self.latency_distribution == "uniform":
+            return max(0.0, rng.uniform(self.latency_mean - self.latency_jitter,
+                                        self.latency_mean + self.latency_jitter))
+        # Lognormal with the requested mean; jitter is the sigma of the underlying normal
+        sigma = self.latency_jitter or 0.5
+        return rng.lognormvariate(0, sigma) * self.latency_mean / math.exp(sigma * sigma / 2)
+    
+    def respond(self, agent_name: str, prompt: str, structured: bool = False, stream: bool = False):
+        """One call's response. structured (a response_schema was sent) disables malformed output,
+        as constrained decoding does for the real model. stream returns a FakeStream that takes
+        TIME_TO_FIRST_CHUNK of the latency to start and spreads the rest over its chunks."""
+        rng = self._rng_for(agent_name, prompt)
+        delay = self.latency(rng)
+        wait = delay * TIME_TO_FIRST_CHUNK if stream else delay
+        if wait:
+            time.sleep(wait)
+        
+        if rng.random() < self.error_rate:
+            self._count("errors")
+            raise FakeBackendError(rng.choice(_INJECTED_ERRORS))
+        
+        builder = getattr(self, f"_{agent_name}_text", None)
+        if builder is None:
+            raise ValueError(f"FakeBackend has no responses for agent: {agent_name}")
+        text = builder(prompt, rng)
+        
+        if rng.random() < self.malformed_rate and not structured:
+            self._count("malformed")
+            text = self._malform(text, rng)
+        generation = self.seconds_per_output_token * (len(text) // 4)
+        if stream:
+            return FakeStream(text, prompt, delay - wait + generation, self.stream_chunk_chars)
+        if generation:
+            time.sleep(generation)
+        return FakeResponse(text, prompt)
+    
+    @staticmethod
+    def _field(prompt: str, pattern: str, default: str) -> str:
+        match = re.search(pattern, prompt)
+        return match.group(1).strip() if match else default
+    
+    @staticmethod
+    def _malform(text: str, rng: random.Random) -> str:
+        """Corrupt a response the way real model output goes wrong."""
+        kind = rng.choice(["truncate", "trailing_comma", "prose", "bad_escape"])
+        if kind == "truncate":
+            return text[:max(1, int(len(text) * rng.uniform(0.3, 0.9)))]
+        if kind == "trailing_comma":
+            return text.rstrip().rstrip("}") + ",}"
+        if kind == "prose":
+            return "Sure! Here is the JSON you asked for:\n" + text.replace('"', "'", 2)
+        return text.replace("\\\\", "\\")
+    
+    def _research_text(self, prompt: str, rng: random.Random) -> str:
+        topic = self._field(prompt, r'topic:\s*"(.*?)"', "Mathematics")
+        class_level = self._field(prompt, r'Suitable for:\s*(.+)', "Class 7")
+        size = re.search(r'(\d+)(?:-(\d+))? creative', prompt)
+        low, high = (int(size.group(1)), int(size.group(2) or size.group(1))) if size else (40, 50)
+        count = rng.randint(low, high)
+        ideas = []
+        for i in range(count):
+            if ideas and self.duplicate_rate and rng.random() < self.duplicate_rate:
+                # The same idea reworded, as models do when asked for many: same words, new order
+                match = re.match(r"(.*): (\w+) a property of a (\w+) in a real-life setting \((.*)\)$", rng.choice(ideas))
+                if match:
+                    self._count("duplicates")
+                    ideas.append(f"In a real-life setting, {match.group(2)} a property of a {match.group(3)} "
+                                 f"({match.group(1)} {match.group(4)})")
+                    continue
+            ideas.append(f"{topic}: {rng.choice(['compare', 'find', 'estimate', 'prove', 'explain'])} a property of a "
+                         f"{rng.choice(_SHAPES)} in a real-life setting (idea {i + 1}, seed {rng.randint(0, 10**6)})")
+        return json.dumps({"topic": topic, "class_level": class_level, "ideas": ideas})
+    
+    def _framer_text(self, prompt: str, rng: random.Random) -> str:
+        question_id = self._field(prompt, r'Question ID:\s*(\S+)', "Q00")
+        difficulty = self._field(prompt, r'Difficulty:\s*(\S+)', "intermediate")
+        idea = self._field(prompt, r'Idea:\s*(.+)', "a shape")
+        a, b = rng.randint(2, 20), rng.randint(2, 20)
+        shape = rng.choice(_SHAPES)
+        question = {
+            "question_id": question_id,
+            "question_text": f"A {shape} has sides $\\frac{{{a}}}{{2}}$ cm and ${b}$ cm ({idea[:60]}). "
+                             f"What is its perimeter?",
+            "options": [f"${a + b}$ cm", f"${a + 2 * b}$ cm", f"${2 * (a + b)}$ cm", f"${a * b}$ cm"],
+            "correct_option": rng.choice(["A", "B", "C", "D"]),
+            "difficulty": difficulty,
+            "needs_diagram": rng.random() < self.diagram_rate,
+        }
+        if self.repeat_question_rate and rng.random() < self.repeat_question_rate:
+            # The same question framed again from another idea, as a model tends to for similar ideas
+            stock = rng.randrange(_REPEATED_QUESTIONS)
+            question.update(self._stock_question(stock))
+            with self._lock:
+                repeated = stock in self._stock_questions_used
+                self._stock_questions_used.add(stock)
+            if repeated:
+                self._count("repeated_questions")
+        return json.dumps(question, ensure_ascii=False)
+    
+    def _stock_question(self, stock: int) -> dict:
+        rng = random.Random(f"{self.seed}:stock_question:{stock}")
+        a, b = rng.randint(2, 20), rng.randint(2, 20)
+        return {
+            "question_text": f"A {rng.choice(_SHAPES)} has sides ${a}$ cm and ${b}$ cm. What is its perimeter?",
+            "options": [f"${a + b}$ cm", f"${a + 2 * b}$ cm", f"${2 * (a + b)}$ cm", f"${a * b}$ cm"],
+            "correct_option": "C",
+        }
+    
+    def _validator_text(self, prompt: str, rng: random.Random) -> str:
+        if rng.random() >= self.rejection_rate:
+            return json.dumps({"is_valid": True, "feedback": _VALID_FEEDBACK, "suggested_corrections": None})
+        self._count("rejections")
+        corrections = None
+        if rng.random() < self.correction_rate:
+            corrections = {"correct_option": rng.choice(["A", "B", "C", "D"])}
+        return json.dumps({
+            "is_valid": False,
+            "feedback": "The marked answer does not match the computed perimeter; " * rng.randint(1, 4),
+            "suggested_corrections": corrections,
+        })
+    
+    def _diagram_text(self, prompt: str, rng: random.Random) -> str:
+        return json.dumps({
+            "diagram_code": "\\begin{tikzpicture}\\draw (0,0) -- (3,0) -- (1.5,2) -- cycle;\\end{tikzpicture}",
+            "needs_python_diagram": rng.random() < self.python_diagram_rate,
+            "insert_position": "below question",
+        })
+    
+    def _python_diagram_text(self, prompt: str, rng: random.Random) -> str:
+        return "fig, ax = plt.subplots(figsize=(4, 3))\nax.plot([0, 3, 1.5, 0], [0, 0, 2, 0])\nax.axis('off')"
+
+
+class FakeModel:
+    """Per-agent handle onto a FakeBackend with the generate_content() interface."""
+    
+    def __init__(self, backend: FakeBackend, agent_name: str):
+        self.backend = backend
+        self.agent_name = agent_name
+        self.model_name = "fake"
+    
+    def generate_content(self, prompt: str, **kwargs):
+        config = kwargs.get("generation_config") or {}
+        return self.backend.respond(self.agent_name, prompt, structured="response_schema" in config,
+                                    stream=bool(kwargs.get("stream")))
+
@@ -0,0 +1,81 @@
+"""
+Gemini: lazy, configure-once access to google.generativeai.
+"""
+
+import os
+import threading
+
+DEFAULT_MODEL_NAME = "gemini-2.5-flash-lite"
+
+_genai = None
+_genai_lock = threading.Lock()
+
+
+def get_genai():
+    """Import google.generativeai and configure it from .env on first use only."""
+    global _genai
+    with _genai_lock:
+        if _genai is None:
+            # Deferred: importing the SDK costs far more than everything else main.py loads
+            import google.generativeai as genai
+            from dotenv import load_dotenv
+            
+            load_dotenv()
+            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+            _genai = genai
+    return _genai
+
+
+class GeminiModel:
+    """A genai.GenerativeModel whose streamed responses can be abandoned (see GeminiStream)."""
+    
+    def __init__(self, inner):
+        self.inner = inner
+        self.model_name = inner.model_name
+    
+    def generate_content(self, prompt, **kwargs):
+        response = self.inner.generate_content(prompt, **kwargs)
+        if kwargs.get("stream"):
+            return GeminiStream(response)
+        return response
+
+
+class GeminiStream:
+    """A streamed genai response with a close() the SDK lacks: it cancels the underlying call,
+    so the server stops generating and the rest of the reply is never sent. Without it an
+    abandoned stream stays open until the whole reply has been generated."""
+    
+    def __init__(self, response):
+        self.response = response
+    
+    def __iter__(self):
+        return iter(self.response)
+    
+    def close(self):
+        # The SDK keeps the transport's iterator here until the stream is exhausted: a gRPC call
+        # (cancel) or, over REST, a generator reading the HTTP response (close)
+        iterator = getattr(self.response, "_iterator", None)
+        stop = getattr(iterator, "cancel", None) or getattr(iterator, "close", None)
+        if stop is not None:
+            stop()
+    
+    @property
+    def text(self) -> str:
+        return self.response.text
+    
+    @property
+    def usage_metadata(self):
+        return getattr(self.response, "usage_metadata", None)
+
+
+_models = {}
+
+
+def default_model(model_name: str = DEFAULT_MODEL_NAME):
+    """The Gemini model agents use when no model is injected. One instance per model name is
+    shared by every agent, so they reuse the SDK's client and its connections."""
+    genai = get_genai()
+    with _genai_lock:
+        if model_name not in _models:
+            _models[model_name] = GeminiModel(genai.GenerativeModel(model_name))
+        return _models[model_name]
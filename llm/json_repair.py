@@ -0,0 +1,251 @@
+"""
+JSON repair: Single-pass tolerant parser that salvages the JSON models actually write.
+
+Fixes, and names in the returned repairs list:
+- latex_escape: LaTeX commands with a single backslash (\\frac, \\times, \\neq, \\sqrt), which
+  are either invalid escapes or silently become control characters (\\f, \\t, \\n)
+- invalid_escape: any other backslash JSON does not allow
+- control_character: raw newlines and tabs inside strings
+- unescaped_quote: a double quote inside a string that does not end it
+- single_quotes, python_literal, unquoted_key: Python-style dicts ('a', True, None, {a: 1})
+- trailing_comma, extra_comma, missing_comma
+- trailing_text: prose or a second object after the first complete value
+- truncated: output cut off mid-way; incomplete members are dropped and brackets closed
+"""
+
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+# LaTeX commands starting with b, f, n, r or t: written with a single backslash, their first two
+# characters would be read as a control character. Any other letter after a backslash ("col1\tcol2")
+# is left as the JSON escape it is
+_LATEX_COMMANDS = (
+    "backslash", "because", "begin", "beta", "bigcap", "bigcup", "bigg", "bigl", "bigr", "big", "binom",
+    "bmod", "boldsymbol", "bot", "boxed", "bullet", "bar", "bf",
+    "forall", "frac", "frown", "flat",
+    "nabla", "neg", "neq", "newline", "ngeq", "nleq", "nmid", "notin", "not", "nparallel", "ne", "ni", "nu",
+    "rangle", "rceil", "rfloor", "rho", "rightarrow", "right", "rm", "root",
+    "tanh", "tan", "tau", "textbf", "textit", "textrm", "text", "tfrac", "therefore", "theta", "tilde",
+    "times", "top", "to", "triangle", "tt",
+)
+_LATEX_ESCAPE = re.compile(r'\\(?:%s)(?![a-zA-Z])' % "|".join(_LATEX_COMMANDS))
+# The same, unless the backslash is itself escaped ("\\frac" is valid JSON for \frac)
+_UNESCAPED_LATEX = re.compile(r'(?<!\\)(?:\\\\)*' + _LATEX_ESCAPE.pattern)
+_UNICODE_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{4}')
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+_TOKEN_END = set(' \t\r\n,:[]{}"\'')
+
+
+class _Container:
+    """An open object or array: its closing bracket, what it expects next, and where its
+    current member starts in the output (so a truncated member can be cut back out)."""
+    
+    __slots__ = ("closer", "expect", "start")
+    
+    def __init__(self, closer: str, start: int):
+        self.closer = closer
+        self.expect = "key" if closer == "}" else "value"
+        self.start = start
+    
+    @property
+    def is_object(self) -> bool:
+        return self.closer == "}"
+
+
+def _strip_trailing_comma(out: List[str]) -> bool:
+    """Remove trailing whitespace and one dangling comma from out; True if a comma went."""
+    while out and out[-1].isspace():
+        out.pop()
+    if out and out[-1] == ",":
+        out.pop()
+        return True
+    return False
+
+
+def read_string(text: str, i: int, note=None) -> Tuple[int, Optional[str]]:
+    """Read the string opening at text[i] (either quote style) as a JSON string literal.
+    
+    Returns (index after the string, literal); the literal is None if the text ends inside it.
+    note, if given, is called with the name of each repair.
+    """
+    note = note or (lambda kind: None)
+    quote = text[i]
+    n = len(text)
+    buf = ['"']
+    j = i + 1
+    while j < n:
+        ch = text[j]
+        if ch == '\\':
+            if j + 1 >= n:
+                return n, None
+            nxt = text[j + 1]
+            if quote == "'" and nxt == "'":
+                buf.append("'")
+                j += 2
+            elif nxt in '"\\/':
+                buf.append(text[j:j + 2])
+                j += 2
+            elif nxt == 'u' and _UNICODE_ESCAPE.match(text, j):
+                buf.append(text[j:j + 6])
+                j += 6
+            elif nxt in 'bfnrt' and not _LATEX_ESCAPE.match(text, j):
+                buf.append(text[j:j + 2])
+                j += 2
+            else:
+                # Keep the backslash as a literal one; the character after it is read normally
+                note("latex_escape" if nxt.isalpha() else "invalid_escape")
+                buf.append('\\\\')
+                j += 1
+            continue
+        
+        if ch == quote:
+            # A quote only ends the string if what follows could follow a string
+            k = j + 1
+            while k < n and text[k].isspace():
+                k += 1
+            if k >= n or text[k] in ',:}]' or '\n' in text[j + 1:k] or (k > j + 1 and text[k] == quote):
+                # ("x" "y": the next string starts after a space, so this one ends and a comma is missing)
+                buf.append('"')
+                return j + 1, "".join(buf)
+            note("unescaped_quote")
+            buf.append('\\"')
+        elif ch == '"':
+            buf.append('\\"')  # Plain character inside a single-quoted string
+        elif ch < ' ':
+            note("control_character")
+            buf.append(_CONTROL_ESCAPES.get(ch, f"\\u{ord(ch):04x}"))
+        else:
+            buf.append(ch)
+        j += 1
+    return n, None
+
+
+def repair_text(text: str) -> Tuple[str, List[str]]:
+    """Rewrite the JSON value at the start of text into strict JSON in one pass.
+    
+    Returns (fixed text, repairs made). Text that does not start with an object or array is
+    returned unchanged.
+    """
+    repairs = []
+    
+    def note(kind: str):
+        if kind not in repairs:
+            repairs.append(kind)
+    
+    text = text.strip()
+    if not text or text[0] not in "{[":
+        return text, repairs
+    
+    out = []
+    stack = []
+    n = len(text)
+    i = 0
+    cut = False  # Text ended inside a member that has to be dropped
+    while i < n:
+        c = text[i]
+        top = stack[-1] if stack else None
+        
+        if c.isspace():
+            out.append(c)
+            i += 1
+        
+        elif c in "{[":
+            if top:
+                top.expect = "child"
+            out.append(c)
+            stack.append(_Container("}" if c == "{" else "]", len(out)))
+            i += 1
+        
+        elif c in "}]":
+            if c != top.closer:
+                note("mismatched_bracket")
+            if _strip_trailing_comma(out):
+                note("trailing_comma")
+            if top.is_object and top.expect in ("colon", "value"):
+                # A key with no value: drop it
+                note("missing_value")
+                del out[top.start:]
+                _strip_trailing_comma(out)
+            out.append(top.closer)
+            stack.pop()
+            i += 1
+            if not stack:
+                if text[i:].strip():
+                    note("trailing_text")
+                return "".join(out), repairs
+            stack[-1].expect = "comma"
+        
+        elif c == ",":
+            if top.expect in ("comma", "child"):
+                top.start = len(out)
+                out.append(c)
+                top.expect = "key" if top.is_object else "value"
+            else:
+                note("extra_comma")
+            i += 1
+        
+        elif c == ":":
+            out.append(c)
+            top.expect = "value"
+            i += 1
+        
+        else:
+            if top.expect in ("comma", "child"):
+                # Two members with nothing between them
+                note("missing_comma")
+                top.start = len(out)
+                out.append(",")
+                top.expect = "key" if top.is_object else "value"
+            
+            if c in "\"'":
+                if c == "'":
+                    note("single_quotes")
+                i, literal = read_string(text, i, note)
+                if literal is None:
+                    cut = True
+                    break
+                out.append(literal)
+            else:
+                j = i
+                while j < n and text[j] not in _TOKEN_END:
+                    j += 1
+                token = text[i:j]
+                if j >= n and token not in _PYTHON_LITERALS and token not in ("true", "false", "null"):
+                    cut = True  # A number or partial literal may be incomplete
+                    break
+                if token in _PYTHON_LITERALS:
+                    note("python_literal")
+                    token = _PYTHON_LITERALS[token]
+                elif top.is_object and top.expect == "key":
+                    note("unquoted_key")
+                    token = json.dumps(token)
+                out.append(token)
+                i = j
+            top.expect = "colon" if top.is_object and top.expect == "key" else "comma"
+    
+    # The text ended before the outermost value closed
+    note("truncated")
+    top = stack[-1]
+    if cut or (top.is_object and top.expect in ("colon", "value")):
+        del out[top.start:]
+    for container in reversed(stack):
+        _strip_trailing_comma(out)
+        out.append(container.closer)
+    return "".join(out), repairs
+
+
+def repair_json(text: str) -> Tuple[Any, List[str]]:
+    """Parse the JSON value at the start of text, repairing it if needed.
+    
+    Returns (value, repairs). Strict JSON parses with no repairs unless it contains
+    single-backslash LaTeX. Raises ValueError (json.JSONDecodeError) if it cannot be salvaged.
+    """
+    if not _UNESCAPED_LATEX.search(text):
+        try:
+            return json.loads(text), []  # Most replies are fine; skip the Python-level scan
+        except ValueError:
+            pass
+    fixed, repairs = repair_text(text)
+    return json.loads(fixed), repairs
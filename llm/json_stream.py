@@ -0,0 +1,94 @@
+"""
+JSON stream: Incremental parser that pulls array items out of a JSON reply as it streams in.
+"""
+
+import json
+import re
+from typing import Any, List, Optional
+
+from llm.json_repair import read_string, repair_json
+
+
+def _value_end(text: str, i: int) -> Optional[int]:
+    """Index just past the non-string value starting at text[i], or None if it is not complete yet."""
+    depth = 0
+    n = len(text)
+    while i < n:
+        c = text[i]
+        if c in "\"'":
+            i, literal = read_string(text, i)
+            if literal is None:
+                return None
+            continue
+        if c in "{[":
+            depth += 1
+        elif c in "}]":
+            if depth == 0:
+                return i
+            depth -= 1
+        elif c == "," and depth == 0:
+            return i
+        i += 1
+    return None
+
+
+class JSONArrayStream:
+    """Yields the items of the array under `key` (e.g. "ideas": [...]) as soon as each is complete.
+    
+    feed() takes the next chunk of the reply and returns the items it completed. Text before the
+    array is skipped, strings get the same escape repairs as llm/json_repair.py, and a string
+    is only emitted once something follows its closing quote (or with final=True), so a quote
+    split across chunks is never mistaken for the end of the item.
+    """
+    
+    def __init__(self, key: str):
+        self._opening = re.compile(r'["\']%s["\']\s*:\s*\[' % re.escape(key))
+        self._buffer = ""
+        self.started = False
+        self.done = False
+    
+    def feed(self, chunk: str, final: bool = False) -> List[Any]:
+        items = []
+        if self.done:
+            return items
+        self._buffer += chunk
+        if not self.started:
+            match = self._opening.search(self._buffer)
+            if not match:
+                return items
+            self.started = True
+            self._buffer = self._buffer[match.end():]
+        
+        text = self._buffer
+        n = len(text)
+        i = 0
+        while True:
+            while i < n and (text[i].isspace() or text[i] == ","):
+                i += 1
+            if i >= n:
+                break
+            if text[i] == "]":
+                self.done = True
+                i += 1
+                break
+            
+            if text[i] in "\"'":
+                end, literal = read_string(text, i)
+                if literal is None or (end >= n and not final):
+                    break
+                items.append(json.loads(literal))
+            else:
+                end = _value_end(text, i)
+                if end is None:
+                    if not final:
+                        break
+                    end = n
+                try:
+                    items.append(repair_json(text[i:end])[0])
+                except ValueError:
+                    pass  # A truncated number or object; nothing worth keeping
+            i = end
+        
+        # Drop what has been consumed so every chunk is scanned once
+        self._buffer = text[i:]
+        return items
@@ -0,0 +1,149 @@
+"""
+RateLimiter: Requests-per-minute and tokens-per-minute token buckets shared by every agent.
+"""
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from telemetry.metrics import REGISTRY
+from telemetry.tracing import span
+
+try:
+    import fcntl  # Cross-process state file; not available on Windows
+except ImportError:
+    fcntl = None
+
+RATE_LIMIT_WAIT_SECONDS = REGISTRY.histogram(
+    "qpg_rate_limit_wait_seconds", "Time LLM calls spent blocked by the rate limiter.", ["agent"],
+    buckets=(0.0, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+
+# Output tokens assumed for a call before its real usage is known
+DEFAULT_EXPECTED_OUTPUT_TOKENS = 512
+
+
+class RateLimiter:
+    """Two token buckets (requests and tokens) refilled continuously at rpm/60 and tpm/60 per second.
+    
+    acquire() blocks until both budgets allow the call. With state_path, the buckets live in a
+    flock-protected JSON file so every process pointing at it draws from the same budget
+    (e.g. all --batch workers); otherwise they are shared by the threads of this process.
+    clock and sleep (time.time and time.sleep by default) measure and wait out the refills.
+    """
+    
+    def __init__(self, requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 state_path: Optional[str] = None, clock: Callable[[], float] = time.time,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.rpm = requests_per_minute
+        self.tpm = tokens_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self.state_path = Path(state_path) if state_path and fcntl is not None else None
+        if self.state_path:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._state = self._full_state()
+    
+    def _full_state(self) -> Dict[str, float]:
+        return {"requests": self.rpm or 0.0, "tokens": self.tpm or 0.0, "updated": self.clock()}
+    
+    @contextmanager
+    def _locked_state(self):
+        """Yield the bucket state dict under an exclusive lock, persisting any changes."""
+        with self._lock:
+            if self.state_path is None:
+                yield self._state
+                return
+            with open(self.state_path, 'a+', encoding='utf-8') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    f.seek(0)
+                    try:
+                        state = json.loads(f.read())
+                    except ValueError:
+                        state = self._full_state()  # New or unreadable file: start with full buckets
+                    yield state
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(state))
+                    f.flush()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+    
+    def _refill(self, state: Dict[str, float], now: float):
+        elapsed = max(0.0, now - state["updated"])
+        if self.rpm:
+            state["requests"] = min(self.rpm, state["requests"] + elapsed * self.rpm / 60)
+        if self.tpm:
+            state["tokens"] = min(self.tpm, state["tokens"] + elapsed * self.tpm / 60)
+        state["updated"] = now
+    
+    def acquire(self, tokens: int = 0) -> float:
+        """Block until one request and `tokens` tokens are available, take them and return
+        the seconds spent waiting."""
+        if not self.rpm and not self.tpm:
+            return 0.0
+        # A call larger than the whole per-minute budget can still go once the bucket is full
+        tokens = min(tokens, self.tpm) if self.tpm else 0
+        started = self.clock()
+        
+        while True:
+            with self._locked_state() as state:
+                now = self.clock()
+                self._refill(state, now)
+                wait = 0.0
+                if self.rpm and state["requests"] < 1:
+                    wait = max(wait, (1 - state["requests"]) * 60 / self.rpm)
+                if self.tpm and state["tokens"] < tokens:
+                    wait = max(wait, (tokens - state["tokens"]) * 60 / self.tpm)
+                if wait == 0.0:
+                    if self.rpm:
+                        state["requests"] -= 1
+                    if self.tpm:
+                        state["tokens"] -= tokens
+                    return now - started
+            self.sleep(wait)
+    
+    def settle(self, estimated_tokens: int, actual_tokens: int):
+        """Correct the token bucket once a call's real usage is known (may leave it in debt)."""
+        if not self.tpm or actual_tokens == estimated_tokens:
+            return
+        with self._locked_state() as state:
+            self._refill(state, self.clock())
+            state["tokens"] -= actual_tokens - min(estimated_tokens, self.tpm)
+
+
+class RateLimitedModel:
+    """Wraps a model so every call first draws from a shared RateLimiter.
+    
+    The token cost is estimated from the prompt (about 4 characters per token) plus
+    expected_output_tokens, then corrected from the response's usage_metadata.
+    """
+    
+    def __init__(self, inner, limiter: RateLimiter, agent_name: str,
+                 expected_output_tokens: int = DEFAULT_EXPECTED_OUTPUT_TOKENS):
+        self.inner = inner
+        self.limiter = limiter
+        self.agent_name = agent_name
+        self.expected_output_tokens = expected_output_tokens
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        estimated = len(prompt) // 4 + self.expected_output_tokens
+        with span("rate_limit_wait", agent=self.agent_name) as trace:
+            waited = self.limiter.acquire(estimated)
+            trace.set(waited_seconds=round(waited, 3))
+        RATE_LIMIT_WAIT_SECONDS.observe(waited, agent=self.agent_name)
+        
+        response = self.inner.generate_content(prompt, **kwargs)
+        
+        if kwargs.get("stream"):
+            return response  # Streamed usage arrives later; the estimate stands
+        usage = getattr(response, "usage_metadata", None)
+        actual = getattr(usage, "total_token_count", 0) or 0
+        if actual:
+            self.limiter.settle(estimated, actual)
+        return response
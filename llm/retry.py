@@ -0,0 +1,194 @@
+"""
+Retry: Backoff-with-jitter retries and a circuit breaker around generate_content.
+"""
+
+import random
+import re
+import threading
+import time
+from typing import Callable
+
+from telemetry.metrics import REGISTRY
+from telemetry.tracing import span
+
+LLM_RETRIES = REGISTRY.counter(
+    "qpg_llm_retries_total", "LLM calls retried after a transient error.", ["agent"])
+CIRCUIT_OPENED = REGISTRY.counter(
+    "qpg_llm_circuit_open_total", "Times the circuit breaker opened after repeated transient errors.")
+
+TRANSIENT_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# google.api_core exception class names, matched by name so the SDK need not be imported
+TRANSIENT_ERROR_NAMES = {
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError",
+    "DeadlineExceeded", "GatewayTimeout", "BadGateway", "Aborted", "RetryError",
+}
+
+_STATUS_IN_MESSAGE = re.compile(r'\b(408|429|500|502|503|504)\b')
+_TRANSIENT_WORDS = re.compile(r'rate limit|quota|exhausted|unavailable|timed? ?out|deadline|overloaded', re.IGNORECASE)
+
+
+class ProviderUnavailableError(RuntimeError):
+    """Raised for every call once the circuit breaker has given up on the endpoint."""
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for errors worth retrying (rate limits, timeouts, 5xx); False for permanent ones
+    such as a bad request, missing permission or a blocked prompt."""
+    if isinstance(error, ProviderUnavailableError):
+        return False
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in TRANSIENT_ERROR_NAMES:
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in TRANSIENT_STATUS_CODES
+    message = str(error)
+    return bool(_STATUS_IN_MESSAGE.search(message) or _TRANSIENT_WORDS.search(message))
+
+
+class RetryPolicy:
+    """Up to max_attempts tries with full-jitter exponential backoff between them."""
+    
+    def __init__(self, max_attempts: int = 4, base_delay: float = 1.0, max_delay: float = 30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+    
+    def delay(self, retry_number: int) -> float:
+        """Seconds to wait before retry number `retry_number` (1-based)."""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry_number - 1)))
+
+
+class CircuitBreaker:
+    """Opens after failure_threshold consecutive transient errors.
+    
+    While open, callers wait (the run pauses) instead of failing or calling. After
+    reset_timeout one probe call goes through: success closes the breaker, failure reopens it
+    with the timeout doubled (up to max_reset_timeout). A probe that reports neither within
+    probe_timeout (its caller hung or died) is given up on and the next waiting caller probes.
+    
+    After max_failed_probes probes in a row have failed (about 12 minutes of outage with the
+    defaults) the endpoint is given up on: every waiting and later call raises
+    ProviderUnavailableError, so the run fails instead of pausing forever.
+    """
+    
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 300.0,
+                 probe_timeout: float = 60.0, max_failed_probes: int = 5, clock: Callable[[], float] = time.time):
+        self.failure_threshold = failure_threshold
+        self.base_reset_timeout = reset_timeout
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+        self.probe_timeout = probe_timeout
+        self.max_failed_probes = max_failed_probes
+        self.clock = clock
+        self._condition = threading.Condition()
+        self.state = "closed"
+        self.failures = 0
+        self.failed_probes = 0
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+    
+    def check(self):
+        """Raise ProviderUnavailableError if the breaker has given up on the endpoint."""
+        if self.state == "unavailable":
+            raise ProviderUnavailableError(
+                f"LLM provider unavailable: {self.failed_probes} probes failed in a row after "
+                f"{self.failure_threshold} consecutive transient errors")
+    
+    def before_call(self) -> float:
+        """Block while the breaker is open; return the seconds spent waiting."""
+        started = self.clock()
+        with self._condition:
+            while True:
+                self.check()
+                now = self.clock()
+                if self.state == "closed":
+                    return now - started
+                if self.state == "open":
+                    remaining = self.opened_at + self.reset_timeout - now
+                else:
+                    # Another caller's probe is in flight; wait for its verdict, but not forever
+                    remaining = self.probe_started + self.probe_timeout - now
+                if remaining <= 0:
+                    self.state = "half_open"  # This caller is the probe
+                    self.probe_started = now
+                    return now - started
+                self._condition.wait(remaining)
+    
+    def record_success(self):
+        with self._condition:
+            if self.state == "unavailable":
+                return  # A call that started before the breaker gave up; the run is failing anyway
+            self.state = "closed"
+            self.failures = 0
+            self.failed_probes = 0
+            self.reset_timeout = self.base_reset_timeout
+            self._condition.notify_all()
+    
+    def record_failure(self):
+        with self._condition:
+            self.failures += 1
+            if self.state == "half_open":
+                self.failed_probes += 1
+                if self.failed_probes >= self.max_failed_probes:
+                    print(f"   🔌 LLM endpoint still failing after {self.failed_probes} probes; giving up")
+                    self.state = "unavailable"
+                    self._condition.notify_all()
+                    return
+                self.reset_timeout = min(self.max_reset_timeout, self.reset_timeout * 2)
+                self._open()
+            elif self.state == "closed" and self.failures >= self.failure_threshold:
+                self._open()
+    
+    def _open(self):
+        print(f"   🔌 LLM endpoint failing; pausing calls for {self.reset_timeout:.0f}s")
+        self.state = "open"
+        self.opened_at = self.clock()
+        CIRCUIT_OPENED.inc()
+        self._condition.notify_all()
+
+
+class RetryingModel:
+    """Wraps a model with RetryPolicy retries for transient errors and a shared CircuitBreaker.
+    
+    Permanent errors are raised at once. Backoff sleeps block the calling thread: in the async
+    and staged modes that is one worker thread and other questions keep going, but a sequential
+    run (including a --batch job without concurrency) pauses for the backoff.
+    """
+    
+    def __init__(self, inner, agent_name: str, policy: RetryPolicy = None, breaker: CircuitBreaker = None):
+        self.inner = inner
+        self.agent_name = agent_name
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.breaker:
+                self.breaker.before_call()
+            try:
+                response = self.inner.generate_content(prompt, **kwargs)
+            except Exception as e:
+                transient = is_transient(e)
+                if self.breaker:
+                    if transient:
+                        self.breaker.record_failure()
+                    else:
+                        self.breaker.record_success()  # The endpoint answered; the request was bad
+                if not transient or attempt >= self.policy.max_attempts:
+                    raise
+                delay = self.policy.delay(attempt)
+                LLM_RETRIES.inc(agent=self.agent_name)
+                print(f"   🔁 {self.agent_name} call failed ({e}); retry {attempt}/{self.policy.max_attempts - 1} in {delay:.1f}s")
+                with span("retry_backoff", agent=self.agent_name, attempt=attempt, error=str(e)[:200]):
+                    time.sleep(delay)
+                continue
+            
+            if self.breaker:
+                self.breaker.record_success()
+            return response
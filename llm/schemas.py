@@ -0,0 +1,104 @@
+"""
+Schemas: Response schemas for each agent's JSON output, and a strict local validator.
+
+The schemas use the OpenAPI subset Gemini accepts as response_schema (type, properties,
+required, items, enum, nullable), so the same dict constrains generation and checks the result.
+"""
+
+from typing import Any, Dict, List
+
+RESEARCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "topic": {"type": "string"},
+        "class_level": {"type": "string"},
+        "ideas": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["ideas"],
+}
+
+FRAMER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question_id": {"type": "string"},
+        "question_text": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "correct_option": {"type": "string", "enum": ["A", "B", "C", "D"]},
+        "difficulty": {"type": "string", "enum": ["basic", "intermediate", "advanced"]},
+        "needs_diagram": {"type": "boolean"},
+    },
+    "required": ["question_text", "options", "correct_option", "needs_diagram"],
+}
+
+VALIDATOR_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "is_valid": {"type": "boolean"},
+        "feedback": {"type": "string"},
+        "suggested_corrections": {
+            "type": "object",
+            "nullable": True,
+            "properties": {
+                "question_text": {"type": "string"},
+                "options": {"type": "array", "items": {"type": "string"}},
+                "correct_option": {"type": "string", "enum": ["A", "B", "C", "D"]},
+            },
+        },
+    },
+    "required": ["is_valid", "feedback"],
+}
+
+DIAGRAM_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "diagram_code": {"type": "string"},
+        "needs_python_diagram": {"type": "boolean"},
+        "insert_position": {"type": "string"},
+    },
+    "required": ["diagram_code", "needs_python_diagram"],
+}
+
+SCHEMAS = {
+    "research": RESEARCH_SCHEMA,
+    "framer": FRAMER_SCHEMA,
+    "validator": VALIDATOR_SCHEMA,
+    "diagram": DIAGRAM_SCHEMA,
+}
+
+_TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "boolean": lambda v: isinstance(v, bool),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+}
+
+
+def schema_errors(value: Any, schema: Dict[str, Any], path: str = "$") -> List[str]:
+    """Every way value breaks schema, as "path: problem" strings (empty if it conforms).
+    
+    Properties the schema does not mention are allowed; only declared ones are checked.
+    """
+    if value is None:
+        return [] if schema.get("nullable") else [f"{path}: is null"]
+    
+    expected = schema.get("type", "").lower()
+    check = _TYPE_CHECKS.get(expected)
+    if check and not check(value):
+        return [f"{path}: expected {expected}, got {type(value).__name__}"]
+    
+    errors = []
+    if "enum" in schema and value not in schema["enum"]:
+        errors.append(f"{path}: {value!r} is not one of {schema['enum']}")
+    if expected == "object":
+        for name in schema.get("required", []):
+            if name not in value:
+                errors.append(f"{path}: missing required property '{name}'")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in value:
+                errors.extend(schema_errors(value[name], subschema, f"{path}.{name}"))
+    elif expected == "array" and "items" in schema:
+        for i, item in enumerate(value):
+            errors.extend(schema_errors(item, schema["items"], f"{path}[{i}]"))
+    return errors
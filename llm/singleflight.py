@@ -0,0 +1,84 @@
+"""
+SingleFlight: Coalesces identical in-flight LLM calls so concurrent callers share one request.
+"""
+
+import threading
+from typing import Any, Callable, Dict
+
+from llm.cache import prompt_key
+from llm.cassette import _model_name
+from telemetry.metrics import REGISTRY
+
+COALESCED_CALLS = REGISTRY.counter(
+    "qpg_llm_coalesced_calls_total", "LLM calls that waited for an identical in-flight call instead of sending their own.", ["agent"])
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0  # Callers sharing this call's outcome
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time; callers arriving while it runs wait and get its outcome."""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+    
+    def do(self, key: str, fn: Callable[[], Any]) -> tuple:
+        """Return (result, shared); shared is True when another caller's call supplied the result."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+        
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Later callers start a fresh call; only those already waiting share this one
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+# Shared by every generator in the process, so e.g. two runs researching one topic make one call
+DEFAULT_GROUP = SingleFlight()
+
+
+class CoalescingModel:
+    """Wraps a model so identical concurrent prompts (same model, prompt and options) share one call.
+    
+    Streaming calls are never coalesced: a stream can only be consumed once.
+    """
+    
+    def __init__(self, inner, agent_name: str, group: SingleFlight = None):
+        self.inner = inner
+        self.agent_name = agent_name
+        self.group = group or DEFAULT_GROUP
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        if kwargs.get("stream"):
+            return self.inner.generate_content(prompt, **kwargs)
+        
+        key = prompt_key(_model_name(self.inner), prompt, kwargs)
+        response, shared = self.group.do(key, lambda: self.inner.generate_content(prompt, **kwargs))
+        if shared:
+            COALESCED_CALLS.inc(agent=self.agent_name)
+        return response
@@ -4,42 +4,260 @@ Orchestrates agents to generate LaTeX-formatted question papers with 25 validate
 """
 
 import sys
+import threading
 import argparse
 import json  # NEW: For loading JSON
+import math
+from collections import Counter
 from pathlib import Path
-from dotenv import load_dotenv
+from typing import Dict, Any, Iterator, List, Optional
 
-from agents.research_agent import ResearchAgent
+from agents.research_agent import ResearchAgent, MAX_IDEAS_PER_CALL, MAX_PARALLEL_CALLS, split_topic
 from agents.question_framer_agent import QuestionFramerAgent
 from agents.validator_agent import ValidatorAgent
 from agents.diagram_agent import DiagramAgent
 from agents.python_diagram_agent import PythonDiagramAgent
 from writers.latex_writer import LaTeXWriter
+from pipeline.idea_pool import IdeaPool
+from pipeline.minhash import MinHashIndex, word_shingles
+from pipeline.journal import RunJournal
+from llm.client import build_client, provider_factory
+from llm.cache import ResponseCache, DEFAULT_MAX_BYTES
+from llm.ratelimit import RateLimiter
+from llm.retry import RetryPolicy, CircuitBreaker
+from telemetry.tracing import Tracer, set_tracer, span
+from telemetry.accounting import UsageLedger, question_scope
+from telemetry.metrics import DUPLICATE_QUESTIONS, QUESTIONS_WRITTEN, TextfileExporter, start_http_server
 
-load_dotenv()  # Load environment variables from .env file
+# Research is sized from the share of ideas that become accepted questions. Until a run has
+# attempts of its own, it behaves as if PRIOR_ATTEMPTS ideas had converted at PRIOR_ACCEPT_RATE.
+PRIOR_ACCEPT_RATE = 0.7
+PRIOR_ATTEMPTS = 10
+IDEA_MARGIN = 1.2
+MIN_RESEARCH_IDEAS = 5
 
 
 class QuestionPaperGenerator:
     """Main orchestrator for the loop-based multi-agent system."""
     
-    def __init__(self, output_dir: str = "question_paper"):
+    def __init__(self, output_dir: str = "question_paper", model_factory=None, usage_ledger: UsageLedger = None,
+                 response_cache: ResponseCache = None, rate_limiter: RateLimiter = None,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None,
+                 llm_timeout: Optional[float] = None, structured_output: bool = False, stream_validation: bool = False,
+                 stream_research: bool = False, idea_low_watermark: int = 10, split_topics: bool = False,
+                 idea_dedup_threshold: float = 0.8, question_dedup_threshold: float = 0.9):
+        """model_factory, if given, is called with an agent name ("research", "framer", "validator",
+        "diagram", "python_diagram") and returns the model object that agent should call.
+        usage_ledger collects token counts; pass one with prices to get cost estimates.
+        response_cache, if given, serves repeated prompts without calling the model.
+        rate_limiter, if given, holds every agent's calls to one shared RPM/TPM budget.
+        retry_policy controls how transient API errors are retried (default: RetryPolicy()).
+        circuit_breaker pauses every agent's calls during an outage and fails the run once it gives
+        up on the endpoint (default: CircuitBreaker()).
+        llm_timeout, if given, fails (and so retries) any single LLM call that takes longer.
+        structured_output asks the model for JSON constrained to each agent's schema (llm/schemas.py).
+        stream_validation streams validator replies and accepts as soon as "is_valid": true arrives.
+        stream_research starts framing questions while the research reply is still streaming in.
+        idea_low_watermark is how few unused ideas may be left before more are researched in the background.
+        split_topics researches each part of a compound topic ("A, B") separately and gives each an
+        equal share of the paper.
+        idea_dedup_threshold drops researched ideas whose content words overlap an earlier idea's at least
+        this much (Jaccard similarity, pipeline/minhash.py); 0 keeps every distinct idea.
+        question_dedup_threshold likewise skips a validated question (text and options) this close to
+        one already in the paper, before its diagram is made; 0 disables the check."""
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
         (self.output_dir / "images").mkdir(exist_ok=True)
         
-        self.research_agent = ResearchAgent()
-        self.question_framer = QuestionFramerAgent()
-        self.validator = ValidatorAgent()
-        self.diagram_agent = DiagramAgent()
-        self.python_diagram_agent = PythonDiagramAgent(str(self.output_dir / "images"))
+        # Agents (and the Gemini SDK behind them) are built on first use, so --from-json never loads them
+        self.model_factory = model_factory or (lambda agent_name: None)
+        self.usage = usage_ledger or UsageLedger()
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.llm_timeout = llm_timeout
+        self.structured_output = structured_output
+        self.stream_validation = stream_validation
+        self.stream_research = stream_research
+        self.idea_low_watermark = idea_low_watermark
+        self.split_topics = split_topics
+        self.idea_dedup_threshold = idea_dedup_threshold
+        self.question_dedup_threshold = question_dedup_threshold
+        # One breaker for all agents: they share the endpoint, so they share its outages
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        self._agents = {}
+        self._agents_lock = threading.Lock()
+        self._counts_lock = threading.Lock()
         
         self.validated_questions = []
-        self.question_ideas = []
+        self.idea_pools = {}
         self.latex_writer = None
+        self.journal = None
+        self.pending_jobs = []
     
-    def generate(self, topic_name: str, class_level: str, target_question_count: int = 25) -> dict:
+    def _agent(self, agent_name: str):
+        """Build an agent the first time it is needed and cache it."""
+        agent = self._agents.get(agent_name)
+        if agent is not None:
+            return agent
+        with self._agents_lock:
+            if agent_name not in self._agents:
+                # One client stack per agent: cache, coalescing, retries, metering, rate limit, metrics
+                llm = build_client(agent_name, self.model_factory(agent_name), usage=self.usage,
+                                   cache=self.response_cache, rate_limiter=self.rate_limiter,
+                                   retry_policy=self.retry_policy, breaker=self.circuit_breaker,
+                                   timeout=self.llm_timeout, structured=self.structured_output)
+                if agent_name == "research":
+                    agent = ResearchAgent(llm)
+                elif agent_name == "framer":
+                    agent = QuestionFramerAgent(llm)
+                elif agent_name == "validator":
+                    agent = ValidatorAgent(llm, stream=self.stream_validation)
+                elif agent_name == "diagram":
+                    agent = DiagramAgent(llm)
+                else:
+                    agent = PythonDiagramAgent(str(self.output_dir / "images"), llm)
+                self._agents[agent_name] = agent
+            return self._agents[agent_name]
+    
+    @property
+    def research_agent(self) -> ResearchAgent:
+        return self._agent("research")
+    
+    @property
+    def question_framer(self) -> QuestionFramerAgent:
+        return self._agent("framer")
+    
+    @property
+    def validator(self) -> ValidatorAgent:
+        return self._agent("validator")
+    
+    @property
+    def diagram_agent(self) -> DiagramAgent:
+        return self._agent("diagram")
+    
+    @property
+    def python_diagram_agent(self) -> PythonDiagramAgent:
+        return self._agent("python_diagram")
+    
+    def generate(self, topic_name: str, class_level: str, target_question_count: int = 25,
+                 resume: bool = False) -> dict:
         """Main generation loop that continues until target_question_count validated questions are produced."""
         
+        base_filename = self._start_run(topic_name, class_level, target_question_count, resume)
+        
+        # Step 2-4: Loop until we have 25 validated questions
+        print("\n🔄 Starting question generation and validation loop...")
+        print("   (Questions will be written to LaTeX file as they are created)\n")
+        
+        while len(self.validated_questions) < target_question_count:
+            job = self._next_job(topic_name, class_level)
+            if job is None:
+                break  # Safety limit reached
+            
+            question = self._process_job(job, topic_name, class_level)
+            if question is not None:
+                self._accept_question(question, target_question_count)
+        
+        return self._finish_run(topic_name, class_level, target_question_count, base_filename)
+    
+    async def generate_async(self, topic_name: str, class_level: str, target_question_count: int = 25,
+                             concurrency: int = 4, resume: bool = False) -> dict:
+        """Concurrent variant of generate() that keeps up to `concurrency` ideas in flight at once.
+        
+        Each in-flight idea runs frame -> validate -> diagram on a worker thread (the agents are
+        blocking network calls); accepted questions are written from the event loop, so the
+        LaTeX file is only ever touched by one coroutine. No more ideas are launched than are
+        still needed to reach target_question_count, so the run stops as soon as the target is met.
+        """
+        # asyncio and the executor machinery are imported only by the modes that use them
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+        
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="qpg-worker")
+        
+        try:
+            base_filename = await loop.run_in_executor(
+                executor, self._start_run, topic_name, class_level, target_question_count, resume
+            )
+            
+            print(f"\n🔄 Starting concurrent generation loop ({concurrency} ideas in flight)...")
+            print("   (Questions will be written to LaTeX file as they are created)\n")
+            
+            in_flight = {}  # future -> job
+            exhausted = False
+            
+            while len(self.validated_questions) < target_question_count:
+                # Top up the in-flight set, never exceeding what is still needed
+                remaining = target_question_count - len(self.validated_questions)
+                while not exhausted and len(in_flight) < min(concurrency, remaining):
+                    job = await loop.run_in_executor(executor, self._next_job, topic_name, class_level)
+                    if job is None:
+                        exhausted = True  # Safety limit reached
+                        break
+                    future = loop.run_in_executor(executor, self._process_job, job, topic_name, class_level)
+                    in_flight[future] = job
+                
+                if not in_flight:
+                    break
+                
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    try:
+                        question = future.result()
+                    except Exception as e:
+                        print(f"      ❌ Question worker failed: {e}")
+                        # Release its slot and journal it, so neither quotas nor a --resume count it as open
+                        self._drop(job, f"worker failed: {e}")
+                        continue
+                    if question is None:
+                        continue
+                    if len(self.validated_questions) < target_question_count:
+                        self._accept_question(question, target_question_count)
+                    else:
+                        self._drop(question, "paper already complete", failed=False)
+            
+            return await loop.run_in_executor(
+                executor, self._finish_run, topic_name, class_level, target_question_count, base_filename
+            )
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    async def generate_staged(self, topic_name: str, class_level: str, target_question_count: int = 25,
+                              framer_workers: int = 2, validator_workers: int = 4, diagram_workers: int = 2,
+                              writer_workers: int = 1, queue_size: int = 8, resume: bool = False) -> dict:
+        """Pipelined variant of generate(): framer, validator, diagram and writer run as separate
+        stages with their own worker counts and bounded queues (see pipeline/staged.py)."""
+        import asyncio
+        from pipeline.staged import StagedPipeline
+        
+        loop = asyncio.get_running_loop()
+        base_filename = await loop.run_in_executor(
+            None, self._start_run, topic_name, class_level, target_question_count, resume
+        )
+        
+        print(f"\n🔄 Starting staged pipeline (framer={framer_workers}, validator={validator_workers}, "
+              f"diagram={diagram_workers}, writer={writer_workers}, queue size={queue_size})...")
+        print("   (Questions will be written to LaTeX file as they are created)\n")
+        
+        pipeline = StagedPipeline(self, framer_workers, validator_workers, diagram_workers,
+                                  writer_workers, queue_size)
+        await pipeline.run(topic_name, class_level, target_question_count)
+        
+        return await loop.run_in_executor(
+            None, self._finish_run, topic_name, class_level, target_question_count, base_filename
+        )
+    
+    def _start_run(self, topic_name: str, class_level: str, target_question_count: int,
+                   resume: bool = False) -> str:
+        """Reset per-run state, open the LaTeX file and research the first batch of ideas.
+        
+        With resume=True the run journal is replayed instead: accepted questions are rewritten
+        to a fresh LaTeX file, the idea list and cursors are restored, and unfinished questions
+        are queued to continue from their last completed step.
+        """
         print(f"🚀 Starting question paper generation for: {topic_name} - {class_level}")
         
         # Initialize LaTeX file for incremental writing
@@ -50,114 +268,363 @@ class QuestionPaperGenerator:
         self.latex_writer.initialize()
         print(f"📝 Initialized LaTeX file: {main_tex_path}")
         
-        # Step 1: Research and Idea Generation
-        print("\n📚 Step 1: Researching question ideas...")
-        research_result = self.research_agent.generate_ideas(topic_name, class_level)
-        self.question_ideas = research_result.get("ideas", [])
-        print(f"✅ Generated {len(self.question_ideas)} question ideas")
+        self.journal = RunJournal(self.output_dir / f"{base_filename}.journal.jsonl")
+        state = self.journal.load() if resume else None
+        if resume and not (state["ideas"] or state["accepted"]):
+            print("   ⚠️  No journal to resume from, starting a fresh run")
+            resume = False
+        self.journal.open(resume)
         
-        # Step 2-4: Loop until we have 25 validated questions
-        print("\n🔄 Starting question generation and validation loop...")
-        print("   (Questions will be written to LaTeX file as they are created)\n")
+        self.validated_questions = []
+        # Accepted questions, so a new one that repeats any of them is caught before its diagram. Word
+        # trigrams keep templated questions with other numbers apart; 8 rows per band keep them out of each
+        # other's buckets
+        self.question_dedup = (MinHashIndex(self.question_dedup_threshold, shingler=word_shingles, num_perm=64)
+                               if self.question_dedup_threshold > 0 else None)
+        self.pending_jobs = []
+        self.usage.reset()
+        self.question_counter = 0
+        self.dropped_count = 0
+        self.open_jobs = Counter()
+        self.accepted_counts = Counter()  # Per subtopic, so quota checks don't rescan the paper
+        self.iteration = 0
+        # Safety limit: 200 attempts for a standard paper, scaled up for large ones
+        self.max_iterations = max(200, target_question_count * 8)
+        self.target_question_count = target_question_count
         
-        idea_index = 0
-        question_counter = 0
-        max_iterations = 200  # Safety limit
-        iteration = 0
+        # Each subtopic gets its own ideas and an equal share (quota) of the paper
+        self.topic_name = topic_name
+        self.subtopics = split_topic(topic_name) if self.split_topics else [topic_name]
+        self.quotas = {
+            subtopic: target_question_count // len(self.subtopics) + (1 if i < target_question_count % len(self.subtopics) else 0)
+            for i, subtopic in enumerate(self.subtopics)
+        }
+        # One index across all subtopics, so overlapping subtopics don't frame the same idea twice
+        self.idea_dedup = MinHashIndex(self.idea_dedup_threshold) if self.idea_dedup_threshold > 0 else None
+        
+        if resume:
+            print(f"\n♻️  Resuming from journal: {self.journal.path}")
+            cursors = state["cursor"].get("idea_cursors") or {topic_name: state["cursor"].get("idea_index", 0)}
+            self.idea_pools = {
+                subtopic: self._idea_pool(topic_name, class_level, subtopic,
+                                          state["subtopic_ideas"].get(subtopic, []) if self._is_split() else state["ideas"],
+                                          cursors.get(subtopic, 0))
+                for subtopic in self.subtopics
+            }
+            self.question_counter = state["cursor"].get("question_counter", 0)
+            self.iteration = state["cursor"].get("iteration", 0)
+            self.dropped_count = state["dropped"]
+            
+            # Rebuild the LaTeX file from what was already accepted
+            for question in state["accepted"][:target_question_count]:
+                self.validated_questions.append(question)
+                self.accepted_counts[self._subtopic_of(question)] += 1
+                if self.question_dedup is not None:
+                    self.question_dedup.add(self._question_fingerprint(question), check=False,
+                                            key=question.get("question_id"))
+                self.latex_writer.write_question(question)
+            idea_count = sum(len(pool) for pool in self.idea_pools.values())
+            print(f"✅ Restored {len(self.validated_questions)} questions and {idea_count} ideas")
+            
+            # Finished questions whose acceptance was lost only need writing
+            for job in state["pending"].values():
+                if job.get("diagram_done") and len(self.validated_questions) < target_question_count:
+                    self.open_jobs[self._subtopic_of(job)] += 1
+                    self._accept_question(job["question"], target_question_count)
+                elif not job.get("diagram_done"):
+                    self.open_jobs[self._subtopic_of(job)] += 1
+                    self.pending_jobs.append(job)
+            if self.pending_jobs:
+                print(f"   ↪️  {len(self.pending_jobs)} unfinished questions will continue where they stopped")
+            
+            self.journal.record("run_resumed", target_question_count=target_question_count)
+        else:
+            self.journal.record("run_started", topic=topic_name, class_level=class_level,
+                                target_question_count=target_question_count)
+            
+            # Step 1: Research and Idea Generation
+            print("\n📚 Step 1: Researching question ideas...")
+            if self._is_split():
+                print("   Subtopics: " + ", ".join(f"{subtopic} ({quota} questions)" for subtopic, quota in self.quotas.items()))
+            self.idea_pools = {subtopic: self._idea_pool(topic_name, class_level, subtopic) for subtopic in self.subtopics}
+            # Questions are framed from the first ideas while the rest (other calls, other subtopics,
+            # or the rest of a streamed reply) are still arriving
+            for subtopic, pool in self.idea_pools.items():
+                pool.stream_from(self._research_ideas(subtopic, class_level))
+            print("✅ Question ideas are arriving in the background")
         
         # Calculate difficulty distribution based on target count
         basic_count = int(target_question_count * 0.32)
         intermediate_count = int(target_question_count * 0.40)
         advanced_count = target_question_count - basic_count - intermediate_count
-        difficulty_distribution = (["basic"] * basic_count + 
-                                  ["intermediate"] * intermediate_count + 
-                                  ["advanced"] * advanced_count)
-        difficulty_index = 0
+        self.difficulty_distribution = (["basic"] * basic_count + 
+                                        ["intermediate"] * intermediate_count + 
+                                        ["advanced"] * advanced_count)
+        self.difficulty_index = state["cursor"].get("difficulty_index", 0) if resume else 0
         
-        while len(self.validated_questions) < target_question_count and iteration < max_iterations:
-            iteration += 1
-            
-            if idea_index >= len(self.question_ideas):
-                # Regenerate ideas if we run out
-                print("   ⚠️  Running low on ideas, generating more...")
-                research_result = self.research_agent.generate_ideas(topic_name, class_level)
-                self.question_ideas.extend(research_result.get("ideas", []))
-                idea_index = 0  # Reset to use new ideas
-            
-            # Get next idea
-            idea = self.question_ideas[idea_index]
-            idea_index = (idea_index + 1) % len(self.question_ideas)  # Cycle if needed
-            question_counter += 1
-            question_id = f"Q{question_counter:02d}"
-            
-            # Get difficulty
-            difficulty = difficulty_distribution[difficulty_index % len(difficulty_distribution)]
-            difficulty_index += 1
-            
-            print(f"   🔨 Generating question {question_counter} (attempt {iteration})...")
-            
-            # Step 2: Question Framing
-            try:
-                question = self.question_framer.frame_question(
-                    idea, topic_name, class_level, question_id, difficulty
-                )
-            except Exception as e:
-                print(f"      ❌ Failed to frame question: {e}")
-                continue  # Skip this question and try the next idea
+        return base_filename
+    
+    def _is_split(self) -> bool:
+        return len(self.subtopics) > 1
+    
+    def _subtopic_of(self, item: Dict[str, Any]) -> str:
+        """The subtopic a job or question belongs to (the whole topic unless topics are split)."""
+        return item.get("subtopic") or self.topic_name
+    
+    def _accepted_in(self, subtopic: str) -> int:
+        return self.accepted_counts[subtopic]
+    
+    def _idea_pool(self, topic_name: str, class_level: str, subtopic: str, ideas: Optional[List[str]] = None,
+                   cursor: int = 0) -> IdeaPool:
+        """An IdeaPool for one subtopic that journals every new batch and researches more in the
+        background when it runs low."""
+        labels = {"subtopic": subtopic} if self._is_split() else {}
+        return IdeaPool(ideas, cursor, refill=lambda: self._research_ideas(subtopic, class_level),
+                        low_watermark=self.idea_low_watermark,
+                        on_batch=lambda new_ideas: self.journal.record("ideas", ideas=new_ideas, **labels),
+                        dedup=self.idea_dedup)
+    
+    def _ideas_needed(self, subtopic: str) -> int:
+        """Unused ideas a subtopic still needs to reach its quota, at the idea -> accepted question
+        rate seen so far in this run (PRIOR_ACCEPT_RATE until there is data) plus IDEA_MARGIN.
+        Ideas still being worked on are expected to convert at the same rate."""
+        accepted = len(self.validated_questions)
+        rate = (accepted + PRIOR_ACCEPT_RATE * PRIOR_ATTEMPTS) / (accepted + self.dropped_count + PRIOR_ATTEMPTS)
+        rate = min(max(rate, 0.05), 1.0)
+        remaining = max(0.0, self.quotas[subtopic] - self._accepted_in(subtopic) - self.open_jobs[subtopic] * rate)
+        return math.ceil(remaining / rate * IDEA_MARGIN) - self.idea_pools[subtopic].fresh
+    
+    def _research_ideas(self, subtopic: str, class_level: str) -> Optional[Iterator[List[str]]]:
+        """Batches from a research round sized to what a subtopic still needs (parallel calls for
+        large needs), or None while its unused ideas already cover it."""
+        needed = self._ideas_needed(subtopic)
+        if needed <= 0 and self.idea_pools[subtopic].fresh > 0:
+            return None
+        # One round is at most one wave of parallel calls; later rounds are sized by the observed rate
+        count = min(max(needed, MIN_RESEARCH_IDEAS), MAX_IDEAS_PER_CALL * MAX_PARALLEL_CALLS)
+        return self.research_agent.research(subtopic, class_level, count, stream=self.stream_research)
+    
+    def _next_subtopics(self) -> List[str]:
+        """Subtopics ordered by how far they are from their quota, counting work in flight."""
+        return sorted(self.subtopics, key=lambda subtopic: self._accepted_in(subtopic) + self.open_jobs[subtopic]
+                      - self.quotas[subtopic])
+    
+    def _close_job(self, item: Dict[str, Any]):
+        subtopic = self._subtopic_of(item)
+        with self._counts_lock:
+            self.open_jobs[subtopic] = max(0, self.open_jobs[subtopic] - 1)
+    
+    def _drop(self, job: Dict[str, Any], reason: str, failed: bool = True):
+        """Give up on a job. Failed jobs lower the conversion rate research is sized by."""
+        self._close_job(job)
+        if failed:
+            with self._counts_lock:
+                self.dropped_count += 1
+        self.journal.record("dropped", question_id=job.get("question_id"), reason=reason, failed=failed)
+    
+    def _next_job(self, topic_name: str, class_level: str) -> Optional[Dict[str, Any]]:
+        """Pick the next idea, question ID and difficulty. Returns None once the safety limit is hit.
+        Raises ProviderUnavailableError once the circuit breaker has given up on the endpoint."""
+        self.circuit_breaker.check()
+        if self.pending_jobs:
+            # Unfinished work restored from the journal goes first
+            return self.pending_jobs.pop(0)
+        
+        if self.iteration >= self.max_iterations:
+            return None
+        self.iteration += 1
+        
+        # Get next idea (more are researched in the background before the unused ones run out),
+        # from the subtopic furthest from its quota
+        for subtopic in self._next_subtopics():
+            idea = self.idea_pools[subtopic].take()
+            if idea is not None:
+                break
+        else:
+            return None
+        with self._counts_lock:
+            self.open_jobs[subtopic] += 1
+        self.question_counter += 1
+        question_id = f"Q{self.question_counter:02d}"
+        
+        # Get difficulty
+        difficulty = self.difficulty_distribution[self.difficulty_index % len(self.difficulty_distribution)]
+        self.difficulty_index += 1
+        
+        print(f"   🔨 Generating question {self.question_counter} (attempt {self.iteration})...")
+        
+        job = {
+            "idea": idea,
+            "question_id": question_id,
+            "difficulty": difficulty,
+        }
+        cursor = {
+            "idea_index": self.idea_pools[subtopic].cursor,
+            "question_counter": self.question_counter,
+            "difficulty_index": self.difficulty_index,
+            "iteration": self.iteration,
+        }
+        if self._is_split():
+            job["subtopic"] = subtopic
+            cursor["idea_cursors"] = {name: pool.cursor for name, pool in self.idea_pools.items()}
+            del cursor["idea_index"]
+        self.journal.record("job", job=job, cursor=cursor)
+        return job
+    
+    def _process_job(self, job: Dict[str, Any], topic_name: str, class_level: str) -> Optional[Dict[str, Any]]:
+        """Run frame -> validate -> diagram for one idea. Returns the finished question or None."""
+        with span("question", question_id=job["question_id"], difficulty=job["difficulty"]) as trace, \
+                question_scope(job["question_id"]):
+            question = self._frame(job, topic_name, class_level)
+            if question is None:
+                trace.set(outcome="dropped", stage="frame")
+                return None
             
-            # Step 3: Validation (with loop-back)
-            max_validation_attempts = 5
-            validation_attempt = 0
-            is_valid = False
+            question = self._validate(job, question, topic_name, class_level)
+            if question is None:
+                trace.set(outcome="dropped", stage="validate")
+                return None
             
-            while not is_valid and validation_attempt < max_validation_attempts:
-                validation_attempt += 1
+            return self._add_diagram(question, topic_name)
+    
+    def _frame(self, job: Dict[str, Any], topic_name: str, class_level: str) -> Optional[Dict[str, Any]]:
+        """Step 2: Question Framing."""
+        if job.get("question"):
+            return job["question"]  # Already framed before a resume
+        try:
+            question = self.question_framer.frame_question(
+                job["idea"], job.get("subtopic", topic_name), class_level, job["question_id"], job["difficulty"]
+            )
+        except Exception as e:
+            print(f"      ❌ Failed to frame question: {e}")
+            self._drop(job, f"framing failed: {e}")
+            return None  # Skip this question and try the next idea
+        if "subtopic" in job:
+            question["subtopic"] = job["subtopic"]
+        
+        self.journal.record("framed", question_id=job["question_id"], question=question)
+        return question
+    
+    def _validate(self, job: Dict[str, Any], question: Dict[str, Any], topic_name: str,
+                  class_level: str) -> Optional[Dict[str, Any]]:
+        """Step 3: Validation (with loop-back). Returns the validated question or None."""
+        if job.get("validated"):
+            return question  # Already validated before a resume
+        
+        question_id = job["question_id"]
+        topic_name = job.get("subtopic", topic_name)  # A split topic's questions are checked against their subtopic
+        max_validation_attempts = 5
+        validation_attempt = job.get("validation_attempts", 0)
+        is_valid = False
+        
+        while not is_valid and validation_attempt < max_validation_attempts:
+            validation_attempt += 1
+            with span("validate_attempt", question_id=question_id, attempt=validation_attempt) as trace:
                 is_valid, feedback, corrected_question = self.validator.validate(
                     question, topic_name, class_level
                 )
-                
-                if not is_valid:
-                    print(f"      ⚠️  Validation failed (attempt {validation_attempt}): {feedback[:50]}...")
-                    if corrected_question:
-                        question = corrected_question
-                    else:
-                        # Regenerate question with feedback
-                        try:
-                            question = self.question_framer.frame_question(
-                                f"{idea} [Feedback: {feedback}]", 
-                                topic_name, class_level, question_id, difficulty
-                            )
-                        except Exception as e:
-                            print(f"      ❌ Failed to regenerate question: {e}")
-                            is_valid = False
-                            break  # Exit validation loop
-                else:
-                    print(f"      ✅ Question validated!")
+                trace.set(outcome="valid" if is_valid else ("corrected" if corrected_question else "rejected"))
+            self.journal.record("validation", question_id=question_id, attempt=validation_attempt,
+                                is_valid=is_valid, feedback=feedback)
             
             if not is_valid:
-                print(f"      ❌ Question {question_counter} failed validation after {max_validation_attempts} attempts, skipping...")
-                continue
-            
-            # Step 4: Diagram Generation
-            question["needs_diagram"] = question.get("needs_diagram", False)  # Ensure key exists
-            if question["needs_diagram"]:
-                print(f"      🎨 Generating diagram...")
-                question = self.diagram_agent.generate_diagram(question, topic_name)
-                
-                if question.get("needs_python_diagram", False):
-                    question = self.python_diagram_agent.generate_diagram(question, topic_name)
-            
-            # Add to validated questions
-            self.validated_questions.append(question)
+                print(f"      ⚠️  Validation failed (attempt {validation_attempt}): {feedback[:50]}...")
+                if corrected_question:
+                    question = corrected_question
+                else:
+                    # Regenerate question with feedback
+                    try:
+                        question = self.question_framer.frame_question(
+                            f"{job['idea']} [Feedback: {feedback}]", 
+                            topic_name, class_level, question_id, job["difficulty"]
+                        )
+                    except Exception as e:
+                        print(f"      ❌ Failed to regenerate question: {e}")
+                        is_valid = False
+                        break  # Exit validation loop
+                self.journal.record("framed", question_id=question_id, question=question)
+            else:
+                print(f"      ✅ Question validated!")
+        
+        if not is_valid:
+            print(f"      ❌ Question {question_id} failed validation after {max_validation_attempts} attempts, skipping...")
+            self._drop(job, "validation failed")
+            return None
+        
+        duplicate = self.question_dedup.find_duplicate(self._question_fingerprint(question)) if self.question_dedup else None
+        if duplicate is not None:
+            # Skipped before the diagram agents and the writer spend anything on it
+            print(f"      ♻️  Question {question_id} repeats {duplicate} already in the paper, skipping...")
+            DUPLICATE_QUESTIONS.inc()
+            self._drop(job, f"duplicate of {duplicate}")
+            return None
+        
+        if "subtopic" in job:
+            question["subtopic"] = job["subtopic"]  # A corrected or reframed question is a new dict
+        self.journal.record("validated", question_id=question_id, question=question)
+        return question
+    
+    @staticmethod
+    def _question_fingerprint(question: Dict[str, Any]) -> str:
+        """The text compared when looking for duplicate questions: the question and its options."""
+        return " ".join([str(question.get("question_text", ""))] + [str(option) for option in question.get("options", [])])
+    
+    def _add_diagram(self, question: Dict[str, Any], topic_name: str) -> Dict[str, Any]:
+        """Step 4: Diagram Generation."""
+        question["needs_diagram"] = question.get("needs_diagram", False)  # Ensure key exists
+        if question["needs_diagram"]:
+            print(f"      🎨 Generating diagram...")
+            question = self.diagram_agent.generate_diagram(question, topic_name)
             
-            # Step 5: Write question to LaTeX file immediately
-            print(f"      📝 Writing question to LaTeX file...")
+            if question.get("needs_python_diagram", False):
+                question = self.python_diagram_agent.generate_diagram(question, topic_name)
+        
+        self.journal.record("diagram", question_id=question.get("question_id"), question=question,
+                            diagram_code=question.get("diagram_code"), image_path=question.get("image_path"))
+        return question
+    
+    def _accept_question(self, question: Dict[str, Any], target_question_count: int):
+        """Add a finished question to the paper and write it to the LaTeX file immediately."""
+        subtopic = self._subtopic_of(question)
+        if self._is_split() and self._accepted_in(subtopic) >= self.quotas[subtopic]:
+            # Concurrent jobs can overshoot a subtopic; its share of the paper is already full
+            print(f"      ↪️  {subtopic} already has its {self.quotas[subtopic]} questions, skipping")
+            self._drop(question, "subtopic quota met", failed=False)
+            return
+        if self.question_dedup is not None:
+            # Checked again here: a question validated concurrently may have been accepted since
+            duplicate = self.question_dedup.add(self._question_fingerprint(question), key=question.get("question_id"))
+            if duplicate is not None:
+                print(f"      ♻️  Question {question.get('question_id')} repeats {duplicate} already in the paper, skipping")
+                DUPLICATE_QUESTIONS.inc()
+                self._drop(question, f"duplicate of {duplicate}")
+                return
+        self._close_job(question)
+        self.validated_questions.append(question)
+        self.accepted_counts[subtopic] += 1
+        self.journal.record("accepted", question_id=question.get("question_id"), question=question)
+        
+        # Step 5: Write question to LaTeX file immediately
+        print(f"      📝 Writing question to LaTeX file...")
+        with span("latex_write", question_id=question.get("question_id")):
             self.latex_writer.write_question(question)
-            
-            print(f"   ✅ Question {len(self.validated_questions)}/{target_question_count} completed and written to file")
+        QUESTIONS_WRITTEN.inc()
+        
+        print(f"   ✅ Question {len(self.validated_questions)}/{target_question_count} completed and written to file")
+    
+    def _finish_run(self, topic_name: str, class_level: str, target_question_count: int,
+                    base_filename: str) -> dict:
+        """Finalize the LaTeX file, dump the question data JSON and return the output summary."""
+        main_tex_path = self.latex_writer.output_path
+        for pool in self.idea_pools.values():
+            pool.close()  # Stop reading research replies we no longer need
         
         if len(self.validated_questions) < target_question_count:
             print(f"\n⚠️  Warning: Only generated {len(self.validated_questions)} questions (target: {target_question_count})")
+        for label, index in (("Idea", self.idea_dedup), ("Question", self.question_dedup)):
+            if index is not None and index.truncated_lookups:
+                print(f"\n⚠️  {label} dedup: {index.truncated_lookups} lookups stopped after {index.max_candidates} "
+                      f"candidates, so near-duplicates among the rest may have been kept")
         
         # Finalize LaTeX file
         print("\n✨ Finalizing LaTeX file...")
@@ -166,28 +633,51 @@ class QuestionPaperGenerator:
         # Save question data as JSON (includes answer key via correct_options)
         # Use the same base filename as the LaTeX file
         question_data_path = self.output_dir / f"{base_filename}.json"
+        usage = self.usage.summary([q["question_id"] for q in self.validated_questions])
         with open(question_data_path, 'w', encoding='utf-8') as f:
             json.dump({
                 "topic": topic_name,
                 "class_level": class_level,
                 "questions": self.validated_questions,
                 "total_questions": len(self.validated_questions),
-                "answer_key": [(q["question_id"], q["correct_option"]) for q in self.validated_questions]
+                "answer_key": [(q["question_id"], q["correct_option"]) for q in self.validated_questions],
+                "usage": usage
             }, f, indent=2, ensure_ascii=False)
         
+        self.journal.record("run_finished", total_questions=len(self.validated_questions))
+        self.journal.close()
+        
         print(f"\n✅ Question paper generation complete!")
         print(f"   📄 LaTeX file: {main_tex_path}")
         print(f"   📊 Question data: {question_data_path}")
+        print(f"   🧾 Run journal: {self.journal.path}")
         print(f"   🖼️  Images: {self.output_dir / 'images'}")
+        self._print_usage_report(usage)
         print(f"\n💡 To compile: pdflatex {main_tex_path}")
         
         return {
             "latex_file": str(main_tex_path),
             "question_data": str(question_data_path),
             "images_dir": str(self.output_dir / "images"),
-            "total_questions": len(self.validated_questions)
+            "total_questions": len(self.validated_questions),
+            "usage": usage
         }
-
+    
+    @staticmethod
+    def _print_usage_report(usage: dict):
+        """Print LLM calls and tokens per agent for the run."""
+        total = usage["total"]
+        print(f"\n💰 LLM usage: {total['calls']} calls, {total['prompt_tokens']} prompt + "
+              f"{total['output_tokens']} output tokens")
+        for agent_name, bucket in usage["by_agent"].items():
+            print(f"   {agent_name:<15} {bucket['calls']:>5} calls  {bucket['total_tokens']:>9} tokens")
+        if "per_accepted_question" in usage:
+            per_question = usage["per_accepted_question"]
+            line = f"   Per accepted question: {per_question['calls']} calls, {per_question['total_tokens']} tokens"
+            if "estimated_cost_usd" in per_question:
+                line += f", ~${per_question['estimated_cost_usd']:.4f}"
+            print(line)
+    
     # NEW: Method to run only LaTeX writer from existing JSON
     def generate_from_json(self, json_path: str, topic_name: str, class_level: str) -> dict:
         """Load validated questions from JSON and write only to LaTeX."""
@@ -242,18 +732,156 @@ def main():
     parser.add_argument("class_level", nargs="?", default="Class 7", help="Class level")
     parser.add_argument("--from-json", type=str, help="Path to existing question_data.json (skips generation, runs only LaTeX writer)")
     parser.add_argument("--count", type=int, default=25, help="Target number of questions to generate (default: 25)")
+    parser.add_argument("--resume", action="store_true", help="Continue an interrupted run from its journal instead of starting over")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of ideas to frame/validate/draw at once (default: 1, sequential)")
+    parser.add_argument("--pipeline", action="store_true", help="Run framer, validator, diagram and writer as separately scaled stages")
+    parser.add_argument("--framer-workers", type=int, default=2, help="Framer workers in --pipeline mode (default: 2)")
+    parser.add_argument("--validator-workers", type=int, default=4, help="Validator workers in --pipeline mode (default: 4)")
+    parser.add_argument("--diagram-workers", type=int, default=2, help="Diagram workers in --pipeline mode (default: 2)")
+    parser.add_argument("--writer-workers", type=int, default=1, help="LaTeX writer workers in --pipeline mode (default: 1)")
+    parser.add_argument("--queue-size", type=int, default=8, help="Bounded queue size between --pipeline stages (default: 8)")
+    parser.add_argument("--record-cassette", type=str, help="Record every Gemini prompt/response to this cassette file")
+    parser.add_argument("--replay-cassette", type=str, help="Serve Gemini calls from this cassette file (no network)")
+    parser.add_argument("--replay-latency", type=float, default=None, help="Fixed seconds per replayed call (default: recorded latency)")
+    parser.add_argument("--fake-llm", nargs="?", const="{}", default=None, metavar="JSON",
+                        help="Use the local fake LLM backend; optional JSON of FakeBackend settings, e.g. '{\"latency_mean\": 0.5, \"error_rate\": 0.05}'")
+    parser.add_argument("--trace", type=str, help="Write per-stage timing spans to this file (.json for Chrome/Perfetto trace, .jsonl for one span per line)")
+    parser.add_argument("--price-input", type=float, default=None, help="USD per million prompt tokens, for cost estimates in the usage report")
+    parser.add_argument("--price-output", type=float, default=None, help="USD per million output tokens, for cost estimates in the usage report")
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port at /metrics")
+    parser.add_argument("--metrics-file", type=str, help="Periodically rewrite Prometheus metrics to this file (e.g. for node_exporter's textfile collector)")
+    parser.add_argument("--metrics-interval", type=float, default=15.0, help="Seconds between --metrics-file rewrites (default: 15)")
+    parser.add_argument("--cache", nargs="?", const="llm_cache.sqlite", default=None, metavar="PATH",
+                        help="Cache LLM responses in this SQLite file (default: llm_cache.sqlite) and reuse them for identical prompts")
+    parser.add_argument("--cache-max-mb", type=float, default=DEFAULT_MAX_BYTES / (1024 * 1024),
+                        help="Evict least recently used cache entries beyond this size (default: 256)")
+    parser.add_argument("--cache-ttl", nargs="+", default=[], metavar="AGENT=HOURS",
+                        help="Override how long an agent's cached responses stay fresh, e.g. research=24 framer=720")
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute allowed across all agents (calls block when exhausted)")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute allowed across all agents (calls block when exhausted)")
+    parser.add_argument("--rate-limit-file", type=str, default=None,
+                        help="Share the --rpm/--tpm budget with every process using this state file")
+    parser.add_argument("--max-retries", type=int, default=3, help="Retries per LLM call after transient errors (default: 3)")
+    parser.add_argument("--retry-base-delay", type=float, default=1.0,
+                        help="Base seconds for exponential backoff with jitter between retries (default: 1.0)")
+    parser.add_argument("--breaker-threshold", type=int, default=5,
+                        help="Consecutive transient errors that pause all LLM calls (default: 5)")
+    parser.add_argument("--breaker-reset", type=float, default=30.0,
+                        help="Seconds calls are paused before a probe call is tried, doubling per failed probe (default: 30)")
+    parser.add_argument("--breaker-max-probes", type=int, default=5,
+                        help="Failed probes in a row after which the run fails as provider unavailable (default: 5)")
+    parser.add_argument("--llm-timeout", type=float, default=120.0,
+                        help="Seconds before a single LLM call is abandoned and retried (default: 120; 0 disables)")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Request schema-constrained JSON from the model and validate every reply against the agent's schema")
+    parser.add_argument("--stream-validation", action="store_true",
+                        help="Stream validator replies and accept a question as soon as the verdict is read")
+    parser.add_argument("--stream-research", action="store_true",
+                        help="Stream the research reply and start framing questions from the first ideas that arrive")
+    parser.add_argument("--idea-low-watermark", type=int, default=10,
+                        help="Research more ideas in the background once this few unused ones are left (default: 10)")
+    parser.add_argument("--split-topics", action="store_true",
+                        help="Research each comma-separated part of --topic in parallel and give each an equal share of the questions")
+    parser.add_argument("--idea-dedup-threshold", type=float, default=0.8,
+                        help="Drop researched ideas at least this similar to an earlier one (Jaccard over content words, default: 0.8; 0 disables)")
+    parser.add_argument("--question-dedup-threshold", type=float, default=0.9,
+                        help="Skip validated questions at least this similar to one already in the paper (default: 0.9; 0 disables)")
+    parser.add_argument("--batch", type=str, help="Path to a JSONL manifest of worksheets to generate in a process pool")
+    parser.add_argument("--batch-output", type=str, default="batch_output", help="Root directory for --batch job outputs (default: batch_output)")
+    parser.add_argument("--processes", type=int, default=None, help="Worker processes for --batch (default: CPU count)")
     args = parser.parse_args()
     
-    generator = QuestionPaperGenerator()
+    if args.batch:
+        # Many worksheets, one isolated output directory per job
+        from pipeline.batch import run_batch
+        rate_limit = {"rpm": args.rpm, "tpm": args.tpm, "state_file": args.rate_limit_file} if args.rpm or args.tpm else None
+        llm_settings = {
+            "llm_timeout": args.llm_timeout, "max_retries": args.max_retries, "retry_base_delay": args.retry_base_delay,
+            "breaker_threshold": args.breaker_threshold, "breaker_reset": args.breaker_reset,
+            "breaker_max_probes": args.breaker_max_probes,
+        }
+        summary = run_batch(args.batch, args.batch_output, args.processes, rate_limit, llm_settings)
+        if summary["failed"]:
+            sys.exit(1)
+        return
+    
+    if args.record_cassette:
+        model_factory = provider_factory("record", path=args.record_cassette)
+    elif args.replay_cassette:
+        model_factory = provider_factory("replay", path=args.replay_cassette, latency=args.replay_latency)
+    elif args.fake_llm is not None:
+        model_factory = provider_factory("fake", **json.loads(args.fake_llm or "{}"))
+    else:
+        model_factory = provider_factory("gemini")
+    
+    tracer = Tracer(args.trace) if args.trace else None
+    set_tracer(tracer)
+    
+    if args.metrics_port:
+        start_http_server(args.metrics_port)
+        print(f"📈 Serving metrics on http://localhost:{args.metrics_port}/metrics")
+    metrics_exporter = TextfileExporter(args.metrics_file, args.metrics_interval).start() if args.metrics_file else None
+    
+    response_cache = None
+    if args.cache:
+        ttls = {}
+        for setting in args.cache_ttl:
+            agent_name, hours = setting.split("=", 1)
+            ttls[agent_name] = float(hours) * 3600
+        response_cache = ResponseCache(args.cache, int(args.cache_max_mb * 1024 * 1024), ttls)
+    
+    rate_limiter = RateLimiter(args.rpm, args.tpm, args.rate_limit_file) if args.rpm or args.tpm else None
+    
+    retry_policy = RetryPolicy(max_attempts=args.max_retries + 1, base_delay=args.retry_base_delay)
+    circuit_breaker = CircuitBreaker(args.breaker_threshold, args.breaker_reset,
+                                     max_failed_probes=args.breaker_max_probes)
+    
+    usage_ledger = UsageLedger(args.price_input, args.price_output)
+    generator = QuestionPaperGenerator(model_factory=model_factory, usage_ledger=usage_ledger,
+                                       response_cache=response_cache, rate_limiter=rate_limiter,
+                                       retry_policy=retry_policy, circuit_breaker=circuit_breaker,
+                                       llm_timeout=args.llm_timeout,
+                                       structured_output=args.structured_output,
+                                       stream_validation=args.stream_validation,
+                                       stream_research=args.stream_research,
+                                       idea_low_watermark=args.idea_low_watermark,
+                                       split_topics=args.split_topics,
+                                       idea_dedup_threshold=args.idea_dedup_threshold,
+                                       question_dedup_threshold=args.question_dedup_threshold)
     
     if args.from_json:
         # Run only LaTeX writer
         result = generator.generate_from_json(args.from_json, args.topic, args.class_level)
+    elif args.pipeline:
+        # Full generation as a staged pipeline
+        import asyncio
+        result = asyncio.run(generator.generate_staged(
+            args.topic, args.class_level, args.count,
+            framer_workers=args.framer_workers, validator_workers=args.validator_workers,
+            diagram_workers=args.diagram_workers, writer_workers=args.writer_workers,
+            queue_size=args.queue_size, resume=args.resume
+        ))
+    elif args.concurrency > 1:
+        # Full generation, several ideas in flight at once
+        import asyncio
+        result = asyncio.run(generator.generate_async(args.topic, args.class_level, args.count, args.concurrency, args.resume))
     else:
         # Full generation
-        result = generator.generate(args.topic, args.class_level, args.count)
+        result = generator.generate(args.topic, args.class_level, args.count, args.resume)
     
     print(f"\n🎉 Success! Processed {result['total_questions']} questions.")
+    if tracer:
+        set_tracer(None)
+        tracer.close()
+        print(f"🔍 Trace written to {args.trace} (open in https://ui.perfetto.dev or chrome://tracing)")
+    if response_cache:
+        cache_summary = response_cache.summary()
+        print(f"🗄️  Response cache: {cache_summary['hits']} hits, {cache_summary['misses']} misses "
+              f"({cache_summary['hit_rate']:.0%}), {cache_summary['entries']} entries in {args.cache}")
+        response_cache.close()
+    if metrics_exporter:
+        metrics_exporter.stop()
+        print(f"📈 Metrics written to {args.metrics_file}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1 @@
+# Empty init for pipeline package
\ No newline at end of file
@@ -0,0 +1,198 @@
+"""
+Batch runner: Generates many (topic, class_level) worksheets from a JSONL manifest in a process pool.
+"""
+
+import json
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+from typing import Dict, Any, List
+
+from llm.fake import FakeBackend
+from llm.cache import ResponseCache
+from llm.ratelimit import RateLimiter
+from llm.retry import CircuitBreaker, RetryPolicy
+from telemetry.tracing import Tracer, get_tracer, set_tracer
+
+
+def load_manifest(manifest_path: str) -> List[Dict[str, Any]]:
+    """Read one job per line and give each a job_id. Lines that are not valid jobs, and jobs whose
+    job_id an earlier job already has (they would share an output directory), become jobs
+    carrying an error."""
+    jobs = []
+    seen = {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                job = {"error": f"manifest line {line_number}: invalid JSON ({e})"}
+            if not isinstance(job, dict):
+                job = {"error": f"manifest line {line_number}: job is not a JSON object"}
+            elif "error" not in job and (not job.get("topic") or not job.get("class_level")):
+                job["error"] = f"manifest line {line_number}: job needs both 'topic' and 'class_level'"
+            job["line"] = line_number
+            job_id = _job_id(job, len(jobs) + 1)
+            if job_id in seen:
+                job.setdefault("error", f"manifest line {line_number}: job_id '{job_id}' is already used "
+                                        f"by line {seen[job_id]}")
+                job_id = f"{job_id}_line{line_number}"
+            seen[job_id] = line_number
+            job["job_id"] = job_id
+            jobs.append(job)
+    return jobs
+
+
+def _job_id(job: Dict[str, Any], index: int) -> str:
+    """Stable, filesystem-safe name for a job's output directory."""
+    if job.get("job_id"):
+        return re.sub(r'[^\w\-]+', '_', str(job["job_id"]))
+    slug = re.sub(r'[^\w]+', '_', f"{job.get('topic') or ''}_{job.get('class_level') or ''}".lower()).strip('_')
+    return f"{index:03d}_{slug[:60] or 'invalid'}"
+
+
+def _run_job(job: Dict[str, Any], output_dir: str, rate_limit: Dict[str, Any] = None,
+             llm_settings: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Run one worksheet in a worker process. Never raises; failures are reported in the result."""
+    started = time.time()
+    result = {
+        "job_id": job["job_id"],
+        "topic": job.get("topic"),
+        "class_level": job.get("class_level"),
+        "target_questions": job.get("count", 25),
+        "output_dir": output_dir,
+        "status": "failed",
+    }
+    
+    if "error" in job:
+        result["error"] = job["error"]
+        return result
+    
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    log_path = Path(output_dir) / "run.log"
+    llm_settings = llm_settings or {}
+    response_cache = None
+    try:
+        # Keep each job's console output in its own directory instead of interleaving
+        with open(log_path, 'w', encoding='utf-8') as log, redirect_stdout(log), redirect_stderr(log):
+            # Imported here so the pool's workers pay the agent import cost once each, not the parent
+            import asyncio
+            from main import QuestionPaperGenerator
+            
+            result["target_questions"] = int(result["target_questions"])
+            # "fake_llm": {...} runs the job against the local fake backend (load testing)
+            model_factory = FakeBackend(**job["fake_llm"]).model_for if "fake_llm" in job else None
+            if job.get("trace"):
+                set_tracer(Tracer(str(Path(output_dir) / "trace.json")))
+            # "cache": "<path>" shares one response cache between all jobs that name it
+            response_cache = ResponseCache(job["cache"]) if job.get("cache") else None
+            # Every worker draws from the same budget through the shared state file
+            rate_limiter = RateLimiter(rate_limit["rpm"], rate_limit["tpm"], rate_limit["state_file"]) if rate_limit else None
+            retry_policy = RetryPolicy(max_attempts=llm_settings.get("max_retries", 3) + 1,
+                                       base_delay=llm_settings.get("retry_base_delay", 1.0))
+            circuit_breaker = CircuitBreaker(llm_settings.get("breaker_threshold", 5),
+                                             llm_settings.get("breaker_reset", 30.0),
+                                             max_failed_probes=llm_settings.get("breaker_max_probes", 5))
+            generator = QuestionPaperGenerator(output_dir=output_dir, model_factory=model_factory,
+                                               response_cache=response_cache, rate_limiter=rate_limiter,
+                                               retry_policy=retry_policy, circuit_breaker=circuit_breaker,
+                                               llm_timeout=llm_settings.get("llm_timeout"),
+                                               structured_output=bool(job.get("structured_output", False)))
+            concurrency = int(job.get("concurrency", 1))
+            resume = bool(job.get("resume", False))
+            if concurrency > 1:
+                run = asyncio.run(generator.generate_async(
+                    job["topic"], job["class_level"], result["target_questions"], concurrency, resume
+                ))
+            else:
+                run = generator.generate(job["topic"], job["class_level"], result["target_questions"], resume)
+            if response_cache:
+                run["cache"] = response_cache.summary()
+        
+        result.update(run)
+        result["status"] = "ok" if run["total_questions"] >= result["target_questions"] else "partial"
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        with open(log_path, 'a', encoding='utf-8') as log:
+            log.write(traceback.format_exc())
+    finally:
+        if response_cache:
+            response_cache.close()
+        # Worker processes are reused, so never leak one job's tracer (or cache) into the next
+        tracer = get_tracer()
+        if tracer:
+            set_tracer(None)
+            tracer.close()
+    
+    result["log_file"] = str(log_path)
+    result["elapsed_seconds"] = round(time.time() - started, 2)
+    return result
+
+
+def run_batch(manifest_path: str, output_root: str = "batch_output", processes: int = None,
+              rate_limit: Dict[str, Any] = None, llm_settings: Dict[str, Any] = None) -> Dict[str, Any]:
+    """Fan the manifest's jobs out over a process pool and write batch_summary.json to output_root.
+    
+    rate_limit ({"rpm", "tpm", "state_file"}) caps the whole batch, not each worker.
+    llm_settings ({"llm_timeout", "max_retries", "retry_base_delay", "breaker_threshold",
+    "breaker_reset", "breaker_max_probes"}, all optional) apply to every job, as the CLI flags
+    of the same names do to a single run."""
+    output_root = Path(output_root)
+    output_root.mkdir(parents=True, exist_ok=True)
+    if rate_limit:
+        rate_limit = dict(rate_limit, state_file=rate_limit.get("state_file") or str(output_root / "rate_limit.json"))
+    
+    jobs = load_manifest(manifest_path)
+    print(f"📦 Loaded {len(jobs)} jobs from {manifest_path}")
+    
+    started = time.time()
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {
+            pool.submit(_run_job, job, str(output_root / job["job_id"]), rate_limit, llm_settings): job
+            for job in jobs
+        }
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died (e.g. killed or out of memory)
+                result = {
+                    "job_id": job["job_id"],
+                    "topic": job.get("topic"),
+                    "class_level": job.get("class_level"),
+                    "output_dir": str(output_root / job["job_id"]),
+                    "status": "failed",
+                    "error": f"{type(e).__name__}: {e}",
+                }
+            icon = {"ok": "✅", "partial": "⚠️ "}.get(result["status"], "❌")
+            print(f"   {icon} {result['job_id']}: {result['status']}"
+                  + (f" ({result['error']})" if result.get("error") else ""))
+            results.append(result)
+    
+    results.sort(key=lambda r: r["job_id"])
+    summary = {
+        "manifest": str(manifest_path),
+        "total_jobs": len(results),
+        "succeeded": sum(1 for r in results if r["status"] == "ok"),
+        "partial": sum(1 for r in results if r["status"] == "partial"),
+        "failed": sum(1 for r in results if r["status"] == "failed"),
+        "elapsed_seconds": round(time.time() - started, 2),
+        "jobs": results,
+    }
+    summary_path = output_root / "batch_summary.json"
+    with open(summary_path, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    summary["summary_file"] = str(summary_path)
+    
+    print(f"\n📊 Batch complete: {summary['succeeded']} ok, {summary['partial']} partial, "
+          f"{summary['failed']} failed in {summary['elapsed_seconds']}s")
+    print(f"   📄 Summary: {summary_path}")
+    return summary
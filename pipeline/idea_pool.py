@@ -0,0 +1,202 @@
+"""
+IdeaPool: Question ideas shared by the generation loop, a background research stream and refills.
+"""
+
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from pipeline.minhash import MinHashIndex
+from telemetry.metrics import IDEA_REFILLS, IDEAS_DEDUPLICATED, IDEAS_REUSED
+
+# Ideas handed out before a refill that found nothing new is tried again; doubles with every
+# further dry refill in a row, up to DRY_REFILL_BACKOFF * 2 ** MAX_BACKOFF_DOUBLINGS
+DRY_REFILL_BACKOFF = 8
+MAX_BACKOFF_DOUBLINGS = 5
+
+
+class IdeaPool:
+    """An append-only list of ideas that can grow while the generation loop is taking from it.
+    
+    Ideas are handed out in order by take(), so ideas[:cursor] have been used and the rest are
+    fresh; the cursor is what the run journal stores as idea_index. stream_from() fills the pool
+    from an iterator of idea batches on a daemon thread, so the first question can be framed as
+    soon as the first idea arrives (take() waits for each next idea while that stream runs).
+    
+    With a refill callable (returning an iterable of idea batches, e.g. a research call, or None
+    if no more are needed yet), the pool starts fetching more in the background as soon as no
+    more than low_watermark fresh ideas are left. take() never waits for that: if the fresh ideas run out first it hands out used ones
+    again until the refill lands. It only waits for a refill when the pool has no ideas at all. A
+    refill that adds nothing new (a repeated research call often returns the same ideas) is not
+    retried until DRY_REFILL_BACKOFF more ideas have been handed out, twice as many after each
+    further dry one.
+    
+    With a dedup index (which may be shared by several pools), added ideas that are near-duplicates
+    of an indexed one ("Find the area of a triangle given base and height" / "Given base and
+    height, determine the triangle's area") are dropped before anything is framed from them.
+    """
+    
+    def __init__(self, ideas: Optional[List[str]] = None, cursor: int = 0,
+                 refill: Callable[[], Iterable[List[str]]] = None, low_watermark: int = 0,
+                 on_batch: Callable[[List[str]], None] = None, dedup: Optional[MinHashIndex] = None):
+        """on_batch is called with the new ideas of every streamed or refilled batch before they
+        become visible (e.g. to journal them); ideas already in the pool are dropped."""
+        self._ideas = list(ideas or [])
+        self._seen = set(self._ideas)
+        self.dedup = dedup
+        if dedup is not None:
+            for idea in self._ideas:
+                dedup.add(idea, check=False)  # Already journaled (and maybe framed): keep them all
+        self.cursor = min(cursor, len(self._ideas))
+        self.refill = refill
+        self.low_watermark = low_watermark
+        self.on_batch = on_batch
+        self._condition = threading.Condition()
+        self.streaming = False
+        self._cancelled = False
+        self._waited_for = False
+        self._taken = 0
+        self._refill_after = 0
+        self._dry_refills = 0
+        self._reuse_index = 0
+        self._thread = None
+    
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._ideas)
+    
+    def __getitem__(self, index: int) -> str:
+        with self._condition:
+            return self._ideas[index]
+    
+    @property
+    def fresh(self) -> int:
+        """Ideas not handed out yet."""
+        with self._condition:
+            return len(self._ideas) - self.cursor
+    
+    def extend(self, ideas: List[str]):
+        with self._condition:
+            self._ideas.extend(ideas)
+            self._seen.update(ideas)
+            self._condition.notify_all()
+    
+    def new_only(self, ideas: List[str]) -> List[str]:
+        """The ideas not already in the pool (a repeated research call often returns the same ones),
+        leaving out near-duplicates of indexed ideas too when the pool has a dedup index."""
+        with self._condition:
+            new = [idea for idea in dict.fromkeys(ideas) if idea not in self._seen]
+        if self.dedup is None:
+            return new
+        # Hashing happens outside the lock, so take() is not held up by a batch being deduplicated
+        kept = []
+        for idea in new:
+            if self.dedup.add(idea) is not None:
+                IDEAS_DEDUPLICATED.inc()
+                continue
+            kept.append(idea)
+        return kept
+    
+    def add(self, ideas: List[str]) -> List[str]:
+        """Add the new ideas (see new_only()), passing them to on_batch first. Returns them."""
+        new = self.new_only(ideas)
+        if new:
+            if self.on_batch:
+                self.on_batch(new)
+            self.extend(new)
+        return new
+    
+    def take(self) -> Optional[str]:
+        """The next fresh idea, a used one if none are fresh, or None if there are no ideas at all."""
+        with self._condition:
+            refill = self.fresh <= self.low_watermark and self._claim_refill()
+        if refill:
+            self._start_refill()
+        
+        with self._condition:
+            self._taken += 1
+            # Wait for a streamed idea that is on its way, but never for a refill unless there is nothing to reuse
+            self._condition.wait_for(lambda: self.cursor < len(self._ideas) or not self.streaming
+                                     or (self._ideas and not self._waited_for))
+            
+            if self.cursor < len(self._ideas):
+                idea = self._ideas[self.cursor]
+                self.cursor += 1
+                return idea
+            if not self._ideas:
+                return None
+            # Out of fresh ideas while a refill is in flight (or none is possible): cycle the used ones
+            idea = self._ideas[self._reuse_index % len(self._ideas)]
+            self._reuse_index += 1
+            IDEAS_REUSED.inc()
+            return idea
+    
+    def _claim_refill(self) -> bool:
+        """Whether a refill is due now; if so it is marked as running. Called with the lock held."""
+        if self.refill is None or self.streaming or self._cancelled or self._taken < self._refill_after:
+            return False
+        self.streaming = True
+        self._waited_for = False
+        return True
+    
+    def _start_refill(self):
+        """Start the refill claimed by _claim_refill(). Called without the lock: the refill callable
+        sets up research and may look at the pool itself."""
+        batches = None
+        try:
+            batches = self.refill()
+        finally:
+            if batches is None:
+                with self._condition:
+                    self.streaming = False
+                    self._condition.notify_all()
+        if batches is None:
+            return  # The unused ideas are enough for now
+        IDEA_REFILLS.inc()
+        print(f"   🔄 {self.fresh} fresh ideas left, researching more in the background...")
+        count = len(self)
+        
+        def refilled():
+            with self._condition:
+                if len(self._ideas) > count:
+                    self._dry_refills = 0
+                    return
+                # Asking again right away would only repeat the same call on every take()
+                self._refill_after = self._taken + DRY_REFILL_BACKOFF * 2 ** min(self._dry_refills, MAX_BACKOFF_DOUBLINGS)
+                self._dry_refills += 1
+        
+        self.stream_from(batches, wait=False, on_done=refilled)
+    
+    def stream_from(self, batches: Iterable[List[str]], wait: bool = True, on_done: Callable[[], None] = None):
+        """Start adding batches of ideas from a (slow) iterator in the background. With wait=True
+        take() waits for its next idea rather than reusing one while the iterator is running."""
+        with self._condition:
+            self.streaming = True
+            self._waited_for = wait
+            self._cancelled = False
+        
+        def feed():
+            try:
+                iterator = iter(batches)
+                for batch in iterator:
+                    if self._cancelled:
+                        break
+                    self.add(batch)
+            except Exception as e:
+                print(f"   ⚠️  Idea stream failed: {e}")
+            finally:
+                close = getattr(batches, "close", None)
+                if close is not None:
+                    close()  # Stops reading the model's reply if we left early
+                if on_done:
+                    on_done()
+                with self._condition:
+                    self.streaming = False
+                    self._condition.notify_all()
+        
+        self._thread = threading.Thread(target=feed, name="qpg-idea-stream", daemon=True)
+        self._thread.start()
+    
+    def close(self):
+        """Stop a running stream or refill (e.g. because the paper is already complete). It is
+        closed when its next batch arrives, and that batch is discarded."""
+        self._cancelled = True
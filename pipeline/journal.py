@@ -0,0 +1,99 @@
+"""
+RunJournal: Append-only, crash-safe record of a generation run that --resume can rebuild from.
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any
+
+
+class RunJournal:
+    """Append-only JSONL journal of ideas, framed questions, verdicts, diagrams and accepted questions.
+    
+    Every event is flushed and fsynced as it happens, so a crash loses at most the line being
+    written (a torn last line is ignored on load). load() folds the events back into the state
+    QuestionPaperGenerator needs to carry on without repeating any paid LLM call.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._file = None
+    
+    def open(self, resume: bool = False):
+        """Open the journal, truncating it unless we are resuming."""
+        self._file = open(self.path, 'a' if resume else 'w', encoding='utf-8')
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+    
+    def record(self, event: str, **data):
+        """Append one event and force it to disk."""
+        entry = {"event": event, "time": round(time.time(), 3), **data}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+    
+    def load(self) -> Dict[str, Any]:
+        """Replay the journal into run state. Returns an empty state if there is no journal."""
+        state = {
+            "ideas": [],
+            "cursor": {},
+            "accepted": [],
+            "pending": {},
+            "dropped": 0,
+            "subtopic_ideas": {},
+        }
+        if not self.path.exists():
+            return state
+        
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # Torn write from a crash
+                self._apply(state, entry)
+        return state
+    
+    @staticmethod
+    def _apply(state: Dict[str, Any], entry: Dict[str, Any]):
+        event = entry.get("event")
+        pending = state["pending"]
+        question_id = entry.get("question_id")
+        
+        if event == "ideas":
+            state["ideas"].extend(entry.get("ideas", []))
+            if entry.get("subtopic"):
+                state["subtopic_ideas"].setdefault(entry["subtopic"], []).extend(entry.get("ideas", []))
+        elif event == "job":
+            job = dict(entry["job"])
+            pending[job["question_id"]] = job
+            state["cursor"] = entry.get("cursor", {})
+        elif event == "framed" and question_id in pending:
+            pending[question_id]["question"] = entry["question"]
+        elif event == "validation" and question_id in pending:
+            pending[question_id]["validation_attempts"] = entry.get("attempt", 0)
+        elif event == "validated" and question_id in pending:
+            pending[question_id]["question"] = entry["question"]
+            pending[question_id]["validated"] = True
+        elif event == "diagram" and question_id in pending:
+            pending[question_id]["question"] = entry["question"]
+            pending[question_id]["diagram_done"] = True
+        elif event == "accepted":
+            pending.pop(question_id, None)
+            state["accepted"].append(entry["question"])
+        elif event == "dropped":
+            pending.pop(question_id, None)
+            if entry.get("failed", True):
+                state["dropped"] += 1
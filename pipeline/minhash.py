@@ -0,0 +1,234 @@
+"""
+MinHash: Near-duplicate detection for short texts (question ideas, questions) with MinHash signatures and LSH.
+"""
+
+import bisect
+import random
+import re
+import threading
+import zlib
+from typing import Callable, Dict, FrozenSet, List, Optional, Set, Tuple
+
+from telemetry.metrics import DEDUP_TRUNCATED_LOOKUPS
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# Words that say nothing about what an idea is about, including the instruction verbs paraphrases
+# swap freely ("find" / "determine" / "work out")
+STOPWORDS = frozenset("""
+a an the of in on at to for with and or by from as into onto over under about between
+is are be been being it its this that these those their there which what when where how why
+given using based use involving via such some any each every all both
+find determine calculate compute evaluate work out solve show identify obtain get
+problem problems question questions exercise exercises task tasks idea ideas
+""".split())
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15  # Fibonacci hashing multiplier: spreads a crc32 value over 64 bits
+
+
+def content_words(text: str) -> List[str]:
+    """The words of text that carry meaning: lowercased, stopwords removed, plural 's' stripped."""
+    words = []
+    for token in _TOKEN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        words.append(token)
+    return words
+
+
+def shingles(text: str, k: int = 4) -> Set[str]:
+    """Character k-grams of each content word of text (padded, so short words count too).
+    
+    Built per word, so a reordered paraphrase ("the area of a triangle given base and height" /
+    "given base and height, the triangle's area") keeps all its shingles, while related forms
+    ("compare" / "comparing") still share most of theirs.
+    """
+    grams = set()
+    for word in content_words(text):
+        padded = f" {word} "
+        grams.update(padded[i:i + k] for i in range(max(1, len(padded) - k + 1)))
+    return grams
+
+
+def word_shingles(text: str, k: int = 3) -> Set[str]:
+    """Word k-grams of text, stopwords and numbers included, for texts where wording and order
+    matter (a question and its options): the same template with other numbers shares few of them."""
+    words = _TOKEN.findall(text.lower())
+    if len(words) <= k:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + k]) for i in range(len(words) - k + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def lsh_params(threshold: float, num_perm: int, recall: float = 0.9) -> Tuple[int, int]:
+    """The (bands, rows) split of num_perm signature values for an LSH threshold.
+    
+    A pair with similarity s becomes a candidate with probability 1 - (1 - s**rows)**bands. This
+    picks the most rows per band (the fewest dissimilar candidates) that still makes a pair right
+    at the threshold a candidate with probability `recall`; pairs above it are caught more often.
+    """
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        if 1 - (1 - threshold ** rows) ** bands >= recall:
+            best = (bands, rows)
+    return best
+
+
+class MinHashIndex:
+    """Finds texts whose shingle sets have a Jaccard similarity of at least `threshold` with one
+    already added, without comparing against every one of them.
+    
+    Each text gets a MinHash signature of num_perm hash minima over its shingles (see shingles()
+    and word_shingles()). Texts sharing all rows of any band land in the same LSH bucket and
+    become candidates, checked against the exact Jaccard similarity. bands and rows come from
+    lsh_params(): 32 values at a 0.8 threshold make 8 bands of 4 rows, 64 values at 0.9 make 8
+    bands of 8 rows, and a pair at 0.5 similarity is then a candidate with probability 0.03. At
+    most max_candidates are checked per lookup, so an insert costs about the same however many
+    texts are indexed, even when they share a template; texts with the very same shingles are
+    found through a dict before that limit applies, without hashing them.
+    
+    That limit trades recall for speed: a duplicate among the candidates past it is missed (about
+    one duplicate in ten among 2,000 of the fake backend's templated ideas; see
+    benchmarks/bench_idea_dedup.py). Such lookups are counted in truncated_lookups (and DEDUP_TRUNCATED_LOOKUPS), and a lookup that was
+    cut short does not mark the texts it skipped as checked, so a later lookup of the same text
+    still considers them.
+    """
+    
+    def __init__(self, threshold: float = 0.8, shingler: Callable[[str], Set[str]] = shingles,
+                 num_perm: int = 32, max_candidates: int = 16, gram_cache_size: int = 4096, seed: int = 1):
+        self.threshold = threshold
+        self.shingler = shingler
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        self.max_candidates = max_candidates
+        self.gram_cache_size = gram_cache_size
+        rng = random.Random(seed)
+        self._masks = [rng.getrandbits(64) for _ in range(num_perm)]
+        self._buckets: Dict[Tuple[int, Tuple[int, ...]], List[int]] = {}
+        self._keys: List[str] = []
+        self._shingles: List[FrozenSet[str]] = []
+        self._exact: Dict[FrozenSet[str], int] = {}
+        self._prepared: Dict[str, list] = {}
+        self._gram_rows: Dict[str, Tuple[int, ...]] = {}
+        self.truncated_lookups = 0
+        self._lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return len(self._keys)
+    
+    def signature(self, grams: FrozenSet[str]) -> List[int]:
+        # One 64-bit hash per shingle; XOR with each random mask acts as an independent permutation.
+        # Shingles recur across texts (character grams of common words above all), so each one's
+        # num_perm permuted values are kept and a signature is the column-wise minimum of them
+        rows = []
+        for gram in grams:
+            row = self._gram_rows.get(gram)
+            if row is None:
+                value = (zlib.crc32(gram.encode("utf-8")) * _GOLDEN) & _MASK64
+                row = tuple([value ^ mask for mask in self._masks])
+                if len(self._gram_rows) >= self.gram_cache_size:
+                    self._gram_rows.clear()
+                self._gram_rows[gram] = row
+            rows.append(row)
+        return list(map(min, zip(*rows)))
+    
+    def _band_keys(self, signature: List[int]):
+        rows = self.rows
+        for band in range(self.bands):
+            yield band, tuple(signature[band * rows:(band + 1) * rows])
+    
+    def _prepare(self, text: str) -> list:
+        # find_duplicate() and add() are often called with the same text in turn: shingle and hash
+        # it once, and remember how many texts it has been checked against ([grams, signature, checked])
+        prepared = self._prepared.get(text)
+        if prepared is None:
+            prepared = [frozenset(self.shingler(text)), None, 0]
+            if len(self._prepared) >= 256:
+                self._prepared.clear()
+            self._prepared[text] = prepared
+        return prepared
+    
+    def _match(self, prepared: list) -> Optional[int]:
+        """The index of a near-duplicate of a prepared text among the texts indexed since it was
+        last checked without finding one, or None."""
+        grams, signature, start = prepared
+        exact = self._exact.get(grams)
+        if exact is not None and exact >= start:
+            return exact  # A reordered or reworded copy, found without hashing it
+        if signature is None:
+            signature = prepared[1] = self.signature(grams)
+        match, truncated = self._candidate_match(grams, signature, start)
+        if truncated:
+            self.truncated_lookups += 1
+            DEDUP_TRUNCATED_LOOKUPS.inc()
+        elif match is None:
+            prepared[2] = len(self._keys)
+        return match
+    
+    def _candidate_match(self, grams: FrozenSet[str], signature: List[int],
+                         start: int) -> Tuple[Optional[int], bool]:
+        """(index of a near-duplicate or None, whether max_candidates cut the check short)."""
+        size = len(grams)
+        # Jaccard similarity is at most the smaller set's size over the larger's
+        low, high = size * self.threshold, size / self.threshold
+        seen = set()
+        for band_key in self._band_keys(signature):
+            bucket = self._buckets.get(band_key)
+            if not bucket:
+                continue
+            for candidate in bucket[bisect.bisect_left(bucket, start):] if start else bucket:
+                if candidate in seen:
+                    continue
+                if len(seen) >= self.max_candidates:
+                    return None, True
+                seen.add(candidate)
+                other = self._shingles[candidate]
+                if not low <= len(other) <= high:
+                    continue
+                common = len(grams & other)
+                if common >= self.threshold * (size + len(other) - common):
+                    return candidate, False
+        return None, False
+    
+    def find_duplicate(self, text: str) -> Optional[str]:
+        """The key of an indexed text that text is a near-duplicate of, or None."""
+        with self._lock:
+            prepared = self._prepare(text)
+            if not prepared[0]:
+                return None
+            match = self._match(prepared)
+            return None if match is None else self._keys[match]
+    
+    def add(self, text: str, check: bool = True, key: Optional[str] = None) -> Optional[str]:
+        """Index text under key (default: the text itself) unless it is a near-duplicate of an
+        indexed text; returns that text's key if so. With check=False text is indexed
+        unconditionally (e.g. ideas restored from a journal)."""
+        with self._lock:
+            prepared = self._prepare(text)
+            grams = prepared[0]
+            if check and grams:
+                match = self._match(prepared)
+                if match is not None:
+                    return self._keys[match]
+            index = len(self._keys)
+            self._keys.append(text if key is None else key)
+            self._shingles.append(grams)
+            self._exact.setdefault(grams, index)
+            if grams:
+                if prepared[1] is None:
+                    prepared[1] = self.signature(grams)
+                for band_key in self._band_keys(prepared[1]):
+                    self._buckets.setdefault(band_key, []).append(index)
+            del self._prepared[text]  # Indexed: a later lookup of the same text must check everything
+        return None
@@ -0,0 +1,176 @@
+"""
+StagedPipeline: Runs framing, validation, diagrams and LaTeX writing as separately scaled stages.
+"""
+
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+from telemetry.accounting import question_scope
+
+
+class StagedPipeline:
+    """Runs framing, validation, diagrams and LaTeX writing as separately scaled stages.
+    
+    Each stage has its own worker count, thread pool and bounded input queue, so a slow
+    matplotlib render only ties up diagram workers while framing and validation keep going,
+    and a full queue pushes back on the stage in front of it. The generator supplies the
+    per-stage work (_next_job, _frame, _validate, _add_diagram, _accept_question).
+    """
+    
+    def __init__(self, generator, framer_workers: int = 2, validator_workers: int = 4,
+                 diagram_workers: int = 2, writer_workers: int = 1, queue_size: int = 8):
+        self.generator = generator
+        self.worker_counts = {
+            "framer": framer_workers,
+            "validator": validator_workers,
+            "diagram": diagram_workers,
+            "writer": writer_workers,
+        }
+        self.queue_size = queue_size
+    
+    async def run(self, topic_name: str, class_level: str, target_question_count: int):
+        """Feed ideas through the stages until target_question_count questions are written."""
+        self.topic_name = topic_name
+        self.class_level = class_level
+        self.target_question_count = target_question_count
+        
+        # One bounded queue in front of every stage for backpressure
+        self.queues = {stage: asyncio.Queue(maxsize=self.queue_size) for stage in self.worker_counts}
+        self.executors = {
+            stage: ThreadPoolExecutor(max_workers=count, thread_name_prefix=f"qpg-{stage}")
+            for stage, count in self.worker_counts.items()
+        }
+        self.executors["feeder"] = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qpg-feeder")
+        
+        # Jobs handed to the framer that have not yet been written or dropped
+        self.in_pipeline = 0
+        self.feeder_done = False
+        self.feeder_error = None
+        self.changed = asyncio.Condition()
+        # The LaTeX file is a single stream, so writes are serialized whatever the writer count
+        self.write_lock = asyncio.Lock()
+        
+        stages = {
+            "framer": self._frame_worker,
+            "validator": self._validate_worker,
+            "diagram": self._diagram_worker,
+            "writer": self._write_worker,
+        }
+        tasks = [asyncio.create_task(self._feeder())]
+        for stage, worker in stages.items():
+            tasks.extend(asyncio.create_task(worker()) for _ in range(self.worker_counts[stage]))
+        
+        try:
+            async with self.changed:
+                await self.changed.wait_for(self._finished)
+            if self.feeder_error is not None:
+                # Jobs already in the pipeline were finished (and journaled) first
+                raise self.feeder_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            for executor in self.executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+    
+    def _remaining(self) -> int:
+        return self.target_question_count - len(self.generator.validated_questions)
+    
+    def _finished(self) -> bool:
+        return self._remaining() <= 0 or (self.feeder_done and self.in_pipeline == 0)
+    
+    async def _run_stage(self, stage: str, func, *args):
+        loop = asyncio.get_running_loop()
+        # Carry the question scope (token accounting) over to the worker thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self.executors[stage], context.run, func, *args)
+    
+    async def _job_done(self):
+        """Mark one job as written or dropped and wake the feeder and the run loop."""
+        async with self.changed:
+            self.in_pipeline -= 1
+            self.changed.notify_all()
+    
+    async def _feeder(self):
+        """Hand out ideas, never keeping more in the pipeline than are still needed. If picking
+        the next job fails, no more are handed out and run() raises the error once the jobs in
+        the pipeline are done."""
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: self.in_pipeline < self._remaining())
+            
+            try:
+                job = await self._run_stage("feeder", self.generator._next_job, self.topic_name, self.class_level)
+            except Exception as e:
+                self.feeder_error = e
+                job = None
+            if job is None:
+                async with self.changed:
+                    self.feeder_done = True  # Safety limit reached (or no more jobs can be picked)
+                    self.changed.notify_all()
+                return
+            
+            async with self.changed:
+                self.in_pipeline += 1
+            await self.queues["framer"].put(job)
+    
+    async def _frame_worker(self):
+        while True:
+            job = await self.queues["framer"].get()
+            question = await self._guarded("framer", self.generator._frame, job, self.topic_name, self.class_level)
+            if question is None:
+                await self._job_done()
+            else:
+                await self.queues["validator"].put((job, question))
+    
+    async def _validate_worker(self):
+        while True:
+            job, question = await self.queues["validator"].get()
+            question = await self._guarded("validator", self.generator._validate, job, question,
+                                           self.topic_name, self.class_level)
+            if question is None:
+                await self._job_done()
+            else:
+                await self.queues["diagram"].put(question)
+    
+    async def _diagram_worker(self):
+        while True:
+            question = await self.queues["diagram"].get()
+            question = await self._guarded("diagram", self.generator._add_diagram, question, self.topic_name)
+            if question is None:
+                await self._job_done()
+            else:
+                await self.queues["writer"].put(question)
+    
+    async def _write_worker(self):
+        while True:
+            question = await self.queues["writer"].get()
+            async with self.write_lock:
+                if self._remaining() > 0:
+                    await self._guarded("writer", self.generator._accept_question, question,
+                                        self.target_question_count)
+                else:
+                    # Finished after the paper filled up: close it like any other job that is not needed
+                    await self._guarded("writer", self.generator._drop, question, "paper already complete", False)
+            await self._job_done()
+    
+    async def _guarded(self, stage: str, func, *args) -> Any:
+        """Run one unit of stage work; an unexpected error drops the job instead of the worker."""
+        # The first argument is always the job or question dict, which carries the question_id
+        item = args[0]
+        try:
+            with question_scope(item.get("question_id")):
+                return await self._run_stage(stage, func, *args)
+        except Exception as e:
+            print(f"      ❌ {stage.capitalize()} stage failed: {e}")
+            accepted = stage == "writer" and any(q.get("question_id") == item.get("question_id")
+                                                 for q in self.generator.validated_questions)
+            if not accepted:
+                # Release its slot and journal it, so neither quotas nor a --resume count it as open
+                try:
+                    self.generator._drop(item, f"{stage} stage failed: {e}")
+                except Exception as drop_error:
+                    print(f"      ❌ Could not drop {item.get('question_id')}: {drop_error}")
+            return None
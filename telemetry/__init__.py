@@ -0,0 +1 @@
+# Empty init for telemetry package
\ No newline at end of file
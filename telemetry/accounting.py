@@ -0,0 +1,148 @@
+"""
+Accounting: Token and call counts per agent, per question and per run, read from usage_metadata.
+"""
+
+import contextvars
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+# The question a model call is being made for; None for run-level calls such as research
+current_question_id = contextvars.ContextVar("current_question_id", default=None)
+
+
+@contextmanager
+def question_scope(question_id: Optional[str]):
+    """Attribute every model call made inside the block to question_id."""
+    token = current_question_id.set(question_id)
+    try:
+        yield
+    finally:
+        current_question_id.reset(token)
+
+
+def _empty_bucket() -> Dict[str, int]:
+    return {"calls": 0, "failed_calls": 0, "prompt_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+
+
+class UsageLedger:
+    """Thread-safe running totals of LLM calls and tokens.
+    
+    Prices are optional (USD per million tokens); when given, the summary includes an
+    estimated cost for the run and per accepted question.
+    """
+    
+    def __init__(self, input_price_per_million: Optional[float] = None,
+                 output_price_per_million: Optional[float] = None):
+        self.input_price_per_million = input_price_per_million
+        self.output_price_per_million = output_price_per_million
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self._lock:
+            self.total = _empty_bucket()
+            self.by_agent = {}
+            self.by_question = {}
+    
+    def record(self, agent_name: str, prompt_tokens: int, output_tokens: int, failed: bool = False):
+        """Add one model call, attributed to the agent and the current question."""
+        question_id = current_question_id.get() or "run"
+        with self._lock:
+            for bucket in (self.total,
+                           self.by_agent.setdefault(agent_name, _empty_bucket()),
+                           self.by_question.setdefault(question_id, _empty_bucket())):
+                bucket["calls"] += 1
+                bucket["failed_calls"] += int(failed)
+                bucket["prompt_tokens"] += prompt_tokens
+                bucket["output_tokens"] += output_tokens
+                bucket["total_tokens"] += prompt_tokens + output_tokens
+    
+    def _cost(self, bucket: Dict[str, int]) -> Optional[float]:
+        if self.input_price_per_million is None or self.output_price_per_million is None:
+            return None
+        return round((bucket["prompt_tokens"] * self.input_price_per_million +
+                      bucket["output_tokens"] * self.output_price_per_million) / 1_000_000, 6)
+    
+    def summary(self, accepted_question_ids=()) -> Dict[str, Any]:
+        """Totals for the output JSON; per-accepted-question figures use the given question IDs."""
+        with self._lock:
+            summary = {
+                "total": dict(self.total),
+                "by_agent": {agent: dict(bucket) for agent, bucket in sorted(self.by_agent.items())},
+                "by_question": {qid: dict(bucket) for qid, bucket in sorted(self.by_question.items())},
+            }
+        
+        accepted = len(accepted_question_ids)
+        if accepted:
+            summary["per_accepted_question"] = {
+                "calls": round(summary["total"]["calls"] / accepted, 2),
+                "total_tokens": round(summary["total"]["total_tokens"] / accepted, 1),
+            }
+        cost = self._cost(summary["total"])
+        if cost is not None:
+            summary["estimated_cost_usd"] = cost
+            if accepted:
+                summary["per_accepted_question"]["estimated_cost_usd"] = round(cost / accepted, 6)
+        return summary
+
+
+class MeteredModel:
+    """Wraps a model and records each call's usage_metadata into a UsageLedger."""
+    
+    def __init__(self, inner, ledger: UsageLedger, agent_name: str):
+        self.inner = inner
+        self.ledger = ledger
+        self.agent_name = agent_name
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        try:
+            response = self.inner.generate_content(prompt, **kwargs)
+        except Exception:
+            self.ledger.record(self.agent_name, 0, 0, failed=True)
+            raise
+        
+        if kwargs.get("stream") and hasattr(response, "__iter__"):
+            # Usage is only known once the stream has been read (or abandoned)
+            return MeteredStream(response, lambda: self._record(response))
+        self._record(response)
+        return response
+    
+    def _record(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        self.ledger.record(self.agent_name, prompt_tokens, output_tokens)
+
+
+class MeteredStream:
+    """A streamed response that calls on_done once, when it is exhausted or closed."""
+    
+    def __init__(self, inner, on_done):
+        self.inner = inner
+        self._on_done = on_done
+        self._done = False
+    
+    def __iter__(self):
+        try:
+            yield from self.inner
+        finally:
+            self.close()
+    
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        close = getattr(self.inner, "close", None)
+        if close is not None:
+            close()
+        self._on_done()
+    
+    @property
+    def text(self) -> str:
+        return self.inner.text
+    
+    @property
+    def usage_metadata(self):
+        return getattr(self.inner, "usage_metadata", None)
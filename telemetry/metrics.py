@@ -0,0 +1,220 @@
+"""
+Metrics: Prometheus text-format counters and histograms for the generation pipeline.
+"""
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Tuple, List
+
+DEFAULT_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    """A sample value: whole numbers exactly (":g" would turn 1234567 into 1.23457e+06), else full precision."""
+    if abs(value) < 2 ** 53 and value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _help_line(name: str, documentation: str) -> str:
+    escaped = documentation.replace("\\", "\\\\").replace("\n", "\\n")
+    return f"# HELP {name} {escaped}"
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = []
+    for name, value in zip(labelnames, values):
+        escaped = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{name}="{escaped}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+    
+    def __init__(self, name: str, documentation: str, labelnames: List[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], float] = {}
+    
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [_help_line(self.name, self.documentation), f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values) or ({(): 0.0} if not self.labelnames else {})
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by labels."""
+    
+    def __init__(self, name: str, documentation: str, labelnames: List[str] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series: Dict[Tuple[str, ...], Dict] = {}
+    
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+    
+    def render(self) -> List[str]:
+        lines = [_help_line(self.name, self.documentation), f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]}
+                      for key, s in self._series.items()}
+        for key, s in sorted(series.items()):
+            for bound, count in zip(self.buckets, s["counts"]):
+                labels = _format_labels(self.labelnames, key, f'le="{bound:g}"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            inf_labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf_labels} {s['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(s['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {s['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """Holds every metric and renders them in the Prometheus text exposition format."""
+    
+    def __init__(self):
+        self._metrics = []
+    
+    def counter(self, name: str, documentation: str, labelnames: List[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+    
+    def histogram(self, name: str, documentation: str, labelnames: List[str] = (),
+                  buckets: Tuple[float, ...] = DEFAULT_LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+    
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "qpg_llm_call_duration_seconds", "Latency of generate_content calls.", ["agent", "outcome"])
+FRAMER_JSON_PARSE_FAILURES = REGISTRY.counter(
+    "qpg_framer_json_parse_failures_total", "QuestionFramerAgent responses that did not parse as JSON.")
+VALIDATION_REJECTIONS = REGISTRY.counter(
+    "qpg_validation_rejections_total", "Questions ValidatorAgent judged invalid.")
+VALIDATION_CORRECTIONS = REGISTRY.counter(
+    "qpg_validation_corrections_total", "Invalid questions for which ValidatorAgent suggested corrections.")
+VALIDATION_EARLY_ACCEPTS = REGISTRY.counter(
+    "qpg_validation_early_accepts_total", "Streamed validations accepted before the rest of the reply was read.")
+PYTHON_DIAGRAM_FALLBACKS = REGISTRY.counter(
+    "qpg_python_diagram_fallbacks_total", "PythonDiagramAgent runs that fell back to a placeholder image.")
+IDEA_REFILLS = REGISTRY.counter(
+    "qpg_idea_refills_total", "Background research calls started because fresh ideas fell to the low watermark.")
+IDEAS_REUSED = REGISTRY.counter(
+    "qpg_ideas_reused_total", "Used ideas handed out again because no fresh idea was available.")
+IDEAS_DEDUPLICATED = REGISTRY.counter(
+    "qpg_ideas_deduplicated_total", "Researched ideas dropped as near-duplicates of an earlier idea.")
+DUPLICATE_QUESTIONS = REGISTRY.counter(
+    "qpg_duplicate_questions_total", "Validated questions dropped as near-duplicates of one already in the paper.")
+DEDUP_TRUNCATED_LOOKUPS = REGISTRY.counter(
+    "qpg_dedup_truncated_lookups_total",
+    "Near-duplicate lookups that stopped at max_candidates, so a duplicate past them could be missed.")
+QUESTIONS_WRITTEN = REGISTRY.counter(
+    "qpg_questions_written_total", "Questions written to the LaTeX file.")
+
+
+class InstrumentedModel:
+    """Wraps a model and records each call's latency in LLM_CALL_SECONDS."""
+    
+    def __init__(self, inner, agent_name: str):
+        self.inner = inner
+        self.agent_name = agent_name
+        self.model_name = getattr(inner, "model_name", None)
+    
+    def generate_content(self, prompt: str, **kwargs):
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = self.inner.generate_content(prompt, **kwargs)
+            outcome = "ok"
+            return response
+        finally:
+            LLM_CALL_SECONDS.observe(time.perf_counter() - started, agent=self.agent_name, outcome=outcome)
+
+
+def start_http_server(port: int, registry: MetricsRegistry = REGISTRY, host: str = "0.0.0.0"):
+    """Serve /metrics on a daemon thread."""
+    # Imported here so runs without --metrics-port don't pay for http.server
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):
+            pass  # Keep scrapes out of the console output
+    
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class TextfileExporter:
+    """Periodically rewrites a .prom file (e.g. for node_exporter's textfile collector)."""
+    
+    def __init__(self, path: str, interval: float = 15.0, registry: MetricsRegistry = REGISTRY):
+        self.path = Path(path)
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-textfile", daemon=True)
+    
+    def start(self) -> "TextfileExporter":
+        self._thread.start()
+        return self
+    
+    def write(self):
+        # Atomic swap so a scrape never reads a half-written file
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp_path.write_text(self.registry.render(), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+    
+    def stop(self):
+        """Stop the writer thread and write the final values."""
+        self._stop.set()
+        self._thread.join()
+        self.write()
@@ -0,0 +1,122 @@
+"""
+Tracing: Lightweight per-stage spans written to a Chrome-trace / JSONL file.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+
+class Span:
+    """One timed unit of work. Attach details (outcome, attempt, ...) with set()."""
+    
+    def __init__(self, name: str, args: Dict[str, Any]):
+        self.name = name
+        self.args = {"outcome": "ok", **args}
+    
+    def set(self, **args):
+        self.args.update(args)
+
+
+class Tracer:
+    """Writes completed spans as Chrome trace events.
+    
+    A path ending in .jsonl gets one event per line; anything else gets the Chrome
+    "JSON array" format. Spans are appended as they finish and the array is closed by close(),
+    so a finished trace is valid JSON and a crashed run's is still readable (trace viewers
+    accept an unterminated array). Open it in chrome://tracing or https://ui.perfetto.dev.
+    """
+    
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.jsonl = self.path.suffix == ".jsonl"
+        self._lock = threading.Lock()
+        self._named_threads = set()
+        self._origin = time.perf_counter()
+        self._pid = os.getpid()
+        self._events = 0
+        self._file = open(self.path, 'w', encoding='utf-8')
+        if not self.jsonl:
+            self._file.write("[\n")
+        self._emit({"name": "process_name", "ph": "M", "pid": self._pid, "tid": 0,
+                    "args": {"name": "question paper generator", "started_at": time.time()}})
+    
+    def _now_us(self) -> float:
+        return round((time.perf_counter() - self._origin) * 1_000_000, 1)
+    
+    def _emit(self, event: Dict[str, Any]):
+        line = json.dumps(event, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            if self.jsonl:
+                self._file.write(line + "\n")
+            else:
+                self._file.write((",\n" if self._events else "") + line)
+            self._events += 1
+            self._file.flush()
+    
+    @contextmanager
+    def span(self, name: str, **args):
+        span = Span(name, args)
+        thread = threading.current_thread()
+        with self._lock:
+            first_span_on_thread = thread.ident not in self._named_threads
+            self._named_threads.add(thread.ident)
+        if first_span_on_thread:
+            self._emit({"name": "thread_name", "ph": "M", "pid": self._pid, "tid": thread.ident,
+                        "args": {"name": thread.name}})
+        
+        started = self._now_us()
+        try:
+            yield span
+        except BaseException as e:
+            span.set(outcome="error", error=f"{type(e).__name__}: {e}")
+            raise
+        finally:
+            self._emit({
+                "name": name,
+                "cat": "qpg",
+                "ph": "X",
+                "ts": started,
+                "dur": round(self._now_us() - started, 1),
+                "pid": self._pid,
+                "tid": thread.ident,
+                "args": span.args,
+            })
+    
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                if not self.jsonl:
+                    self._file.write("\n]\n")
+                self._file.close()
+                self._file = None
+
+
+_tracer: Optional[Tracer] = None
+
+
+def set_tracer(tracer: Optional[Tracer]):
+    """Install the process-wide tracer (None turns tracing off)."""
+    global _tracer
+    _tracer = tracer
+
+
+def get_tracer() -> Optional[Tracer]:
+    return _tracer
+
+
+@contextmanager
+def span(name: str, **args):
+    """Time a block under the current tracer; a no-op span when tracing is off."""
+    tracer = _tracer
+    if tracer is None:
+        yield Span(name, args)
+        return
+    with tracer.span(name, **args) as active:
+        yield active
@@ -3,26 +3,64 @@ Comprehensive test suite for all agents in the question paper generation system.
 Tests individual agents and the full pipeline with various corner cases.
 """
 
+import asyncio
 import os
 import json
+import random
+import re
+import shutil
 import sys
+import threading
+import time
+import zlib
 from pathlib import Path
+from types import SimpleNamespace
 from dotenv import load_dotenv
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from agents.research_agent import ResearchAgent
+from agents.research_agent import ResearchAgent, split_topic
 from agents.question_framer_agent import QuestionFramerAgent
 from agents.validator_agent import ValidatorAgent
 from agents.diagram_agent import DiagramAgent
 from agents.python_diagram_agent import PythonDiagramAgent
 from writers.latex_writer import LaTeXWriter
 from main import QuestionPaperGenerator
+from llm.cache import CachedModel, ResponseCache, evict
+from llm.cassette import Cassette, RecordingModel, ReplayModel, CassetteMissError
+from llm.client import LLMClient, LLMJSONError, TimeoutModel, _CallPool
+from llm.fake import FakeBackend
+from llm.gemini import GeminiStream
+from llm.json_repair import repair_json
+from llm.ratelimit import RateLimiter
+from llm.retry import CircuitBreaker, ProviderUnavailableError, RetryingModel, RetryPolicy, is_transient
+from llm.schemas import FRAMER_SCHEMA
+from llm.singleflight import SingleFlight
+from pipeline.batch import load_manifest, run_batch
+from pipeline.idea_pool import IdeaPool, DRY_REFILL_BACKOFF
+from pipeline.journal import RunJournal
+from pipeline.minhash import MinHashIndex
+from telemetry.accounting import MeteredModel, UsageLedger, question_scope
+from telemetry.metrics import DEDUP_TRUNCATED_LOOKUPS, REGISTRY, MetricsRegistry, VALIDATION_EARLY_ACCEPTS
+from telemetry.tracing import Tracer, set_tracer
 
 load_dotenv()
 
 
+class FakeClock:
+    """A clock for time-dependent code that only moves when sleep() is called."""
+    
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+    
+    def __call__(self) -> float:
+        return self.now
+    
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
 class TestRunner:
     """Test runner for all agents."""
     
@@ -531,6 +569,1358 @@ class TestRunner:
         except Exception as e:
             self.log_test("Corner Case: Very long question text", False, str(e))
     
+    def test_cassette_record_replay(self):
+        """Test that a recorded cassette replays the same responses without the network."""
+        print("\n" + "="*60)
+        print("TESTING Cassette Record/Replay")
+        print("="*60)
+        
+        class EchoModel:
+            model_name = "models/gemini-2.5-flash-lite"
+            calls = 0
+            
+            def generate_content(self, prompt, **kwargs):
+                EchoModel.calls += 1
+                return type("Response", (), {"text": f"echo {EchoModel.calls}: {prompt}", "usage_metadata": None})()
+        
+        cassette_path = self.output_dir / "test_cassette.jsonl"
+        if cassette_path.exists():
+            cassette_path.unlink()
+        
+        try:
+            recorder = RecordingModel(EchoModel(), Cassette(str(cassette_path)), "framer")
+            recorded = [recorder.generate_content("same prompt").text for _ in range(2)]
+            
+            replayer = ReplayModel(Cassette(str(cassette_path)), "framer", latency=0)
+            replayed = [replayer.generate_content("same prompt").text for _ in range(2)]
+            lines = cassette_path.read_text(encoding="utf-8").splitlines()
+            self.log_test("Cassette: Replay matches recording", replayed == recorded and len(lines) == 2,
+                         f"{len(recorded)} responses, {len(lines)} lines appended")
+        except Exception as e:
+            self.log_test("Cassette: Replay matches recording", False, str(e))
+        
+        try:
+            replayer = ReplayModel(Cassette(str(cassette_path)), "validator", latency=0)
+            replayer.generate_content("same prompt")
+            self.log_test("Cassette: Unrecorded prompt raises", False, "No error raised")
+        except CassetteMissError:
+            self.log_test("Cassette: Unrecorded prompt raises", True)
+        except Exception as e:
+            self.log_test("Cassette: Unrecorded prompt raises", False, str(e))
+        
+        try:
+            config = {"generation_config": {"response_mime_type": "application/json"}}
+            recorder = RecordingModel(EchoModel(), Cassette(str(cassette_path)), "framer")
+            structured = recorder.generate_content("same prompt", **config).text
+            replayer = ReplayModel(Cassette(str(cassette_path)), "framer", latency=0)
+            replayed = [replayer.generate_content("same prompt", **config).text,
+                        replayer.generate_content("same prompt").text]
+            self.log_test("Cassette: Calls with other options are recorded apart",
+                         replayed == [structured, recorded[0]], f"{replayed}")
+        except Exception as e:
+            self.log_test("Cassette: Calls with other options are recorded apart", False, str(e))
+        
+        legacy_path = self.output_dir / "test_cassette_legacy.json"
+        try:
+            key = Cassette.key("framer", "gemini-2.5-flash-lite", "old prompt")
+            legacy_path.write_text(json.dumps({"version": 1, "entries": {
+                key: {"prompt": "old prompt", "responses": [{"text": "old reply", "latency": 0.0}]}}}), encoding="utf-8")
+            recorder = RecordingModel(EchoModel(), Cassette(str(legacy_path)), "framer")
+            recorder.generate_content("new prompt")
+            replayer = ReplayModel(Cassette(str(legacy_path)), "framer", latency=0)
+            replayed = [replayer.generate_content(prompt).text for prompt in ("old prompt", "new prompt")]
+            lines = legacy_path.read_text(encoding="utf-8").splitlines()
+            self.log_test("Cassette: Old single-JSON cassettes load and convert on record",
+                         replayed[0] == "old reply" and replayed[1].endswith("new prompt") and len(lines) == 2,
+                         f"{replayed}, {len(lines)} lines")
+        except Exception as e:
+            self.log_test("Cassette: Old single-JSON cassettes load and convert on record", False, str(e))
+    
+    def test_json_repair(self):
+        """Test that each repair llm/json_repair.py documents recovers the intended value."""
+        print("\n" + "="*60)
+        print("TESTING JSON Repair")
+        print("="*60)
+        
+        cases = [
+            ("latex_escape", '{"q": "$\\frac{1}{2} \\times 4$"}', {"q": "$\\frac{1}{2} \\times 4$"}),
+            ("invalid_escape", '{"q": "50\\% off"}', {"q": "50\\% off"}),
+            ("control_character", '{"q": "line 1\nline 2"}', {"q": "line 1\nline 2"}),
+            ("unescaped_quote", '{"q": "He said "hi" to me"}', {"q": 'He said "hi" to me'}),
+            ("single_quotes", "{'a': 'x'}", {"a": "x"}),
+            ("python_literal", '{"a": True, "b": None}', {"a": True, "b": None}),
+            ("unquoted_key", '{a: 1}', {"a": 1}),
+            ("trailing_comma", '{"a": [1, 2,],}', {"a": [1, 2]}),
+            ("extra_comma", '{"a": 1,, "b": 2}', {"a": 1, "b": 2}),
+            ("missing_comma", '{"a": "x" "b": 2}', {"a": "x", "b": 2}),
+            ("missing_comma", '{"options": ["3" "4"]}', {"options": ["3", "4"]}),
+            ("trailing_text", '{"a": 1} Hope this helps!', {"a": 1}),
+            ("truncated", '{"a": 1, "b": "unfinish', {"a": 1}),
+        ]
+        for kind, text, expected in cases:
+            try:
+                value, repairs = repair_json(text)
+                self.log_test(f"JSON Repair: {kind} {text!r}", value == expected and repairs == [kind],
+                             f"{value}, repairs: {repairs}")
+            except Exception as e:
+                self.log_test(f"JSON Repair: {kind} {text!r}", False, str(e))
+        
+        try:
+            # \t followed by letters is a tab unless it starts a LaTeX command
+            value, repairs = repair_json('{"t": "col1\\tcol2"}')
+            self.log_test("JSON Repair: Valid escapes are kept", value == {"t": "col1\tcol2"} and not repairs,
+                         f"{value}, repairs: {repairs}")
+        except Exception as e:
+            self.log_test("JSON Repair: Valid escapes are kept", False, str(e))
+    
+    def test_structured_output(self):
+        """Test that structured JSON calls reject replies that break the agent's schema."""
+        print("\n" + "="*60)
+        print("TESTING Structured Output")
+        print("="*60)
+        
+        class SchemaBreakingModel:
+            """Answers the first call with JSON that FRAMER_SCHEMA rejects, later ones from model."""
+            model_name = "fake"
+            
+            def __init__(self, model=None):
+                self.model = model
+                self.calls = 0
+            
+            def generate_content(self, prompt, **kwargs):
+                self.calls += 1
+                if self.calls == 1 or self.model is None:
+                    text = json.dumps({"question_text": "What is 2 + 2?", "options": "4", "correct_option": "E"})
+                    return type("Response", (), {"text": text, "usage_metadata": None})()
+                return self.model.generate_content(prompt, **kwargs)
+        
+        try:
+            client = LLMClient(SchemaBreakingModel(), "framer", structured=True)
+            client.generate_json("Frame a question", schema=FRAMER_SCHEMA)
+            self.log_test("Structured Output: Schema violations raise schema_error", False, "No error raised")
+        except LLMJSONError as e:
+            self.log_test("Structured Output: Schema violations raise schema_error", e.kind == "schema_error", str(e))
+        except Exception as e:
+            self.log_test("Structured Output: Schema violations raise schema_error", False, str(e))
+        
+        try:
+            model = SchemaBreakingModel(FakeBackend(seed=7).model_for("framer"))
+            framer = QuestionFramerAgent(LLMClient(model, "framer", structured=True))
+            question = framer.frame_question("Fencing a rectangular garden", "Perimeter", "Class 6", "Q01")
+            self.log_test("Structured Output: The framer retries a schema violation",
+                         model.calls == 2 and len(question.get("options", [])) == 4,
+                         f"{model.calls} calls")
+        except Exception as e:
+            self.log_test("Structured Output: The framer retries a schema violation", False, str(e))
+        
+        try:
+            backend = FakeBackend(seed=7, malformed_rate=0.3)
+            calls = self._record_calls(backend)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_structured"),
+                                               model_factory=backend.model_for, structured_output=True)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=10)
+            # Every JSON call sends a response_schema, so none of them gets a malformed reply
+            unstructured = [agent_name for agent_name, _, structured, _ in calls
+                            if agent_name in ("framer", "validator") and not structured]
+            self.log_test("Structured Output: The pipeline sends schemas and avoids malformed replies",
+                         result.get("total_questions") == 10 and not unstructured
+                         and backend.stats["malformed"] == 0,
+                         f"{len(calls)} LLM calls, {len(unstructured)} without a schema, "
+                         f"malformed: {backend.stats['malformed']}")
+        except Exception as e:
+            self.log_test("Structured Output: The pipeline sends schemas and avoids malformed replies", False, str(e))
+    
+    def test_idea_pool(self):
+        """Test that IdeaPool backs off from refills that find nothing new instead of stopping them."""
+        print("\n" + "="*60)
+        print("TESTING Idea Pool")
+        print("="*60)
+        
+        try:
+            refills = []
+            
+            def refill():
+                refills.append(pool._taken)
+                new = ["idea 3"] if len(refills) == 4 else []  # Only the fourth research round finds anything
+                return iter([["idea 1", "idea 2"] + new])
+            
+            pool = IdeaPool(["idea 1", "idea 2"], refill=refill, low_watermark=1)
+            ideas = []
+            for _ in range(60):
+                ideas.append(pool.take())
+                if pool._thread is not None:
+                    pool._thread.join()  # Let each background refill land before the next take
+            backoff = DRY_REFILL_BACKOFF
+            expected = [1, 1 + backoff, 1 + 3 * backoff, 1 + 7 * backoff]
+            self.log_test("Idea Pool: Dry refills back off and are retried",
+                         refills[:4] == expected and "idea 3" in ideas and None not in ideas,
+                         f"refills after {refills} takes, {len(pool)} ideas")
+        except Exception as e:
+            self.log_test("Idea Pool: Dry refills back off and are retried", False, str(e))
+    
+    @staticmethod
+    def _record_calls(backend):
+        """Record (agent_name, prompt, structured, stream) for every call the fake backend answers."""
+        calls = []
+        respond = backend.respond
+        
+        def recording_respond(agent_name, prompt, structured=False, stream=False):
+            calls.append((agent_name, prompt, structured, stream))
+            return respond(agent_name, prompt, structured=structured, stream=stream)
+        
+        backend.respond = recording_respond
+        return calls
+    
+    def test_response_cache(self):
+        """Test the response cache's hits, options in the key, TTL expiry, LRU eviction and evict()."""
+        print("\n" + "="*60)
+        print("TESTING Response Cache")
+        print("="*60)
+        
+        class CountingModel:
+            model_name = "models/fake"
+            
+            def __init__(self):
+                self.calls = 0
+            
+            def generate_content(self, prompt, **kwargs):
+                self.calls += 1
+                return type("Response", (), {"text": f"reply {self.calls}", "usage_metadata": None})()
+        
+        cache_path = self.output_dir / "test_cache" / "responses.sqlite"
+        if cache_path.parent.exists():
+            shutil.rmtree(cache_path.parent)
+        clock = FakeClock()
+        
+        try:
+            cache = ResponseCache(str(cache_path), ttls={"framer": 60}, clock=clock)
+            inner = CountingModel()
+            model = CachedModel(inner, cache, "framer")
+            first, second = model.generate_content("same prompt"), model.generate_content("same  prompt")
+            other = model.generate_content("same prompt", generation_config={"temperature": 0})
+            self.log_test("Response Cache: Repeats hit, other options miss",
+                         (first.text, second.text, other.text) == ("reply 1", "reply 1", "reply 2")
+                         and second.cache_hit and inner.calls == 2,
+                         f"{inner.calls} inner calls, {cache.summary()['hits']} hits")
+            
+            clock.sleep(61)
+            expired = model.generate_content("same prompt")
+            self.log_test("Response Cache: Entries expire after their agent's TTL",
+                         not expired.cache_hit and expired.text == "reply 3", expired.text)
+            
+            evict(expired)
+            refetched = model.generate_content("same prompt")
+            self.log_test("Response Cache: evict() drops a bad response",
+                         not refetched.cache_hit and refetched.text == "reply 4", refetched.text)
+            cache.close()
+        except Exception as e:
+            self.log_test("Response Cache: Hits, TTLs and eviction", False, repr(e))
+        
+        try:
+            entry = len(zlib.compress(json.dumps({"text": "x" * 100, "usage": None}).encode("utf-8")))
+            cache = ResponseCache(str(cache_path.with_name("lru.sqlite")), max_bytes=2 * entry, clock=clock)
+            for key in ("a", "b"):
+                clock.sleep(1)
+                cache.put(key, "framer", "models/fake", "x" * 100, None)
+            clock.sleep(1)
+            cache.get("a", "framer")  # Now more recently used than "b"
+            clock.sleep(1)
+            cache.put("c", "framer", "models/fake", "x" * 100, None)
+            kept = [key for key in ("a", "b", "c") if cache.get(key, "framer") is not None]
+            self.log_test("Response Cache: The least recently used entry is evicted first",
+                         kept == ["a", "c"], f"kept {kept}")
+            cache.close()
+        except Exception as e:
+            self.log_test("Response Cache: The least recently used entry is evicted first", False, repr(e))
+        
+        class BlockingModel:
+            """Holds every call until release is set, counting the prompts it was called with."""
+            model_name = "models/fake"
+            
+            def __init__(self):
+                self.prompts = []
+                self.release = threading.Event()
+            
+            def generate_content(self, prompt, **kwargs):
+                self.prompts.append(prompt)
+                self.release.wait(10)
+                return type("Response", (), {"text": f"reply to {prompt}", "usage_metadata": None})()
+        
+        def call_in_thread(model, prompt, replies):
+            thread = threading.Thread(target=lambda: replies.append(model.generate_content(prompt).text), daemon=True)
+            thread.start()
+            return thread
+        
+        try:
+            # Two handles on one store stand in for two processes
+            shared_path = str(cache_path.with_name("shared.sqlite"))
+            inner = BlockingModel()
+            first, second = ResponseCache(shared_path), ResponseCache(shared_path)
+            replies = []
+            threads = [call_in_thread(CachedModel(inner, first, "framer"), "prompt a", replies),
+                       call_in_thread(CachedModel(inner, second, "framer"), "prompt b", replies)]
+            deadline = time.monotonic() + 5
+            while len(inner.prompts) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            parallel = sorted(inner.prompts) == ["prompt a", "prompt b"]  # Both in flight at once
+            inner.release.set()
+            for thread in threads:
+                thread.join(10)
+            self.log_test("Response Cache: Misses for different keys fill in parallel",
+                         parallel and len(replies) == 2, f"in flight together: {inner.prompts}")
+            
+            inner = BlockingModel()
+            replies = []
+            leader = call_in_thread(CachedModel(inner, first, "framer"), "prompt c", replies)
+            deadline = time.monotonic() + 5
+            while not inner.prompts and time.monotonic() < deadline:
+                time.sleep(0.01)
+            follower = call_in_thread(CachedModel(inner, second, "framer"), "prompt c", replies)
+            follower.join(0.3)
+            waited = follower.is_alive() and inner.prompts == ["prompt c"]
+            inner.release.set()
+            leader.join(10)
+            follower.join(10)
+            self.log_test("Response Cache: Misses for one key make a single call",
+                         waited and inner.prompts == ["prompt c"] and replies == ["reply to prompt c"] * 2,
+                         f"{len(inner.prompts)} calls, {replies}")
+            first.close()
+            second.close()
+        except Exception as e:
+            self.log_test("Response Cache: Concurrent misses", False, repr(e))
+    
+    def test_coalescing(self):
+        """Test that identical concurrent calls share one request, including its error."""
+        print("\n" + "="*60)
+        print("TESTING Call Coalescing")
+        print("="*60)
+        
+        def wait_for(condition, timeout=10.0):
+            deadline = time.monotonic() + timeout
+            while not condition():
+                if time.monotonic() > deadline:
+                    raise TimeoutError("condition not reached")
+                time.sleep(0.001)
+        
+        def share(group, key, fn, followers):
+            """Run fn as the leader of key while `followers` callers join it; return all outcomes."""
+            release = threading.Event()
+            outcomes = []
+            
+            def leader_fn():
+                release.wait(10)
+                return fn()
+            
+            def caller(fn):
+                try:
+                    outcomes.append(group.do(key, fn))
+                except Exception as e:
+                    outcomes.append(e)
+            
+            threads = [threading.Thread(target=caller, args=(leader_fn,))]
+            threads[0].start()
+            wait_for(lambda: key in group._calls)
+            threads += [threading.Thread(target=caller, args=(fn,)) for _ in range(followers)]
+            for thread in threads[1:]:
+                thread.start()
+            wait_for(lambda: group._calls[key].waiters == followers)
+            release.set()
+            for thread in threads:
+                thread.join(10)
+            return outcomes
+        
+        try:
+            group = SingleFlight()
+            calls = []
+            outcomes = share(group, "k", lambda: calls.append(1) or "reply", followers=3)
+            shared = sorted(outcome[1] for outcome in outcomes)
+            self.log_test("Coalescing: Concurrent callers share one call",
+                         len(calls) == 1 and [outcome[0] for outcome in outcomes] == ["reply"] * 4
+                         and shared == [False, True, True, True],
+                         f"{len(calls)} calls for {len(outcomes)} callers")
+            
+            result, was_shared = group.do("k", lambda: "fresh")
+            self.log_test("Coalescing: A later call is not served the finished one",
+                         (result, was_shared) == ("fresh", False), f"{result}, shared: {was_shared}")
+        except Exception as e:
+            self.log_test("Coalescing: Concurrent callers share one call", False, repr(e))
+        
+        try:
+            def fail():
+                raise ValueError("bad request")
+            
+            outcomes = share(SingleFlight(), "k", fail, followers=2)
+            self.log_test("Coalescing: The leader's error reaches every caller",
+                         len(outcomes) == 3 and all(isinstance(outcome, ValueError) for outcome in outcomes),
+                         f"{outcomes}")
+        except Exception as e:
+            self.log_test("Coalescing: The leader's error reaches every caller", False, repr(e))
+    
+    def test_rate_limiter(self):
+        """Test the request and token buckets against a fake clock."""
+        print("\n" + "="*60)
+        print("TESTING Rate Limiter")
+        print("="*60)
+        
+        try:
+            clock = FakeClock()
+            limiter = RateLimiter(requests_per_minute=60, clock=clock, sleep=clock.sleep)
+            waits = [limiter.acquire() for _ in range(61)]
+            self.log_test("Rate Limiter: A full request bucket is spent, then refills at rpm/60 per second",
+                         waits[:60] == [0.0] * 60 and abs(waits[60] - 1.0) < 1e-9, f"last wait {waits[60]:.3f}s")
+        except Exception as e:
+            self.log_test("Rate Limiter: A full request bucket is spent, then refills at rpm/60 per second", False, repr(e))
+        
+        try:
+            clock = FakeClock()
+            limiter = RateLimiter(tokens_per_minute=6000, clock=clock, sleep=clock.sleep)
+            first = limiter.acquire(4000)
+            second = limiter.acquire(4000)  # 2000 left: waits for 2000 more at 100 per second
+            limiter.settle(1000, 3000)  # The call used 2000 more than estimated
+            third = limiter.acquire(1000)
+            self.log_test("Rate Limiter: Token waits follow the estimate and the settled usage",
+                         first == 0.0 and abs(second - 20.0) < 1e-9 and abs(third - 30.0) < 1e-9,
+                         f"waits {first:.1f}s, {second:.1f}s, {third:.1f}s")
+        except Exception as e:
+            self.log_test("Rate Limiter: Token waits follow the estimate and the settled usage", False, repr(e))
+    
+    def test_retry(self):
+        """Test retry classification, attempt limits and the circuit breaker's states."""
+        print("\n" + "="*60)
+        print("TESTING Retries and Circuit Breaker")
+        print("="*60)
+        
+        class FlakyModel:
+            model_name = "models/fake"
+            
+            def __init__(self, errors):
+                self.errors = list(errors)
+                self.calls = 0
+            
+            def generate_content(self, prompt, **kwargs):
+                self.calls += 1
+                if self.errors:
+                    raise self.errors.pop(0)
+                return "reply"
+        
+        cases = [(TimeoutError(), True), (RuntimeError("429 Too Many Requests"), True),
+                 (RuntimeError("503 Service Unavailable"), True), (ValueError("400 Bad Request"), False),
+                 (PermissionError("permission denied"), False)]
+        classified = [is_transient(error) == expected for error, expected in cases]
+        self.log_test("Retry: Transient errors are told from permanent ones", all(classified),
+                     f"{[repr(error) for (error, _), ok in zip(cases, classified) if not ok]} misclassified")
+        
+        try:
+            policy = RetryPolicy(max_attempts=3, base_delay=0)
+            inner = FlakyModel([TimeoutError("slow"), TimeoutError("slow")])
+            reply = RetryingModel(inner, "framer", policy).generate_content("prompt")
+            retried = reply == "reply" and inner.calls == 3
+            
+            inner = FlakyModel([TimeoutError("slow")] * 3)
+            try:
+                RetryingModel(inner, "framer", policy).generate_content("prompt")
+                exhausted = False
+            except TimeoutError:
+                exhausted = inner.calls == 3
+            
+            inner = FlakyModel([ValueError("400 Bad Request")])
+            try:
+                RetryingModel(inner, "framer", policy).generate_content("prompt")
+                permanent = False
+            except ValueError:
+                permanent = inner.calls == 1
+            self.log_test("Retry: Transient errors are retried up to max_attempts, permanent ones not at all",
+                         retried and exhausted and permanent,
+                         f"retried: {retried}, exhausted: {exhausted}, permanent: {permanent}")
+        except Exception as e:
+            self.log_test("Retry: Transient errors are retried up to max_attempts, permanent ones not at all", False, repr(e))
+        
+        try:
+            clock = FakeClock()
+            breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, max_reset_timeout=15,
+                                     probe_timeout=5, clock=clock)
+            breaker.record_failure()
+            breaker.record_failure()
+            opened = breaker.state == "open"
+            clock.sleep(10)
+            probe_wait = breaker.before_call()  # Past reset_timeout: this caller probes
+            probing = breaker.state == "half_open"
+            breaker.record_failure()  # The probe failed: reopen for twice as long, capped
+            reopened = breaker.state == "open" and breaker.reset_timeout == 15
+            clock.sleep(15)
+            breaker.before_call()
+            clock.sleep(5)  # The probe never reports back
+            takeover_wait = breaker.before_call()
+            took_over = breaker.state == "half_open" and breaker.probe_started == clock()
+            breaker.record_success()
+            closed = breaker.state == "closed" and breaker.reset_timeout == 10
+            self.log_test("Retry: The circuit breaker opens, probes, backs off and closes",
+                         opened and probing and reopened and took_over and closed
+                         and probe_wait == 0.0 and takeover_wait == 0.0,
+                         f"opened: {opened}, probing: {probing}, reopened: {reopened}, "
+                         f"stalled probe taken over: {took_over}, closed: {closed}")
+        except Exception as e:
+            self.log_test("Retry: The circuit breaker opens, probes, backs off and closes", False, repr(e))
+        
+        try:
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, probe_timeout=0.05)
+            breaker.record_failure()
+            breaker.before_call()  # The probe, which never reports back
+            waiter = threading.Thread(target=breaker.before_call, daemon=True)
+            waiter.start()
+            waiter.join(5)
+            self.log_test("Retry: Callers stop waiting on a probe after probe_timeout", not waiter.is_alive(),
+                         f"state: {breaker.state}")
+        except Exception as e:
+            self.log_test("Retry: Callers stop waiting on a probe after probe_timeout", False, repr(e))
+        
+        try:
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0, probe_timeout=60)
+            breaker.record_failure()
+            breaker.before_call()  # The one probe
+            waiter = threading.Thread(target=breaker.before_call, daemon=True)
+            waiter.start()
+            waiter.join(0.2)
+            held = waiter.is_alive()  # A second caller waits for the probe's verdict
+            breaker.record_success()
+            waiter.join(5)
+            self.log_test("Retry: Only one probe goes through; its success releases the rest",
+                         held and not waiter.is_alive() and breaker.state == "closed",
+                         f"held: {held}, state: {breaker.state}")
+        except Exception as e:
+            self.log_test("Retry: Only one probe goes through; its success releases the rest", False, repr(e))
+        
+        try:
+            clock = FakeClock()
+            breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, max_failed_probes=3, clock=clock)
+            breaker.record_failure()
+            for _ in range(3):
+                clock.sleep(breaker.reset_timeout)
+                breaker.before_call()
+                breaker.record_failure()
+            try:
+                breaker.before_call()
+                gave_up = False
+            except ProviderUnavailableError:
+                gave_up = breaker.state == "unavailable" and not is_transient(ProviderUnavailableError("unavailable"))
+            self.log_test("Retry: The breaker gives up after max_failed_probes failed probes", gave_up,
+                         f"state: {breaker.state}, {breaker.failed_probes} failed probes")
+        except Exception as e:
+            self.log_test("Retry: The breaker gives up after max_failed_probes failed probes", False, repr(e))
+        
+        try:
+            backend = FakeBackend(seed=7, error_rate=1.0)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_outage"),
+                                               model_factory=backend.model_for,
+                                               retry_policy=RetryPolicy(base_delay=0.001),
+                                               circuit_breaker=CircuitBreaker(failure_threshold=3, reset_timeout=0.01,
+                                                                              max_failed_probes=3))
+            generator.generate("Perimeter", "Class 6", target_question_count=5)
+            self.log_test("Retry: A persistent outage fails the run", False, "No error raised")
+        except ProviderUnavailableError as e:
+            self.log_test("Retry: A persistent outage fails the run", backend.stats["errors"] == 6,
+                         f"{e}, {backend.stats['errors']} calls failed")
+        except Exception as e:
+            self.log_test("Retry: A persistent outage fails the run", False, repr(e))
+    
+    def test_timeouts(self):
+        """Test that TimeoutModel times a call from when it runs, frees the slot of a hung call and times stream bodies."""
+        print("\n" + "="*60)
+        print("TESTING Timeouts")
+        print("="*60)
+        
+        class SlowModel:
+            def __init__(self, seconds, release=None):
+                self.seconds = seconds
+                self.release = release
+            
+            def generate_content(self, prompt, **kwargs):
+                if self.release is not None and prompt == "hang":
+                    self.release.wait()
+                time.sleep(self.seconds)
+                return SimpleNamespace(text=prompt)
+        
+        try:
+            # One worker: the second call queues behind the first for longer than the timeout
+            model = TimeoutModel(SlowModel(0.15), timeout=0.4, pool=_CallPool(max_workers=1))
+            replies, errors = [], []
+            
+            def call(prompt):
+                try:
+                    replies.append(model.generate_content(prompt).text)
+                except TimeoutError as e:
+                    errors.append(e)
+            
+            threads = [threading.Thread(target=call, args=(f"p{i}",)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.log_test("Timeouts: Time queued for a worker does not count", sorted(replies) == ["p0", "p1", "p2", "p3"]
+                         and not errors, f"{len(replies)} replies, {len(errors)} timeouts")
+        except Exception as e:
+            self.log_test("Timeouts: Time queued for a worker does not count", False, repr(e))
+        
+        release = threading.Event()
+        try:
+            pool = _CallPool(max_workers=1)
+            model = TimeoutModel(SlowModel(0.0, release), timeout=0.1, pool=pool)
+            try:
+                model.generate_content("hang")
+                timed_out = False
+            except TimeoutError:
+                timed_out = True
+            started = time.monotonic()
+            reply = model.generate_content("next").text
+            self.log_test("Timeouts: A hung call times out and gives up its worker",
+                         timed_out and reply == "next" and time.monotonic() - started < 0.1,
+                         f"timed out: {timed_out}, next call took {time.monotonic() - started:.3f}s")
+            release.set()
+            deadline = time.monotonic() + 5
+            while pool._workers > 1 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            self.log_test("Timeouts: The pool shrinks back once the hung call returns",
+                         pool._workers == 1 and pool._retiring == 0, f"{pool._workers} workers")
+        except Exception as e:
+            self.log_test("Timeouts: A hung call times out and gives up its worker", False, repr(e))
+        finally:
+            release.set()
+        
+        class StallingStream:
+            def __init__(self, stall):
+                self.stall = stall
+                self.closed = False
+            
+            def __iter__(self):
+                yield SimpleNamespace(text="{")
+                self.stall.wait()
+                yield SimpleNamespace(text="}")
+            
+            def close(self):
+                self.closed = True
+        
+        stall = threading.Event()
+        try:
+            stream = StallingStream(stall)
+            inner = SimpleNamespace(generate_content=lambda prompt, **kwargs: stream)
+            client = LLMClient(TimeoutModel(inner, timeout=0.1, pool=_CallPool(max_workers=2)), "research")
+            chunks = []
+            try:
+                for chunk in client.generate_stream("ideas"):
+                    chunks.append(chunk)
+                stalled = False
+            except TimeoutError:
+                stalled = True
+            self.log_test("Timeouts: A stream that stalls part-way times out and is closed",
+                         stalled and chunks == ["{"] and stream.closed, f"chunks: {chunks}, closed: {stream.closed}")
+        except Exception as e:
+            self.log_test("Timeouts: A stream that stalls part-way times out and is closed", False, repr(e))
+        finally:
+            stall.set()
+    
+    def test_tracing(self):
+        """Test that a traced run writes a valid Chrome trace with each job's stage spans nested in its question span."""
+        print("\n" + "="*60)
+        print("TESTING Tracing")
+        print("="*60)
+        
+        output_dir = self.output_dir / "fake_pipeline_traced"
+        output_dir.mkdir(parents=True, exist_ok=True)
+        for suffix in ("json", "jsonl"):
+            trace_path = output_dir / f"trace.{suffix}"
+            tracer = Tracer(str(trace_path))
+            set_tracer(tracer)
+            try:
+                backend = FakeBackend(seed=5, rejection_rate=0.3, diagram_rate=1.0)
+                generator = QuestionPaperGenerator(output_dir=str(output_dir / suffix), model_factory=backend.model_for)
+                asyncio.run(generator.generate_async("Perimeter", "Class 6", 6, concurrency=3))
+            finally:
+                set_tracer(None)
+                tracer.close()
+            
+            name = f"Tracing: A .{suffix} trace parses and nests each job's stages"
+            try:
+                text = trace_path.read_text(encoding="utf-8")
+                events = json.loads(text) if suffix == "json" else [json.loads(line) for line in text.splitlines()]
+                spans = [e for e in events if e["ph"] == "X"]
+                questions = {e["args"]["question_id"]: e for e in spans if e["name"] == "question"}
+                stages = [e for e in spans if e["name"] in ("frame_attempt", "validate_attempt", "diagram")]
+                
+                def nested(event):
+                    # A stage span runs on its question's thread, inside the question span (ts/dur are rounded)
+                    parent = questions.get(event["args"]["question_id"])
+                    return (parent is not None and event["tid"] == parent["tid"] and event["ts"] >= parent["ts"]
+                            and event["ts"] + event["dur"] <= parent["ts"] + parent["dur"] + 1)
+                
+                misplaced = [f"{e['name']} {e['args']['question_id']}" for e in stages if not nested(e)]
+                accepted = [q["question_id"] for q in generator.validated_questions]
+                stage_names = {(e["name"], e["args"]["question_id"]) for e in stages}
+                complete = all(("frame_attempt", qid) in stage_names and ("validate_attempt", qid) in stage_names
+                               and ("diagram", qid) in stage_names for qid in accepted)
+                metadata = {e["name"] for e in events if e["ph"] == "M"}
+                self.log_test(name, set(accepted) <= set(questions) and complete and not misplaced
+                              and {"process_name", "thread_name"} <= metadata
+                              and len({e["tid"] for e in questions.values()}) > 1,
+                              f"{len(events)} events, {len(questions)} question spans, misplaced: {misplaced[:3]}")
+            except Exception as e:
+                self.log_test(name, False, repr(e))
+    
+    def test_usage_accounting(self):
+        """Test that token usage is attributed to the right agent and question across threads and tasks."""
+        print("\n" + "="*60)
+        print("TESTING Usage Accounting")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=9)
+            ledger = UsageLedger()
+            clients = {agent_name: LLMClient(MeteredModel(backend.model_for(agent_name), ledger, agent_name), agent_name)
+                       for agent_name in ("framer", "validator")}
+            expected_agents = {agent_name: [0, 0] for agent_name in clients}
+            expected_questions = {}
+            expected_lock = threading.Lock()
+            
+            def tally(agent_name, question_id, response):
+                usage = response.usage_metadata
+                with expected_lock:
+                    for bucket in (expected_agents[agent_name], expected_questions.setdefault(question_id, [0, 0])):
+                        bucket[0] += 1
+                        bucket[1] += usage.total_token_count
+            
+            def thread_job(question_id):
+                with question_scope(question_id):
+                    for agent_name, client in clients.items():
+                        tally(agent_name, question_id, client.generate(f"Idea: {question_id} for {agent_name}"))
+            
+            async def task_job(question_id):
+                with question_scope(question_id):
+                    for agent_name, client in clients.items():
+                        tally(agent_name, question_id, await client.agenerate(f"Idea: {question_id} for {agent_name}"))
+            
+            async def run_tasks():
+                await asyncio.gather(*(task_job(f"T{i}") for i in range(1, 5)))
+            
+            threads = [threading.Thread(target=thread_job, args=(f"Q{i}",)) for i in range(1, 5)]
+            for thread in threads:
+                thread.start()
+            asyncio.run(run_tasks())
+            for thread in threads:
+                thread.join()
+            
+            summary = ledger.summary()
+            by_agent = {agent_name: [bucket["calls"], bucket["total_tokens"]] for agent_name, bucket in summary["by_agent"].items()}
+            by_question = {qid: [bucket["calls"], bucket["total_tokens"]] for qid, bucket in summary["by_question"].items()}
+            self.log_test("Usage Accounting: Calls from threads and tasks count for their agent and question",
+                         by_agent == expected_agents and by_question == expected_questions and "run" not in by_question,
+                         f"by agent: {by_agent}, {len(by_question)} questions")
+        except Exception as e:
+            self.log_test("Usage Accounting: Calls from threads and tasks count for their agent and question", False, repr(e))
+        
+        try:
+            backend = FakeBackend(seed=9, rejection_rate=0.3)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_usage"),
+                                               model_factory=backend.model_for,
+                                               usage_ledger=UsageLedger(input_price_per_million=0.1, output_price_per_million=0.4))
+            result = asyncio.run(generator.generate_async("Perimeter", "Class 6", 6, concurrency=3))
+            with open(result["question_data"], encoding="utf-8") as f:
+                usage = json.load(f)["usage"]
+            calls = {agent_name: bucket["calls"] for agent_name, bucket in usage["by_agent"].items()}
+            accepted = [q["question_id"] for q in generator.validated_questions]
+            question_calls = sum(bucket["calls"] for bucket in usage["by_question"].values())
+            self.log_test("Usage Accounting: The result JSON carries the run's usage",
+                         calls == backend.stats["calls"] and usage["total"]["calls"] == backend.total_calls()
+                         and question_calls == usage["total"]["calls"] and usage["total"]["total_tokens"] > 0
+                         and set(accepted) <= set(usage["by_question"]) and usage["by_question"]["run"]["calls"] > 0
+                         and usage["estimated_cost_usd"] > 0 and "estimated_cost_usd" in usage["per_accepted_question"],
+                         f"calls by agent: {calls}, {usage['total']['total_tokens']} tokens, "
+                         f"~${usage.get('estimated_cost_usd', 0):.6f}")
+        except Exception as e:
+            self.log_test("Usage Accounting: The result JSON carries the run's usage", False, repr(e))
+    
+    def test_metrics_format(self):
+        """Test the Prometheus text format: HELP/TYPE lines, label escaping and histogram series."""
+        print("\n" + "="*60)
+        print("TESTING Metrics Format")
+        print("="*60)
+        
+        try:
+            registry = MetricsRegistry()
+            registry.counter("qpg_test_plain_total", "A counter\nwith a \\ in its help.")
+            labelled = registry.counter("qpg_test_labelled_total", "A labelled counter.", ["agent"])
+            latency = registry.histogram("qpg_test_seconds", "A histogram.", ["agent"], buckets=(0.1, 1.0))
+            labelled.inc(agent='say "hi"\\\n')
+            labelled.inc(1234567, agent="framer")
+            for value in (0.05, 0.5, 2.0):
+                latency.observe(value, agent="validator")
+            
+            expected = "\n".join([
+                "# HELP qpg_test_plain_total A counter\\nwith a \\\\ in its help.",
+                "# TYPE qpg_test_plain_total counter",
+                "qpg_test_plain_total 0",
+                "# HELP qpg_test_labelled_total A labelled counter.",
+                "# TYPE qpg_test_labelled_total counter",
+                'qpg_test_labelled_total{agent="framer"} 1234567',
+                'qpg_test_labelled_total{agent="say \\"hi\\"\\\\\\n"} 1',
+                "# HELP qpg_test_seconds A histogram.",
+                "# TYPE qpg_test_seconds histogram",
+                'qpg_test_seconds_bucket{agent="validator",le="0.1"} 1',
+                'qpg_test_seconds_bucket{agent="validator",le="1"} 2',
+                'qpg_test_seconds_bucket{agent="validator",le="+Inf"} 3',
+                'qpg_test_seconds_sum{agent="validator"} 2.55',
+                'qpg_test_seconds_count{agent="validator"} 3',
+            ]) + "\n"
+            rendered = registry.render()
+            self.log_test("Metrics Format: Counters and histograms render as Prometheus text", rendered == expected,
+                         rendered if rendered != expected else f"{len(rendered.splitlines())} lines")
+        except Exception as e:
+            self.log_test("Metrics Format: Counters and histograms render as Prometheus text", False, repr(e))
+        
+        try:
+            # Every line of the live registry is a HELP/TYPE comment or a sample with a numeric value
+            sample = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\]|\\.)*",?)*\})? \S+$')
+            lines = REGISTRY.render().splitlines()
+            bad = [line for line in lines if not (line.startswith(("# HELP ", "# TYPE ")) or
+                                                   (sample.match(line) and float(line.rsplit(" ", 1)[1]) >= 0))]
+            typed = {line.split()[2] for line in lines if line.startswith("# TYPE ")}
+            helped = {line.split()[2] for line in lines if line.startswith("# HELP ")}
+            self.log_test("Metrics Format: Every pipeline metric renders well-formed lines",
+                         not bad and typed == helped and len(typed) >= 10, f"{len(typed)} metrics, bad lines: {bad[:3]}")
+        except Exception as e:
+            self.log_test("Metrics Format: Every pipeline metric renders well-formed lines", False, repr(e))
+    
+    def test_fake_backend_pipeline(self):
+        """Test the full pipeline offline against the fake backend, with rejected questions reframed."""
+        print("\n" + "="*60)
+        print("TESTING Full Pipeline: Fake Backend")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=7, rejection_rate=0.3)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline"),
+                                               model_factory=backend.model_for)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=10)
+            ids = [q.get("question_id") for q in generator.validated_questions]
+            calls = backend.stats["calls"]
+            # Every rejection costs one more framed and validated question
+            self.log_test("Fake Backend: Generate 10 questions",
+                         result.get("total_questions") == 10 and len(set(ids)) == 10
+                         and backend.stats["rejections"] > 0
+                         and calls.get("validator", 0) >= 10 + backend.stats["rejections"],
+                         f"{backend.stats['rejections']} rejections, {calls.get('validator', 0)} validator calls")
+        except Exception as e:
+            self.log_test("Fake Backend: Generate 10 questions", False, str(e))
+    
+    def test_resume(self):
+        """Test that a crashed run resumes from its journal without framing any question again."""
+        print("\n" + "="*60)
+        print("TESTING Resume")
+        print("="*60)
+        
+        class Crash(Exception):
+            pass
+        
+        class CrashingGenerator(QuestionPaperGenerator):
+            """Dies after a question is diagrammed but before the fifth one is accepted."""
+            def _accept_question(self, question, target_question_count):
+                if len(self.validated_questions) == 4:
+                    raise Crash()
+                super()._accept_question(question, target_question_count)
+        
+        def framed_ids(calls):
+            return [re.search(r"Question ID: (\S+)", prompt).group(1)
+                    for agent_name, prompt, _, _ in calls if agent_name == "framer"]
+        
+        output_dir = str(self.output_dir / "fake_pipeline_resume")
+        try:
+            backend = FakeBackend(seed=7)
+            calls = self._record_calls(backend)
+            generator = CrashingGenerator(output_dir=output_dir, model_factory=backend.model_for)
+            try:
+                generator.generate("Perimeter", "Class 6", target_question_count=10)
+            except Crash:
+                for pool in generator.idea_pools.values():
+                    pool.close()
+                generator.journal.close()
+            before = framed_ids(calls)
+            
+            backend = FakeBackend(seed=7)
+            calls = self._record_calls(backend)
+            generator = QuestionPaperGenerator(output_dir=output_dir, model_factory=backend.model_for)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=10, resume=True)
+            after = framed_ids(calls)
+            ids = [q.get("question_id") for q in generator.validated_questions]
+            self.log_test("Resume: A crashed run finishes without framing a question twice",
+                         len(before) == 5 and result.get("total_questions") == 10 and len(set(ids)) == 10
+                         and not set(before) & set(after) and len(after) == 5,
+                         f"{len(before)} framed before the crash, {len(after)} after it")
+        except Exception as e:
+            self.log_test("Resume: A crashed run finishes without framing a question twice", False, repr(e))
+    
+    def test_batch(self):
+        """Test manifest loading, per-job failure isolation and the batch summary file."""
+        print("\n" + "="*60)
+        print("TESTING Batch Mode")
+        print("="*60)
+        
+        batch_dir = self.output_dir / "batch"
+        if batch_dir.exists():
+            shutil.rmtree(batch_dir)
+        batch_dir.mkdir()
+        manifest_path = batch_dir / "manifest.jsonl"
+        manifest_path.write_text("\n".join([
+            '{"topic": "Perimeter", "class_level": "Class 6", "count": 4, "fake_llm": {"seed": 1}}',
+            '{"job_id": "fractions", "topic": "Fractions", "class_level": "Class 6", "count": 3, "fake_llm": {"seed": 2}}',
+            '# A comment',
+            '{"job_id": "fractions", "topic": "Ratio", "class_level": "Class 7", "count": 3, "fake_llm": {"seed": 2}}',
+            '{"topic": "Ratio", "class_level": "Class 7", "fake_llm": {"no_such_setting": 1}}',
+            '{"topic": "Area", "class_level": "Class 6", "count": 3, "fake_llm": {"seed": 3, "error_rate": 1.0}}',
+            '{"topic": "Symmetry"}',
+            'not json',
+        ]) + "\n", encoding="utf-8")
+        
+        try:
+            jobs = load_manifest(str(manifest_path))
+            ids = [job["job_id"] for job in jobs]
+            errors = {job["job_id"]: job.get("error", "") for job in jobs}
+            self.log_test("Batch: The manifest gives every job a unique id and flags bad lines",
+                         len(set(ids)) == len(ids) == 7 and ids[0] == "001_perimeter_class_6"
+                         and "already used by line 2" in errors["fractions_line4"]
+                         and "'topic' and 'class_level'" in errors[ids[5]] and "invalid JSON" in errors[ids[6]]
+                         and not errors["fractions"],
+                         f"{ids}")
+        except Exception as e:
+            self.log_test("Batch: The manifest gives every job a unique id and flags bad lines", False, repr(e))
+        
+        try:
+            # A job against a dead endpoint must fail fast with the forwarded breaker settings
+            llm_settings = {"max_retries": 1, "retry_base_delay": 0.001, "breaker_threshold": 2,
+                            "breaker_reset": 0.01, "breaker_max_probes": 2}
+            summary = run_batch(str(manifest_path), str(batch_dir / "out"), processes=2, llm_settings=llm_settings)
+            written = json.loads(Path(summary["summary_file"]).read_text(encoding="utf-8"))
+            status = {job["job_id"]: job["status"] for job in written["jobs"]}
+            errors = {job["job_id"]: job.get("error", "") for job in written["jobs"]}
+            self.log_test("Batch: Failing jobs don't stop the others",
+                         status["001_perimeter_class_6"] == "ok" and status["fractions"] == "ok"
+                         and (batch_dir / "out" / "fractions" / "fractions_class_6.tex").exists()
+                         and errors["004_ratio_class_7"].startswith("TypeError")
+                         and errors["005_area_class_6"].startswith("ProviderUnavailableError"),
+                         f"{status}")
+            self.log_test("Batch: The summary file counts every job",
+                         (written["total_jobs"], written["succeeded"], written["partial"], written["failed"]) == (7, 2, 0, 5)
+                         and [job["job_id"] for job in written["jobs"]] == sorted(status),
+                         f"{written['succeeded']} ok, {written['failed']} failed of {written['total_jobs']}")
+        except Exception as e:
+            self.log_test("Batch: Failing jobs don't stop the others", False, repr(e))
+    
+    def test_injected_errors(self):
+        """Test that transient errors and malformed replies are retried instead of losing questions."""
+        print("\n" + "="*60)
+        print("TESTING Injected Errors")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=7, error_rate=0.1, malformed_rate=0.2)
+            # Injected errors are retried by the retry layer; keep its backoff short here
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_faulty"),
+                                               model_factory=backend.model_for,
+                                               retry_policy=RetryPolicy(base_delay=0.01))
+            result = generator.generate("Perimeter", "Class 6", target_question_count=10)
+            self.log_test("Injected Errors: The run still fills the paper",
+                         result.get("total_questions") == 10
+                         and backend.stats["errors"] > 0 and backend.stats["malformed"] > 0,
+                         f"Errors: {backend.stats['errors']}, malformed: {backend.stats['malformed']}")
+        except Exception as e:
+            self.log_test("Injected Errors: The run still fills the paper", False, str(e))
+    
+    def test_streamed_research(self):
+        """Test that streamed research replies feed the idea pool."""
+        print("\n" + "="*60)
+        print("TESTING Streamed Research")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=11)
+            calls = self._record_calls(backend)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_stream_research"),
+                                               model_factory=backend.model_for, stream_research=True)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=10)
+            research = [stream for agent_name, _, _, stream in calls if agent_name == "research"]
+            self.log_test("Streamed Research: Research calls stream into the loop",
+                         result.get("total_questions") == 10 and research and all(research)
+                         and len(generator.idea_pools['Perimeter']) > 0,
+                         f"{len(research)} research calls, {len(generator.idea_pools['Perimeter'])} ideas streamed")
+        except Exception as e:
+            self.log_test("Streamed Research: Research calls stream into the loop", False, str(e))
+    
+    def test_streamed_validation(self):
+        """Test stream_json's early stop and the streamed validator's accept and reject paths."""
+        print("\n" + "="*60)
+        print("TESTING Streamed Validation")
+        print("="*60)
+        
+        def recording_streams(backend):
+            streams = []
+            respond = backend.respond
+            
+            def recording_respond(agent_name, prompt, structured=False, stream=False):
+                response = respond(agent_name, prompt, structured=structured, stream=stream)
+                streams.append(response)
+                return response
+            
+            backend.respond = recording_respond
+            return streams
+        
+        question = {
+            "question_id": "Q01",
+            "question_text": "A square has sides $4$ cm. What is its perimeter?",
+            "options": ["$8$ cm", "$12$ cm", "$16$ cm", "$20$ cm"],
+            "correct_option": "C",
+            "difficulty": "basic"
+        }
+        
+        try:
+            backend = FakeBackend(seed=3, rejection_rate=0.0, stream_chunk_chars=8)
+            streams = recording_streams(backend)
+            client = LLMClient(backend.model_for("validator"), "validator")
+            partial, stopped_early = client.stream_json("Validate this MCQ question:",
+                                                        lambda partial: "is_valid" in partial)
+            full, read_through = client.stream_json("Validate this MCQ question:", lambda partial: False)
+            self.log_test("Streamed Validation: stream_json stops reading once stop_when holds",
+                         stopped_early and partial == {"is_valid": True} and streams[0]._closed
+                         and len(streams[0]._sent) < len(streams[0]._chunks)
+                         and not read_through and full == json.loads("".join(streams[1]._chunks)),
+                         f"{len(streams[0]._sent)}/{len(streams[0]._chunks)} chunks read before stopping")
+        except Exception as e:
+            self.log_test("Streamed Validation: stream_json stops reading once stop_when holds", False, repr(e))
+        
+        try:
+            backend = FakeBackend(seed=3, rejection_rate=0.0, stream_chunk_chars=8)
+            streams = recording_streams(backend)
+            early_accepts = VALIDATION_EARLY_ACCEPTS._values.get((), 0.0)
+            is_valid, feedback, corrected = ValidatorAgent(backend.model_for("validator"), stream=True).validate(
+                question, "Perimeter", "Class 6")
+            stream = streams[0]
+            self.log_test("Streamed Validation: An accepting verdict stops the stream early",
+                         is_valid and corrected is None and stream._closed and len(stream._sent) < len(stream._chunks)
+                         and VALIDATION_EARLY_ACCEPTS._values.get((), 0.0) == early_accepts + 1,
+                         f"{len(stream._sent)}/{len(stream._chunks)} chunks read: {feedback[:50]}")
+        except Exception as e:
+            self.log_test("Streamed Validation: An accepting verdict stops the stream early", False, repr(e))
+        
+        try:
+            backend = FakeBackend(seed=3, rejection_rate=1.0, correction_rate=1.0, stream_chunk_chars=8)
+            streams = recording_streams(backend)
+            is_valid, feedback, corrected = ValidatorAgent(backend.model_for("validator"), stream=True).validate(
+                question, "Perimeter", "Class 6")
+            stream = streams[0]
+            # A rejection is read to the end: its feedback and corrections follow the verdict
+            self.log_test("Streamed Validation: A rejecting verdict is read through for its corrections",
+                         not is_valid and corrected is not None and "correct_option" in corrected
+                         and feedback and len(stream._sent) == len(stream._chunks),
+                         f"{len(stream._sent)}/{len(stream._chunks)} chunks read, corrected: {corrected and corrected['correct_option']}")
+        except Exception as e:
+            self.log_test("Streamed Validation: A rejecting verdict is read through for its corrections", False, repr(e))
+        
+        class FakeCall:
+            def __init__(self):
+                self.cancelled = False
+            
+            def cancel(self):
+                self.cancelled = True
+        
+        try:
+            call = FakeCall()
+            stream = GeminiStream(SimpleNamespace(_iterator=call))
+            stream.close()
+            self.log_test("Streamed Validation: Closing a Gemini stream cancels its call", call.cancelled,
+                         f"cancelled: {call.cancelled}")
+        except Exception as e:
+            self.log_test("Streamed Validation: Closing a Gemini stream cancels its call", False, repr(e))
+    
+    def test_idea_refill(self):
+        """Test that the idea pool is researched again before any idea is reused."""
+        print("\n" + "="*60)
+        print("TESTING Idea Refill")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=3, rejection_rate=0.3)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_idea_refill"),
+                                               model_factory=backend.model_for)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=60)
+            research_calls = backend.stats["calls"].get("research", 0)
+            # Every attempt got an idea no earlier attempt had used
+            self.log_test("Idea Refill: Ideas are refilled before any is reused",
+                         result.get("total_questions") == 60 and research_calls > 1
+                         and generator.idea_pools['Perimeter'].cursor == generator.iteration,
+                         f"{generator.iteration} attempts, {len(generator.idea_pools['Perimeter'])} ideas, "
+                         f"{research_calls} research calls")
+        except Exception as e:
+            self.log_test("Idea Refill: Ideas are refilled before any is reused", False, str(e))
+    
+    def test_parallel_research(self):
+        """Test that large research needs are split into parallel calls with their own focus."""
+        print("\n" + "="*60)
+        print("TESTING Parallel Research")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=5)
+            calls = self._record_calls(backend)
+            agent = ResearchAgent(backend.model_for("research"))
+            ideas = [idea for batch in agent.research("Perimeter", "Class 6", 100) for idea in batch]
+            prompts = [prompt for _, prompt, _, _ in calls]
+            sets = sorted(i for i in range(1, 4) for prompt in prompts if f"(idea set {i} of 3)" in prompt)
+            requested = sorted(int(prompt.split("Research and collect ")[1].split()[0]) for prompt in prompts)
+            self.log_test("Parallel Research: Large research splits into parallel calls",
+                         len(ideas) == 100 and len(set(ideas)) == 100 and sets == [1, 2, 3]
+                         and requested == [33, 33, 34],
+                         f"{len(ideas)} ideas from {len(calls)} calls asking for {requested}")
+        except Exception as e:
+            self.log_test("Parallel Research: Large research splits into parallel calls", False, str(e))
+        
+        class CrashingResearchAgent(ResearchAgent):
+            def _research_call(self, topic_name, class_level, count, focus, stream):
+                if "idea set 2 of" in focus:
+                    raise RuntimeError("research worker crashed")
+                return super()._research_call(topic_name, class_level, count, focus, stream)
+        
+        try:
+            agent = CrashingResearchAgent(FakeBackend(seed=5).model_for("research"))
+            batches = []
+            reader = threading.Thread(target=lambda: batches.extend(agent.research("Perimeter", "Class 6", 100)),
+                                      daemon=True)
+            reader.start()
+            reader.join(timeout=10)
+            ideas = [idea for batch in batches for idea in batch]
+            self.log_test("Parallel Research: A crashing worker still lets the reader finish",
+                         not reader.is_alive() and len(ideas) == 67, f"{len(ideas)} ideas from the other calls")
+        except Exception as e:
+            self.log_test("Parallel Research: A crashing worker still lets the reader finish", False, repr(e))
+    
+    def test_split_topics(self):
+        """Test that compound topics are researched per subtopic and get equal shares of the paper."""
+        print("\n" + "="*60)
+        print("TESTING Split Topics")
+        print("="*60)
+        
+        subtopics = split_topic("Numbers (1,000 to 10,000), Ratio (a/b); Symmetry")
+        self.log_test("Split Topics: Separators inside brackets don't split",
+                     subtopics == ["Numbers (1,000 to 10,000)", "Ratio (a/b)", "Symmetry"], f"{subtopics}")
+        
+        try:
+            backend = FakeBackend(seed=9, rejection_rate=0.3)
+            calls = self._record_calls(backend)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_split_topics"),
+                                               model_factory=backend.model_for, split_topics=True)
+            result = generator.generate("Congruence of Triangles, AREA AND PERIMETER", "Class 7", target_question_count=11)
+            by_subtopic = {}
+            for question in generator.validated_questions:
+                by_subtopic[question.get("subtopic")] = by_subtopic.get(question.get("subtopic"), 0) + 1
+            researched = {subtopic for subtopic in ("Congruence of Triangles", "AREA AND PERIMETER")
+                          for agent_name, prompt, _, _ in calls
+                          if agent_name == "research" and f'topic: "{subtopic}"' in prompt}
+            self.log_test("Split Topics: Subtopics are researched apart and get equal shares",
+                         result.get("total_questions") == 11 and len(researched) == 2
+                         and by_subtopic == {"Congruence of Triangles": 6, "AREA AND PERIMETER": 5},
+                         f"{by_subtopic}, researched: {sorted(researched)}")
+        except Exception as e:
+            self.log_test("Split Topics: Subtopics are researched apart and get equal shares", False, str(e))
+    
+    def test_idea_dedup(self):
+        """Test that reworded research ideas are dropped before they are framed."""
+        print("\n" + "="*60)
+        print("TESTING Idea Dedup")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=10, duplicate_rate=0.4)
+            calls = self._record_calls(backend)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_idea_dedup"),
+                                               model_factory=backend.model_for)
+            result = generator.generate("Fractions", "Class 7", target_question_count=12)
+            # The fake backend's reworded ideas all start "In a real-life setting"
+            reworded = [prompt for agent_name, prompt, _, _ in calls
+                        if agent_name == "framer" and "Idea: In a real-life setting" in prompt]
+            self.log_test("Idea Dedup: Near-duplicate ideas are never framed",
+                         result.get("total_questions") == 12 and backend.stats["duplicates"] > 0 and not reworded,
+                         f"{backend.stats['duplicates']} reworded ideas researched, {len(reworded)} framed")
+        except Exception as e:
+            self.log_test("Idea Dedup: Near-duplicate ideas are never framed", False, str(e))
+        
+        try:
+            # Ideas sharing most of their words: every one is a candidate for the next, none a duplicate
+            rng = random.Random(1)
+            ideas = [f"perimeter rectangular garden fencing budget {''.join(rng.choices('bcdfghjklmnpqrtvwxz', k=6))}"
+                     for _ in range(61)]
+            limited, unlimited = MinHashIndex(0.8, max_candidates=4), MinHashIndex(0.8, max_candidates=100)
+            for index in (limited, unlimited):
+                for idea in ideas[:-1]:
+                    index.add(idea, check=False)
+            truncated = DEDUP_TRUNCATED_LOOKUPS._values.get((), 0.0)
+            found = limited.find_duplicate(ideas[-1]), unlimited.find_duplicate(ideas[-1])
+            # A cut-short lookup leaves the skipped ideas unchecked; a complete one marks them all checked
+            self.log_test("Idea Dedup: Lookups cut short by max_candidates are counted, not marked checked",
+                         found == (None, None) and limited.truncated_lookups == 1 and unlimited.truncated_lookups == 0
+                         and DEDUP_TRUNCATED_LOOKUPS._values.get((), 0.0) == truncated + 1
+                         and limited._prepared[ideas[-1]][2] == 0 and unlimited._prepared[ideas[-1]][2] == 60,
+                         f"{limited.truncated_lookups} truncated lookups")
+        except Exception as e:
+            self.log_test("Idea Dedup: Lookups cut short by max_candidates are counted, not marked checked", False, repr(e))
+    
+    def test_question_dedup(self):
+        """Test that questions repeating an accepted one are dropped before their diagram is drawn."""
+        print("\n" + "="*60)
+        print("TESTING Question Dedup")
+        print("="*60)
+        
+        try:
+            backend = FakeBackend(seed=11, repeat_question_rate=0.3, diagram_rate=1.0)
+            generator = QuestionPaperGenerator(output_dir=str(self.output_dir / "fake_pipeline_question_dedup"),
+                                               model_factory=backend.model_for)
+            result = generator.generate("Perimeter", "Class 6", target_question_count=12)
+            texts = [q.get("question_text") for q in generator.validated_questions]
+            diagram_calls = backend.stats["calls"].get("diagram", 0)
+            self.log_test("Question Dedup: Repeated questions are skipped before their diagram",
+                         result.get("total_questions") == 12 and len(set(texts)) == 12
+                         and backend.stats["repeated_questions"] > 0 and diagram_calls == 12,
+                         f"{backend.stats['repeated_questions']} repeats framed, {diagram_calls} diagram calls")
+        except Exception as e:
+            self.log_test("Question Dedup: Repeated questions are skipped before their diagram", False, str(e))
+        
+        try:
+            prompts = [f"Question ID: Q{i:02d}\nDifficulty: basic\nIdea: idea {i}" for i in range(1, 25)]
+            in_order = FakeBackend(seed=11, repeat_question_rate=0.5)
+            replies = {prompt: in_order.respond("framer", prompt).text for prompt in prompts}
+            # The same prompts from four threads, newest first: scheduling must not change any reply
+            shuffled = FakeBackend(seed=11, repeat_question_rate=0.5)
+            threaded = {}
+            
+            def frame(chunk):
+                for prompt in chunk:
+                    threaded[prompt] = shuffled.respond("framer", prompt).text
+            
+            workers = [threading.Thread(target=frame, args=(prompts[::-1][i::4],)) for i in range(4)]
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            texts = [json.loads(text)["question_text"] for text in replies.values()]
+            self.log_test("Question Dedup: The fake framer's repeats do not depend on call order",
+                         threaded == replies and len(set(texts)) < len(texts)
+                         and shuffled.stats["repeated_questions"] == in_order.stats["repeated_questions"] > 0,
+                         f"{in_order.stats['repeated_questions']} repeats, {len(set(texts))} distinct of {len(texts)}")
+        except Exception as e:
+            self.log_test("Question Dedup: The fake framer's repeats do not depend on call order", False, repr(e))
+    
+    def test_staged_pipeline(self):
+        """Test that the staged pipeline stops on a failing feeder after finishing the jobs it holds."""
+        print("\n" + "="*60)
+        print("TESTING Staged Pipeline")
+        print("="*60)
+        
+        class BrokenFeedGenerator(QuestionPaperGenerator):
+            def _next_job(self, topic_name, class_level):
+                if self.iteration >= 3:
+                    raise RuntimeError("idea source failed")
+                return super()._next_job(topic_name, class_level)
+        
+        try:
+            backend = FakeBackend(seed=7)
+            generator = BrokenFeedGenerator(output_dir=str(self.output_dir / "fake_pipeline_staged_feed_error"),
+                                            model_factory=backend.model_for)
+            asyncio.run(asyncio.wait_for(generator.generate_staged("Perimeter", "Class 6", 10), timeout=30))
+            self.log_test("Staged Pipeline: A failing feeder stops the run with its error", False, "No error raised")
+        except RuntimeError as e:
+            self.log_test("Staged Pipeline: A failing feeder stops the run with its error",
+                         str(e) == "idea source failed" and len(generator.validated_questions) == 3,
+                         f"{e}, {len(generator.validated_questions)} questions from jobs already in the pipeline")
+        except Exception as e:
+            self.log_test("Staged Pipeline: A failing feeder stops the run with its error", False, repr(e))
+        
+        class FailingStageGenerator(QuestionPaperGenerator):
+            """Raises in the validation stage for Q02 and in the diagram stage for Q04."""
+            def _validate(self, job, question, topic_name, class_level):
+                if job["question_id"] == "Q02":
+                    raise RuntimeError("validator crashed")
+                return super()._validate(job, question, topic_name, class_level)
+            
+            def _add_diagram(self, question, topic_name):
+                if question["question_id"] == "Q04":
+                    raise RuntimeError("renderer crashed")
+                return super()._add_diagram(question, topic_name)
+        
+        try:
+            backend = FakeBackend(seed=7)
+            generator = FailingStageGenerator(output_dir=str(self.output_dir / "fake_pipeline_staged_stage_error"),
+                                              model_factory=backend.model_for)
+            result = asyncio.run(asyncio.wait_for(generator.generate_staged("Perimeter", "Class 6", 8), timeout=30))
+            ids = [q["question_id"] for q in generator.validated_questions]
+            state = RunJournal(generator.journal.path).load()
+            self.log_test("Staged Pipeline: A job whose stage fails is dropped and journaled",
+                         result.get("total_questions") == 8 and "Q02" not in ids and "Q04" not in ids
+                         and state["dropped"] == 2 and not state["pending"] and sum(generator.open_jobs.values()) == 0,
+                         f"{len(ids)} questions, {state['dropped']} dropped, pending: {sorted(state['pending'])}, "
+                         f"open jobs: {dict(generator.open_jobs)}")
+        except Exception as e:
+            self.log_test("Staged Pipeline: A job whose stage fails is dropped and journaled", False, repr(e))
+    
+    def test_async_pipeline(self):
+        """Test the concurrent pipeline: the paper is complete and correct, and a failing worker's job is dropped."""
+        print("\n" + "="*60)
+        print("TESTING Async Pipeline")
+        print("="*60)
+        
+        class FailingWorkerGenerator(QuestionPaperGenerator):
+            """Raises on a worker thread for Q03 and records how many jobs ran at once."""
+            def __init__(self, *args, **kwargs):
+                super().__init__(*args, **kwargs)
+                self.active = 0
+                self.peak = 0
+                self.active_lock = threading.Lock()
+            
+            def _process_job(self, job, topic_name, class_level):
+                with self.active_lock:
+                    self.active += 1
+                    self.peak = max(self.peak, self.active)
+                try:
+                    return super()._process_job(job, topic_name, class_level)
+                finally:
+                    with self.active_lock:
+                        self.active -= 1
+            
+            def _add_diagram(self, question, topic_name):
+                if question["question_id"] == "Q03":
+                    raise RuntimeError("renderer crashed")
+                return super()._add_diagram(question, topic_name)
+        
+        try:
+            backend = FakeBackend(seed=7, rejection_rate=0.3, latency_mean=0.01, latency_distribution="constant")
+            generator = FailingWorkerGenerator(output_dir=str(self.output_dir / "fake_pipeline_async"),
+                                               model_factory=backend.model_for)
+            result = asyncio.run(asyncio.wait_for(generator.generate_async("Perimeter", "Class 6", 8, concurrency=4),
+                                                  timeout=60))
+            ids = [q["question_id"] for q in generator.validated_questions]
+            with open(result["question_data"], encoding="utf-8") as f:
+                data = json.load(f)
+            well_formed = all(len(q.get("options", [])) == 4 and q.get("correct_option") in ("A", "B", "C", "D")
+                              for q in data["questions"])
+            self.log_test("Async Pipeline: Generate 8 questions with 4 in flight",
+                         result.get("total_questions") == 8 and len(set(ids)) == 8 and generator.peak > 1
+                         and data["total_questions"] == 8 and well_formed
+                         and [qid for qid, _ in data["answer_key"]] == ids,
+                         f"{len(set(ids))} unique questions, peak {generator.peak} jobs in flight, "
+                         f"well formed: {well_formed}")
+            
+            state = RunJournal(generator.journal.path).load()
+            self.log_test("Async Pipeline: A job whose worker fails is dropped and journaled",
+                         "Q03" not in ids and state["dropped"] == 1 and not state["pending"]
+                         and sum(generator.open_jobs.values()) == 0,
+                         f"{state['dropped']} dropped, pending: {sorted(state['pending'])}, "
+                         f"open jobs: {dict(generator.open_jobs)}")
+        except Exception as e:
+            self.log_test("Async Pipeline: Generate 8 questions with 4 in flight", False, repr(e))
+    
     def run_all_tests(self):
         """Run all test suites."""
         print("\n" + "="*60)
@@ -552,6 +1942,31 @@ class TestRunner:
         self.test_full_pipeline_25_questions()
         self.test_full_pipeline_30_questions()
         self.test_corner_cases()
+        self.test_cassette_record_replay()
+        self.test_json_repair()
+        self.test_structured_output()
+        self.test_idea_pool()
+        self.test_response_cache()
+        self.test_coalescing()
+        self.test_rate_limiter()
+        self.test_retry()
+        self.test_timeouts()
+        self.test_tracing()
+        self.test_usage_accounting()
+        self.test_metrics_format()
+        self.test_fake_backend_pipeline()
+        self.test_resume()
+        self.test_batch()
+        self.test_injected_errors()
+        self.test_streamed_research()
+        self.test_streamed_validation()
+        self.test_idea_refill()
+        self.test_parallel_research()
+        self.test_split_topics()
+        self.test_idea_dedup()
+        self.test_question_dedup()
+        self.test_staged_pipeline()
+        self.test_async_pipeline()
         
         # Print summary
         self.print_summary()